@@ -1,73 +1,178 @@
 from datetime import time
-from flask import Flask, request, jsonify
+from functools import partial
+from flask import (Blueprint, Flask, Response, current_app, request, jsonify,
+                   g, stream_with_context)
+from flask.json import dumps as json_dumps
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import ImmutableMultiDict
-from flask_debugtoolbar import DebugToolbarExtension
 from flask_cors import CORS, cross_origin
 import json
+import os
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 # from flask_json_schema import JsonSchema, JsonValidationError
-from models import Listing_Photo, db, connect_db, User, Listing, Booking, Message
-from project_secrets import SECRET_KEY
-from aws import upload_file_s3
+from models import (Listing_Photo, db, connect_db, User, Listing, Booking,
+                    Message, ConversationSummary, PriceRule)
+from pricing import quote_listings
+from upload_queue import upload_queue
+from images import image_pipeline
+from passwords import password_hasher
+from auth import token_auth, login_required, InvalidToken
+from broker import message_broker
+import queue
+import aws
+import uuid
+from query_budget import query_budget
+from instrumentation import instrumentation
+from routing import (db_routing, engine_options, read_only,
+                     replica_binds)
+import migrate
+from conditional import conditional_get
+from availability import availability_index
+from facets import facet_cache, facet_key
+from helpers import (dump_json, encode_cursor, parse_listing_filters,
+                     parse_page_args, parse_photo_size, parse_date_range,
+                     parse_coordinates, parse_radius, parse_facet_buckets,
+                     parse_price, parse_price_rule, parse_quote_request,
+                     parse_bulk_listings, INVALID_INPUT, LISTING_SORTS,
+                     MAX_LISTING_PHOTOS)
 
 
 CURR_USER_KEY = "curr_user"
 DEFAULT_PHOTO = "https://i.pinimg.com/474x/c2/69/cb/c269cb7865fc5fec8adb9c38bb432e9e.jpg"
+# messages.id is an INTEGER
+MAX_MESSAGE_ID = 2 ** 31 - 1
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sharebnb'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SECRET_KEY'] = SECRET_KEY
 
-toolbar = DebugToolbarExtension(app)
+def finish_upload(model, key, url, variants):
+    """upload queue callback: point the pending row at its S3 url (and
+    the urls of any resized variants), or mark it failed if the upload
+    didn't work (url is None)"""
 
-connect_db(app)
-db.create_all()
+    row = model.query.get(key)
+    if row is None:
+        return
+    apply_upload(row, url, variants)
+    db.session.commit()
+
+
+def finish_photo_uploads(photo_ids, results):
+    """upload queue callback for a group of listing photos (see
+    UploadQueue.enqueue_many): update every row in one transaction"""
+
+    photos = {photo.id: photo for photo in
+              Listing_Photo.query.filter(Listing_Photo.id.in_(photo_ids))}
+    for photo_id, (url, variants) in zip(photo_ids, results):
+        if photo_id in photos:
+            apply_upload(photos[photo_id], url, variants)
+    db.session.commit()
+
+
+def apply_upload(row, url, variants):
+    """point a pending row at its S3 url and variant urls, or mark it
+    failed if url is None"""
+
+    row.upload_spool = None
+    if url:
+        row.image_url = url
+        row.upload_status = 'done'
+        for column, variant_url in variants.items():
+            setattr(row, column, variant_url)
+    else:
+        row.upload_status = 'failed'
+
+
+def resume_uploads():
+    """re-enqueue the uploads a restart left pending whose spooled file is
+    still there, mark the others failed and delete spooled files no row
+    is waiting for. returns (resumed, failed) counts
+
+    only run it while no web worker is spooling (see resume-uploads)"""
+
+    resumed = []
+    failed = 0
+    for model, key in ((User, "username"), (Listing_Photo, "id")):
+        for row in model.query.filter_by(upload_status='pending'):
+            spooled = (upload_queue.load(row.upload_spool)
+                       if row.upload_spool else None)
+            if spooled is None:
+                apply_upload(row, None, {})
+                failed += 1
+            else:
+                resumed.append((model, getattr(row, key), spooled))
+    db.session.commit()
+
+    upload_queue.sweep({spooled.name for _, _, spooled in resumed})
+
+    for model, key, spooled in resumed:
+        # profile photos have no variants
+        derive = image_pipeline.derive if model is Listing_Photo else None
+        upload_queue.enqueue(spooled, partial(finish_upload, model, key),
+                             derive=derive)
+    return len(resumed), failed
+
+
+def check_photo(photo):
+    """raises ValueError unless an uploaded file is an allowed image type
+    within the size limit"""
+
+    if photo.mimetype not in aws.ALLOWED_IMAGE_TYPES:
+        raise ValueError(f"photos must be one of {aws.ALLOWED_IMAGE_TYPES}")
+    photo.stream.seek(0, os.SEEK_END)
+    size = photo.stream.tell()
+    photo.stream.seek(0)
+    if size > aws.MAX_UPLOAD_BYTES:
+        raise ValueError(
+            f"photos must be at most {aws.MAX_UPLOAD_BYTES >> 20} MB")
 
 
 ######################################################################
 # User signup/login endpoints
 
-@app.route('/signup', methods=["POST"])
+@api.route('/signup', methods=["POST"])
 @cross_origin()
 def signup():
     """Handle user signup
     Takes signup form data and creates new user in DB
     returns token or error message"""
 
-    output = DEFAULT_PHOTO
-    if "file" not in request.files:
-        print("No file key in request.files")
-
     signup_data = dict(request.form)
     # use schema validator and return error if invalid
 
+    # the photo is uploaded to s3 in the background after signup succeeds,
+    # until then the user has the default photo
+    spooled = None
     if "file" in request.files:
         photo = request.files["file"]
         photo.filename = secure_filename(photo.filename)
-        output = upload_file_s3(photo)
+        spooled = upload_queue.spool(photo)
     try:
         new_user = User.signup(signup_data["username"],
                                signup_data["email"],
                                signup_data["password"],
                                signup_data["bio"],
                                signup_data["location"],
-                               output
+                               DEFAULT_PHOTO
                                )
+        if spooled:
+            new_user.upload_status = 'pending'
+            new_user.upload_spool = spooled.name
         db.session.commit()
-        token = User.get_token(new_user.username)
-        return jsonify({"token": token}), 201
     except IntegrityError:
-        # TODO: figure out how to only keep an image on s3 if signup successful
-        # client.delete_object(Bucket=BUCKET_NAME, Key=output)
+        db.session.rollback()
+        if spooled:
+            upload_queue.discard(spooled)
         return jsonify({'error': 'Same user exists'})
 
+    if spooled:
+        upload_queue.enqueue(spooled,
+                             partial(finish_upload, User, new_user.username))
+    return jsonify(issue_tokens(new_user.username)), 201
+
 
-@app.route('/login', methods=["POST"])
+@api.route('/login', methods=["POST"])
 @cross_origin()
 def login():
     """Handle user login
@@ -78,57 +183,805 @@ def login():
     user = User.authenticate(username,
                              password)
     if user:
-        token = User.get_token(user.username)
-        return jsonify({"token": token}), 201
+        # saves the password if it was rehashed at a new cost
+        db.session.commit()
+        return jsonify(issue_tokens(user.username)), 201
 
     return jsonify({'error': 'Login unsuccessful'})
 
+
+def issue_tokens(username):
+    """access token for requests plus a refresh token to get new ones"""
+
+    return {"token": User.get_token(username),
+            "refresh_token": token_auth.create_token(username, "refresh")}
+
+
+@api.route('/token/refresh', methods=["POST"])
+@cross_origin()
+def refresh_token():
+    """Handle token refresh
+    Takes json {refresh_token}, the old refresh token is revoked
+    returns new tokens or error message"""
+
+    data = request.json if isinstance(request.json, dict) else {}
+    try:
+        claims = token_auth.verify(data.get("refresh_token"), "refresh")
+    except InvalidToken as e:
+        return jsonify({'error': str(e)}), 401
+
+    token_auth.revoke(claims)
+    return jsonify(issue_tokens(claims["username"])), 201
+
+
+@api.route('/logout', methods=["POST"])
+@cross_origin()
+@login_required
+def logout():
+    """Handle logout
+    Revokes the access token and, if given in json {refresh_token}, the
+    refresh token"""
+
+    token_auth.revoke(g.claims)
+
+    data = request.json if isinstance(request.json, dict) else {}
+    refresh = data.get("refresh_token")
+    if refresh:
+        try:
+            token_auth.revoke(token_auth.verify(refresh, "refresh"))
+        except InvalidToken:
+            pass
+
+    return jsonify({'message': 'Logged out'})
+
 ######################################################################
 # Listing Endpoints
 
 
-@app.route('/listings', methods=["GET"])
-# Gets all listings, TODO: add query params
+def stream_json_array(items, chunk_bytes=64 * 1024):
+    """Yield a JSON array of `items` in chunks of about chunk_bytes,
+    encoded the same way as jsonify"""
+
+    chunk = ["["]
+    size = 1
+    for i, item in enumerate(items):
+        encoded = json_dumps(item, separators=(",", ":"))
+        chunk.append("," + encoded if i else encoded)
+        size += len(encoded) + 1
+        if size >= chunk_bytes:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    chunk.append("]\n")
+    yield "".join(chunk)
+
+
+@api.route('/listings', methods=["GET"])
+@read_only
+@query_budget(3)
+@conditional_get('listings')
 def send_listings():
-    """gets all listings from database and returns it"""
-    # max_price = request.args.get('max_price') or 0
-    # location = request.args.get('location')
-    print("what is here?----->", Listing.query.all())
-    listings = Listing.query.all()
+    """gets one page of listings matching the query params and returns it
+
+    filters: min_price, max_price, location, owner
+    paging: sort (id or price), limit, cursor
+    size: photo variant to return (thumb, medium or original)
+    the cursor for the next page is sent in the X-Next-Cursor header
+    listings and their photos are read in one query as plain rows
+    answers 304 if the client's ETag is still current
+
+    stream=1 returns every matching listing instead of a page, written
+    out as it is read from the database"""
+
+    sort = request.args.get('sort', 'id')
+    if sort not in LISTING_SORTS:
+        return jsonify({'error': f'sort must be one of {LISTING_SORTS}'}), 400
+
+    try:
+        filters = parse_listing_filters(request.args)
+        page = parse_page_args(request.args)
+        size = parse_photo_size(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = Listing.filtered(**filters)
+    if request.args.get('stream') in ('1', 'true'):
+        listings = Listing.stream(
+            query.options(selectinload(Listing.photos)), sort=sort)
+        return Response(
+            stream_with_context(stream_json_array(
+                listing.serialize(size) for listing in listings)),
+            mimetype="application/json")
+
+    try:
+        rows, next_cursor = Listing.paginate_keyset(
+            Listing.projected(query, size), sort=sort, **page)
+    except INVALID_INPUT:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    response = current_app.response_class(
+        dump_json([dict(row._mapping) for row in rows]),
+        mimetype="application/json")
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_cursor)
+    return response
+
+
+@api.route('/listings/search', methods=["GET"])
+@read_only
+@query_budget(3)
+@conditional_get('listings')
+def search_listings():
+    """full-text search of listings, best match first
+
+    takes q (search terms), limit, cursor and size query params
+    the cursor for the next page is sent in the X-Next-Cursor header"""
+
+    terms = request.args.get('q', '').strip()
+    if not terms:
+        return jsonify({'error': 'q is required'}), 400
+
+    try:
+        page = parse_page_args(request.args)
+        size = parse_photo_size(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    json_listings = [listing.serialize() for listing in listings]
-    return jsonify(json_listings)
+    try:
+        listings, next_cursor = Listing.search_ranked(terms, **page)
+    except INVALID_INPUT:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    response = jsonify([listing.serialize(size) for listing in listings])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_cursor)
+    return response
+
+
+@api.route('/listings/facets', methods=["GET"])
+@read_only
+@query_budget(2)
+@conditional_get('listings')
+def listing_facets():
+    """price histogram and the most common locations and owners of the
+    listings matching the filters, for the search sidebar
+
+    takes the /listings filters plus buckets (price ranges, default 20)
+    results are cached for a few seconds per filter"""
+
+    try:
+        filters = parse_listing_filters(request.args)
+        buckets = parse_facet_buckets(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    facets = facet_cache.get(
+        facet_key(filters, buckets, g.change_version),
+        lambda: Listing.facets(Listing.filtered(**filters), buckets))
+    return jsonify(facets)
 
-@app.route('/listings/new', methods=["POST"])
+
+@api.route('/listings/available', methods=["GET"])
+@read_only
+@query_budget(3)
+def available_listings():
+    """gets one page of listings with no bookings between start and end
+
+    takes start and end (YYYY-MM-DD, end is the checkout day) plus the
+    same filter, limit, cursor and size query params as /listings.
+    which listings are booked is answered from the in-memory calendar
+    index, the database only loads the page of free listings (or, when
+    too many are booked to list, checks bookings itself)"""
+
+    try:
+        start, end = parse_date_range(request.args)
+        filters = parse_listing_filters(request.args)
+        page = parse_page_args(request.args)
+        size = parse_photo_size(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    booked = availability_index.booked_listings(start, end)
+
+    query = Listing.filtered(**filters)
+    if len(booked) > current_app.config['AVAILABILITY_MAX_EXCLUDED']:
+        # too many ids to send, let the database skip them itself
+        query = Listing.unbooked(query, start, end)
+    elif booked:
+        query = query.filter(Listing.id.notin_(booked))
+    try:
+        rows, next_cursor = Listing.paginate_keyset(
+            Listing.projected(query, size), **page)
+    except INVALID_INPUT:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    response = current_app.response_class(
+        dump_json([dict(row._mapping) for row in rows]),
+        mimetype="application/json")
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_cursor)
+    return response
+
+
+@api.route('/listings/nearby', methods=["GET"])
+@read_only
+@query_budget(2)
+@conditional_get('listings')
+def nearby_listings():
+    """gets one page of listings within radius km of lat, lng, nearest
+    first, each with its distance_km
+
+    takes lat, lng, radius (km, default 10) plus limit, cursor and size
+    query params; the cursor for the next page is sent in the
+    X-Next-Cursor header"""
+
+    try:
+        latitude, longitude = parse_coordinates(request.args)
+        if latitude is None:
+            raise ValueError("lat and lng are required")
+        radius = parse_radius(request.args)
+        page = parse_page_args(request.args)
+        size = parse_photo_size(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        rows, next_cursor = Listing.nearby(latitude, longitude, radius,
+                                           size=size, **page)
+    except INVALID_INPUT:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    listings = []
+    for row in rows:
+        listing = dict(row._mapping)
+        listing["distance_km"] = round(listing["distance_km"], 3)
+        listings.append(listing)
+
+    response = current_app.response_class(dump_json(listings),
+                                          mimetype="application/json")
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_cursor)
+    return response
+
+
+@api.route('/listings/new', methods=["POST"])
 @cross_origin()
 def add_listing():
-    """add a new listing"""
+    """add a new listing
+    takes any number of photo files (up to 20), as repeated photo fields
+    latitude and longitude are optional, listings without them don't show
+    up in /listings/nearby"""
 
     listing_data = dict(request.form)
+    files = request.files.getlist("photo")
+    # everything is checked before any photo is spooled
+    try:
+        missing = [field for field in ("title", "description", "location",
+                                       "username")
+                   if not listing_data.get(field)]
+        if missing:
+            raise ValueError(f"{', '.join(missing)} required")
+        price = parse_price(listing_data.get("price"))
+        latitude, longitude = parse_coordinates(
+            request.form, "latitude", "longitude")
+        if len(files) > MAX_LISTING_PHOTOS:
+            raise ValueError(f"at most {MAX_LISTING_PHOTOS} photos")
+        for photo in files:
+            check_photo(photo)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    output = DEFAULT_PHOTO
+    # the photos are uploaded to s3 in the background, in parallel, until
+    # then the listing shows the default photo
+    spooled = []
+    try:
+        for photo in files:
+            photo.filename = secure_filename(photo.filename)
+            spooled.append(upload_queue.spool(photo))
 
-    if "photo" in request.files:
-        photo = request.files["photo"]
-        photo.filename = secure_filename(photo.filename)
-        output = upload_file_s3(photo)
-    print("listing_data[username]======", listing_data["username"])
-    new_listing = Listing(price=listing_data["price"],
-                          title=listing_data["title"],
-                          description=listing_data["description"],
-                          location=listing_data["location"],
-                          listing_owner=listing_data["username"])
-
-    db.session.add(new_listing)
+        new_listing = Listing(price=price,
+                              title=listing_data["title"],
+                              description=listing_data["description"],
+                              location=listing_data["location"],
+                              listing_owner=listing_data["username"],
+                              latitude=latitude,
+                              longitude=longitude)
+
+        new_photos = [Listing_Photo(image_url=DEFAULT_PHOTO,
+                                    upload_status='pending',
+                                    upload_spool=upload.name)
+                      for upload in spooled] or [
+                          Listing_Photo(image_url=DEFAULT_PHOTO)]
+        new_listing.photos.extend(new_photos)
+        db.session.add(new_listing)
+
+        # one transaction: the flush inserts the listing, then all its
+        # photos in one multi-row statement (ids come back with
+        # RETURNING), the response is built from the flushed objects
+        # before the commit expires them, so nothing is read back
+        db.session.flush()
+        listing_info = new_listing.serialize()
+        photo_ids = [photo.id for photo in new_photos]
+        db.session.commit()
+    except Exception as e:
+        # nothing will ever upload these
+        db.session.rollback()
+        for upload in spooled:
+            upload_queue.discard(upload)
+        if isinstance(e, IntegrityError):
+            return jsonify({'error': 'No such user'}), 400
+        raise
+
+    if spooled:
+        upload_queue.enqueue_many(
+            spooled, partial(finish_photo_uploads, photo_ids),
+            derive=image_pipeline.derive)
+
+    return jsonify(listing_info)
+
+
+@api.route('/listings/bulk', methods=["POST"])
+@cross_origin()
+@login_required
+def add_listings():
+    """add many listings at once for the logged in user, e.g. to onboard a
+    whole portfolio
+    takes json {"listings": [{title, price, description, location,
+    latitude, longitude, photos: [image urls]}]}, see
+    helpers.parse_bulk_listings
+    returns the new listings in the order given; all or none are added"""
+
+    try:
+        listings = parse_bulk_listings(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    created = Listing.create_many(g.username, listings)
     db.session.commit()
+    return jsonify(created), 201
 
-    new_photo = Listing_Photo(listing_id=new_listing.id,
-                              image_url=output)
 
-    db.session.add(new_photo)
+######################################################################
+# Pricing endpoints
+
+
+@api.route('/quotes', methods=["POST"])
+@cross_origin()
+@read_only
+@query_budget(2)
+def send_quotes():
+    """prices every listing for every stay in one request
+
+    takes json {"listing_ids": [1, 2], "stays": [{"start": "2021-11-01",
+    "end": "2021-11-03"}]} (end is the checkout day)
+    returns [{listing_id, quotes: [{start, end, nights, total_price}]}]
+    in the order given, leaving out unknown listings"""
+
+    try:
+        listing_ids, ranges = parse_quote_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(quote_listings(listing_ids, ranges))
+
+
+@api.route('/listings/<int:listing_id>/price-rules', methods=["GET"])
+@read_only
+def send_price_rules(listing_id):
+    """gets the price rules of a listing"""
+
+    listing = Listing.query.get_or_404(listing_id)
+    rules = PriceRule.query.filter_by(listing_id=listing.id) \
+        .order_by(PriceRule.priority.desc(), PriceRule.id.desc())
+    return jsonify([rule.serialize() for rule in rules])
+
+
+@api.route('/listings/<int:listing_id>/price-rules', methods=["POST"])
+@cross_origin()
+@login_required
+def add_price_rule(listing_id):
+    """add a seasonal/weekend price to the logged in user's listing
+    takes json {name, nightly_price, start_date, end_date, weekdays,
+    priority}, see helpers.parse_price_rule"""
+
+    listing = Listing.query.get_or_404(listing_id)
+    if listing.listing_owner != g.username:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    try:
+        rule = PriceRule(listing_id=listing.id,
+                         **parse_price_rule(request.json))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    db.session.add(rule)
+    db.session.commit()
+    return jsonify(rule.serialize()), 201
+
+
+######################################################################
+# Message endpoints
+
+
+def send_page(items, next_cursor):
+    """json array of serialized items, with the next page's cursor in
+    the X-Next-Cursor header"""
+
+    response = jsonify([item.serialize() for item in items])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_cursor)
+    return response
+
+
+@api.route('/messages', methods=["POST"])
+@cross_origin()
+@login_required
+def send_message():
+    """Handle sending a message from the logged in user
+    Takes json {to_user_name, text}
+    returns the new message or error message"""
+
+    data = request.json or {}
+    if not data.get("to_user_name") or not data.get("text"):
+        return jsonify({'error': 'to_user_name and text are required'}), 400
+
+    message = Message(text=data["text"],
+                      to_user_name=data["to_user_name"],
+                      from_user_name=g.username)
+    db.session.add(message)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'No such user'}), 404
+
+    return jsonify(message.serialize()), 201
+
+
+@api.route('/messages/stream', methods=["GET"])
+def stream_messages():
+    """Server-Sent Events stream of new messages to the logged in user
+
+    EventSource can't set headers, so the access token may be passed as
+    the token query param. On reconnect the messages after the
+    Last-Event-ID header (or last_event_id param) are sent first. The
+    stream ends with a "reset" event if the client falls, or was, too far
+    behind; it should then refetch its threads and reconnect."""
+
+    username = g.username
+    if not username:
+        try:
+            username = token_auth.verify(
+                request.args.get("token"))["username"]
+        except InvalidToken:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    last_id = (request.headers.get("Last-Event-ID") or
+               request.args.get("last_event_id"))
+    # isdigit alone passes '²' and other digits int() won't read
+    if last_id is not None and not (last_id.isascii() and
+                                    last_id.isdigit() and
+                                    int(last_id) <= MAX_MESSAGE_ID):
+        return jsonify({'error': 'Last-Event-ID must be a message id'}), 400
+
+    heartbeat = current_app.config['MESSAGE_STREAM_HEARTBEAT']
+    max_missed = current_app.config['MESSAGE_STREAM_QUEUE_SIZE']
+
+    # subscribed while the request (and its app) is current, and before
+    # looking up missed messages so none fall in between; the generator
+    # runs after the request has ended
+    subscription = message_broker.subscribe(username)
+    missed = []
+    if last_id is not None:
+        try:
+            missed = [message.serialize() for message in
+                      Message.since(username, int(last_id), max_missed + 1)]
+        except Exception:
+            message_broker.unsubscribe(subscription)
+            raise
+    replayed = {message["id"] for message in missed}
+
+    def event(message):
+        return (f"id: {message['id']}\nevent: message\n"
+                f"data: {json.dumps(message)}\n\n")
+
+    def events():
+        yield "retry: 3000\n\n"
+        if len(missed) > max_missed:
+            yield "event: reset\ndata: {}\n\n"
+            return
+        for message in missed:
+            yield event(message)
+        while not subscription.overflowed:
+            try:
+                message = subscription.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            # committed while we were looking up the missed ones
+            if message["id"] not in replayed:
+                yield event(message)
+        yield "event: reset\ndata: {}\n\n"
+
+    # release this request's db connection, the stream never needs it
+    db.session.remove()
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"})
+    response.call_on_close(lambda: message_broker.unsubscribe(subscription))
+    return response
+
+
+@api.route('/messages/inbox', methods=["GET"])
+@read_only
+@login_required
+@query_budget(1)
+def send_inbox():
+    """gets one page of messages sent to the logged in user, newest first
+    takes limit and cursor query params"""
+
+    try:
+        page = parse_page_args(request.args)
+        messages, next_cursor = Message.inbox(g.username, **page)
+    except INVALID_INPUT as e:
+        return jsonify({'error': str(e)}), 400
+
+    return send_page(messages, next_cursor)
+
+
+@api.route('/conversations', methods=["GET"])
+@read_only
+@login_required
+@query_budget(1)
+def send_conversations():
+    """gets one page of the logged in user's conversations, most recent
+    first, each with its last message id/time and unread count
+    takes limit and cursor query params"""
+
+    try:
+        page = parse_page_args(request.args)
+        summaries, next_cursor = ConversationSummary.recent(g.username,
+                                                            **page)
+    except INVALID_INPUT as e:
+        return jsonify({'error': str(e)}), 400
+
+    return send_page(summaries, next_cursor)
+
+
+@api.route('/messages/<username>/read', methods=["POST"])
+@cross_origin()
+@login_required
+def mark_read(username):
+    """Mark the conversation with `username` as read
+    returns the updated conversation summary"""
+
+    summary = ConversationSummary.query.get_or_404((g.username, username))
+    summary.unread_count = 0
     db.session.commit()
 
-    listing_info = Listing.query.get(new_listing.id)
+    return jsonify(summary.serialize())
+
+
+@api.route('/messages/<username>', methods=["GET"])
+@read_only
+@login_required
+@query_budget(2)
+def send_thread(username):
+    """gets one page of the conversation between the logged in user and
+    `username`, newest first
+    takes limit and cursor query params"""
+
+    try:
+        page = parse_page_args(request.args)
+        messages, next_cursor = Message.thread(g.username, username, **page)
+    except INVALID_INPUT as e:
+        return jsonify({'error': str(e)}), 400
+
+    return send_page(messages, next_cursor)
+
+
+######################################################################
+# Upload queue endpoints
+
+
+@api.route('/uploads/stats', methods=["GET"])
+def upload_stats():
+    """returns upload queue depth, totals and recent upload latency"""
+
+    return jsonify(upload_queue.stats())
+
+
+@api.route('/uploads/presign', methods=["POST"])
+@cross_origin()
+@login_required
+def presign_upload():
+    """Handle a request to upload a photo straight to s3
+    Takes json {target: "listing" or "user", id, filename, content_type}
+    the listing must be the logged in user's, or the user themselves
+    returns {url, fields, key}: POST the file to url as a multipart form
+    with fields, then confirm the key with the matching photo endpoint"""
+
+    data = request.json or {}
+    target = data.get("target")
+    target_id = str(data.get("id", ""))
+    content_type = data.get("content_type")
+
+    if content_type not in aws.ALLOWED_IMAGE_TYPES:
+        return jsonify({'error': 'Unsupported content type'}), 400
+
+    if target == "listing":
+        listing = (Listing.query.get(int(target_id))
+                   if target_id.isdigit() else None)
+        if not listing:
+            return jsonify({'error': 'No such listing'}), 404
+        if listing.listing_owner != g.username:
+            return jsonify({'error': 'Forbidden'}), 403
+    elif target == "user":
+        if not User.query.get(target_id):
+            return jsonify({'error': 'No such user'}), 404
+        if target_id != g.username:
+            return jsonify({'error': 'Forbidden'}), 403
+    else:
+        return jsonify({'error': 'target must be listing or user'}), 400
+
+    filename = secure_filename(data.get("filename") or "photo")
+    key = f"{upload_prefix(target, target_id)}{uuid.uuid4()}_{filename}"
+    post = aws.presigned_post_s3(key, content_type)
+
+    return jsonify({"url": post["url"], "fields": post["fields"], "key": key})
+
+
+def upload_prefix(target, target_id):
+    """keys for presigned uploads are scoped to what they belong to, so a
+    key can only be confirmed for that listing or user"""
+
+    return f"uploads/{target}s/{target_id}/"
+
+
+def check_uploaded(key, target, target_id):
+    """returns an error message if `key` isn't a finished upload for this
+    target, else None"""
+
+    if not key or not key.startswith(upload_prefix(target, target_id)):
+        return 'Key does not belong to this upload'
+
+    head = aws.head_object_s3(key)
+    if head is None:
+        return 'Upload not found'
+    size, content_type = head
+    if size > aws.MAX_UPLOAD_BYTES or content_type not in aws.ALLOWED_IMAGE_TYPES:
+        return 'Upload is not an accepted image'
+    return None
+
+
+@api.route('/listings/<int:listing_id>/photos', methods=["POST"])
+@cross_origin()
+@login_required
+def confirm_listing_photo(listing_id):
+    """Attach a presigned upload to the logged in user's listing
+    Takes json {key}, returns the new photo"""
+
+    listing = Listing.query.get_or_404(listing_id)
+    if listing.listing_owner != g.username:
+        return jsonify({'error': 'Forbidden'}), 403
+    key = (request.json or {}).get("key")
+
+    error = check_uploaded(key, "listing", listing.id)
+    if error:
+        return jsonify({'error': error}), 400
+
+    photo = Listing_Photo(listing_id=listing.id,
+                          image_url=aws.object_url_s3(key))
+    db.session.add(photo)
+    db.session.commit()
+
+    return jsonify(photo.serialize()), 201
+
+
+@api.route('/users/<username>/photo', methods=["POST"])
+@cross_origin()
+@login_required
+def confirm_user_photo(username):
+    """Make a presigned upload the logged in user's profile photo
+    Takes json {key}, returns {image_url}"""
+
+    user = User.query.get_or_404(username)
+    if user.username != g.username:
+        return jsonify({'error': 'Forbidden'}), 403
+    key = (request.json or {}).get("key")
+
+    error = check_uploaded(key, "user", user.username)
+    if error:
+        return jsonify({'error': error}), 400
+
+    user.image_url = aws.object_url_s3(key)
+    user.upload_status = 'done'
+    db.session.commit()
+
+    return jsonify({"image_url": user.image_url})
+
+
+######################################################################
+# App factory
+
+
+def create_app(config=None):
+    """Create and configure the app
+
+    Nothing here touches the database or AWS: connections and the S3
+    client are made on first use, and the schema is managed with
+    `flask db-upgrade` (see migrate.py) instead of create_all.
+
+    `config` overrides the defaults below, e.g. for tests:
+    create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
+
+    Every app gets its own extension state (upload queue, caches, pools,
+    broker...) in app.extensions, so apps made in one process don't share
+    it. `flask run` finds this factory by itself; servers import the app
+    from wsgi.py.
+    """
+
+    app = Flask(__name__)
+    CORS(app, expose_headers=['X-Next-Cursor'])
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'DATABASE_URL', 'postgresql:///sharebnb')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # send UTF-8 as is, so dump_json and jsonify encode the same bytes
+    app.config['JSON_AS_ASCII'] = False
+    # pool sizing, or no pool behind PgBouncer, and read replicas
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(os.environ)
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(os.environ)
+    app.config['DATABASE_REPLICAS'] = list(app.config['SQLALCHEMY_BINDS'])
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if not app.config['SECRET_KEY']:
+        from project_secrets import SECRET_KEY
+        app.config['SECRET_KEY'] = SECRET_KEY
+
+    # SHAREBNB_PROFILE=debug logs every statement, installs the debug
+    # toolbar and fails any view that goes over its @query_budget
+    debug_profile = os.environ.get('SHAREBNB_PROFILE') == 'debug'
+    app.config['SQLALCHEMY_ECHO'] = debug_profile
+    app.config['QUERY_BUDGET_ENFORCE'] = debug_profile
+    # fraction of requests that get Server-Timing headers and a perf log,
+    # every request when profiling
+    app.config['PERF_SAMPLE_RATE'] = float(os.environ.get(
+        'PERF_SAMPLE_RATE', 1.0 if debug_profile else 0.01))
+
+    # a listing with its most and largest photos, plus its form fields
+    app.config['MAX_CONTENT_LENGTH'] = (
+        MAX_LISTING_PHOTOS * aws.MAX_UPLOAD_BYTES + 1024 * 1024)
+
+    app.config.update(config or {})
+
+    if debug_profile:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    db_routing.init_app(app)
+    migrate.init_app(app)
+
+    instrumentation.init_app(app)
+    upload_queue.init_app(app)
+    image_pipeline.init_app(app)
+
+    @app.cli.command('resume-uploads')
+    def resume_uploads_command():
+        """Finish uploads a restart left pending (run before starting the
+        web workers)."""
+
+        resumed, failed = resume_uploads()
+        upload_queue.join()
+        print(f"resumed {resumed} uploads, {failed} were lost")
+
+    availability_index.init_app(app)
+    facet_cache.init_app(app)
+    password_hasher.init_app(app)
+    token_auth.init_app(app)
+    message_broker.init_app(app)
+
+    app.register_blueprint(api)
 
-    return jsonify(listing_info.serialize())
+    return app
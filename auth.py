@@ -0,0 +1,159 @@
+"""Stateless JWT auth
+
+Issues short-lived access tokens and long-lived refresh tokens, and
+verifies the bearer token on every request without touching the users
+table. Decoded claims are kept in a bounded LRU cache keyed by token, so a
+repeat request skips the HMAC check and JSON decoding; expiry and
+revocation are still checked on every hit.
+
+    token_auth = TokenAuth()
+    token_auth.init_app(app)
+
+    @app.route('/secret')
+    @login_required
+    def secret():
+        return jsonify({"hello": g.username})
+"""
+
+import heapq
+import threading
+import time
+import uuid
+from functools import lru_cache, wraps
+
+import jwt
+from flask import current_app, g, jsonify, request
+
+ALGORITHM = "HS256"
+
+
+class InvalidToken(Exception):
+    """Token is malformed, expired, revoked or of the wrong type"""
+
+
+def _decode(token, secret):
+    # expiry is checked by the caller so cached claims can expire
+    try:
+        return jwt.decode(token, secret, algorithms=[ALGORITHM],
+                          options={"verify_exp": False,
+                                   "require": ["exp", "jti", "type"]})
+    except jwt.InvalidTokenError as e:
+        raise InvalidToken(str(e))
+
+
+class _AuthState:
+    """One app's claims cache and revoked tokens"""
+
+    def __init__(self, cache_size):
+        self.decode = lru_cache(maxsize=cache_size)(_decode)
+        # jti -> exp, and a heap of (exp, jti) to drop them once expired
+        self.revoked = {}
+        self.expiries = []
+        self.lock = threading.Lock()
+
+
+class TokenAuth:
+    """Token issuing and verification, with a claims cache and revocation
+    list per app (kept in app.extensions)
+
+    config:
+    JWT_SECRET_KEY: signing key (defaults to SECRET_KEY)
+    ACCESS_TOKEN_SECONDS / REFRESH_TOKEN_SECONDS: token lifetimes
+    JWT_CLAIMS_CACHE_SIZE: decoded tokens kept in the LRU cache
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JWT_SECRET_KEY', app.config.get('SECRET_KEY'))
+        app.config.setdefault('ACCESS_TOKEN_SECONDS', 15 * 60)
+        app.config.setdefault('REFRESH_TOKEN_SECONDS', 30 * 24 * 60 * 60)
+        app.config.setdefault('JWT_CLAIMS_CACHE_SIZE', 10000)
+        app.extensions['token_auth'] = _AuthState(
+            app.config['JWT_CLAIMS_CACHE_SIZE'])
+        app.before_request(self._load_user)
+
+    def _app(self):
+        return self.app if self.app is not None else current_app
+
+    def create_token(self, username, token_type="access"):
+        """Signed token for `username`, token_type is access or refresh"""
+
+        config = self._app().config
+        lifetime = (config['ACCESS_TOKEN_SECONDS'] if token_type == "access"
+                    else config['REFRESH_TOKEN_SECONDS'])
+        now = int(time.time())
+        payload = {
+            'username': username,
+            'type': token_type,
+            'iat': now,
+            'exp': now + lifetime,
+            'jti': uuid.uuid4().hex,
+        }
+        return jwt.encode(payload, config['JWT_SECRET_KEY'],
+                          algorithm=ALGORITHM)
+
+    def verify(self, token, token_type="access"):
+        """Claims of a valid token, raises InvalidToken otherwise"""
+
+        # anything else (e.g. a list from a json body) can't be a cache key
+        if not isinstance(token, str):
+            raise InvalidToken("Token must be a string")
+
+        app = self._app()
+        state = app.extensions['token_auth']
+        claims = state.decode(token, app.config['JWT_SECRET_KEY'])
+        if claims["type"] != token_type:
+            raise InvalidToken("Wrong token type")
+        if claims["exp"] <= time.time():
+            raise InvalidToken("Token has expired")
+        if claims["jti"] in state.revoked:
+            raise InvalidToken("Token has been revoked")
+        return claims
+
+    def revoke(self, claims):
+        """Reject this token from now until it would have expired anyway"""
+
+        state = self._app().extensions['token_auth']
+        now = time.time()
+        with state.lock:
+            state.revoked[claims["jti"]] = claims["exp"]
+            heapq.heappush(state.expiries, (claims["exp"], claims["jti"]))
+            # only unexpired tokens need remembering
+            while state.expiries and state.expiries[0][0] <= now:
+                _, jti = heapq.heappop(state.expiries)
+                state.revoked.pop(jti, None)
+
+    def _load_user(self):
+        """before_request: set g.username / g.claims from a valid bearer
+        token, None if there isn't one"""
+
+        g.username = None
+        g.claims = None
+
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return
+        try:
+            g.claims = self.verify(header[len("Bearer "):])
+        except InvalidToken:
+            return
+        g.username = g.claims["username"]
+
+
+def login_required(view):
+    """Respond 401 unless the request has a valid access token"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not g.get("username"):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+token_auth = TokenAuth()
@@ -0,0 +1,237 @@
+"""In-memory booking calendar index
+
+Keeps one bytearray per listing with a byte per day since ORIGIN (1 =
+booked), built from the bookings table on first use and updated as
+bookings are committed. "Is listing X free from A to B" is then a single
+bytearray.find over the range instead of an overlap scan of bookings.
+
+Nights are half-open like the bookings themselves: a stay from the 1st to
+the 3rd books the nights of the 1st and 2nd, so another stay can start on
+the 3rd.
+"""
+
+import threading
+import time
+from datetime import date
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Booking
+
+ORIGIN = date(2020, 1, 1)
+BOOKED = 1
+
+
+def _day(value):
+    """Day number of a date/datetime since ORIGIN, clipped at 0"""
+    if hasattr(value, "date"):
+        value = value.date()
+    return max((value - ORIGIN).days, 0)
+
+
+def _mark(calendars, listing_id, first, last):
+    """Book the nights [first, last) of a listing's calendar"""
+    calendar = calendars.setdefault(listing_id, bytearray())
+    if len(calendar) < last:
+        calendar.extend(bytes(last - len(calendar)))
+    calendar[first:last] = bytes([BOOKED]) * (last - first)
+
+
+class _Calendars:
+    """One app's calendars"""
+
+    def __init__(self, app):
+        self.app = app
+        self.calendars = {}
+        self.stale = set()
+        self.built_at = None
+        # guards the fields above; never held while reading the database
+        self.lock = threading.RLock()
+        # held by the one thread reading bookings for a rebuild
+        self.build_lock = threading.Lock()
+        # bookings committed while a rebuild reads, replayed on top of it
+        self.changes = None
+
+
+class AvailabilityIndex:
+    """Per-listing day calendars of booked nights, one set per app (kept
+    in app.extensions)
+
+    config:
+    AVAILABILITY_REFRESH_SECONDS: rebuild from the database this often so
+    bookings written by other worker processes are picked up
+    AVAILABILITY_MAX_EXCLUDED: past this many booked listings a search
+    asks the database for free ones instead of excluding booked ids
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AVAILABILITY_REFRESH_SECONDS', 300)
+        app.config.setdefault('AVAILABILITY_MAX_EXCLUDED', 1000)
+        app.extensions['availability_index'] = _Calendars(app)
+
+    def _state(self, app=None):
+        if app is None:
+            app = self.app if self.app is not None else current_app
+        return app.extensions['availability_index']
+
+    def reset(self):
+        """Forget everything, the next lookup rebuilds from the database"""
+
+        state = self._state()
+        with state.lock:
+            state.calendars = {}
+            state.stale = set()
+            state.built_at = None
+
+    def booked_listings(self, start, end):
+        """ids of listings with at least one booked night in [start, end)"""
+
+        first, last = _day(start), _day(end)
+        state = self._state()
+        self._refresh(state)
+        with state.lock:
+            return {listing_id
+                    for listing_id, calendar in state.calendars.items()
+                    if calendar.find(BOOKED, first, last) != -1}
+
+    def add_booking(self, listing_id, start, end, app=None):
+        """Mark the nights of a committed booking as booked"""
+
+        first, last = _day(start), _day(end)
+        if last <= first:
+            return
+
+        state = self._state(app)
+        with state.lock:
+            if state.changes is not None:
+                state.changes.append(("add", listing_id, first, last))
+            if state.built_at is None:
+                # the first build will read it from the database
+                return
+            _mark(state.calendars, listing_id, first, last)
+
+    def invalidate(self, listing_id, app=None):
+        """Rebuild this listing's calendar on the next lookup (used when a
+        booking is changed or removed)"""
+
+        state = self._state(app)
+        with state.lock:
+            state.stale.add(listing_id)
+            if state.changes is not None:
+                state.changes.append(("invalidate", listing_id, None, None))
+
+    def _needs(self, state):
+        """(rebuild everything?, stale listing ids) as of now"""
+
+        max_age = state.app.config['AVAILABILITY_REFRESH_SECONDS']
+        expired = (state.built_at is None or
+                   time.monotonic() - state.built_at > max_age)
+        return expired, set(state.stale)
+
+    def _refresh(self, state):
+        with state.lock:
+            expired, stale = self._needs(state)
+            if not expired and not stale:
+                return
+            # past its age but otherwise current: keep answering from it
+            # while another thread rebuilds
+            wait = state.built_at is None or bool(stale)
+
+        if not state.build_lock.acquire(blocking=wait):
+            return
+        try:
+            with state.lock:
+                # another thread may have rebuilt while we waited
+                expired, stale = self._needs(state)
+                if not expired and not stale:
+                    return
+                state.changes = []
+
+            listing_ids = None if expired else stale
+            try:
+                calendars, built_at = self._build(listing_ids)
+            except Exception:
+                with state.lock:
+                    state.changes = None
+                raise
+
+            with state.lock:
+                if listing_ids is None:
+                    state.calendars = calendars
+                    state.built_at = built_at
+                    state.stale = set()
+                else:
+                    for listing_id in listing_ids:
+                        state.calendars.pop(listing_id, None)
+                    state.calendars.update(calendars)
+                    state.stale -= listing_ids
+                for action, listing_id, first, last in state.changes:
+                    if action == "add":
+                        _mark(state.calendars, listing_id, first, last)
+                    else:
+                        state.stale.add(listing_id)
+                state.changes = None
+        finally:
+            state.build_lock.release()
+
+    def _build(self, listing_ids=None):
+        """(calendars, monotonic time) read from the bookings table, for
+        every listing or just `listing_ids`"""
+
+        built_at = time.monotonic()
+        query = db.session.query(Booking.listing_id, Booking.start_date,
+                                 Booking.end_date)
+        if listing_ids is not None:
+            query = query.filter(Booking.listing_id.in_(listing_ids))
+
+        calendars = {}
+        for listing_id, start, end in query.yield_per(10000):
+            first, last = _day(start), _day(end)
+            if last > first:
+                _mark(calendars, listing_id, first, last)
+        return calendars, built_at
+
+
+availability_index = AvailabilityIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_booking_changes(session, flush_context):
+    """Remember booking writes until we know the transaction committed"""
+
+    pending = session.info.setdefault('availability_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            pending.append(("add", obj.listing_id, obj.start_date,
+                            obj.end_date))
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Booking):
+            # a booking moved to another listing frees the old one too
+            moved_from = inspect(obj).attrs.listing_id.history.deleted
+            for listing_id in {obj.listing_id, *moved_from}:
+                pending.append(("invalidate", listing_id, None, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_booking_changes(session):
+    changes = session.info.pop('availability_changes', ())
+    # the index of the app this session belongs to
+    app = getattr(session, 'app', None)
+    if not changes or app is None or \
+            'availability_index' not in app.extensions:
+        return
+    for action, listing_id, start, end in changes:
+        if action == "add":
+            availability_index.add_booking(listing_id, start, end, app)
+        else:
+            availability_index.invalidate(listing_id, app)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_booking_changes(session):
+    session.info.pop('availability_changes', None)
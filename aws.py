@@ -1,32 +1,144 @@
-from project_secrets import BUCKET_NAME, AWS_SECRET_KEY, AWS_ACCESS_KEY
-import boto3
+from functools import lru_cache
+import os
 import uuid
+from instrumentation import track_s3
 
-client = boto3.client(
+# point at a local S3 stand-in (minio, moto server...) for dev and tests
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+# files over the chunk size go up as a multipart upload, MAX_CONCURRENCY
+# parts at a time; a 10MB photo is two 5MB parts sent in parallel instead
+# of one long PUT. The client's connection pool has room for every upload
+# worker to do that at once.
+MULTIPART_CHUNK_BYTES = int(
+    os.environ.get('S3_MULTIPART_CHUNK_MB', 5)) * 1024 * 1024
+MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 4))
+MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+
+
+@lru_cache(maxsize=None)
+def settings():
+    """Bucket and credentials, from the environment or project_secrets.
+    Read on first use so importing this module stays cheap."""
+
+    if os.environ.get('S3_BUCKET_NAME'):
+        return {"bucket": os.environ['S3_BUCKET_NAME'],
+                "access_key": os.environ.get('AWS_ACCESS_KEY_ID'),
+                "secret_key": os.environ.get('AWS_SECRET_ACCESS_KEY')}
+
+    from project_secrets import BUCKET_NAME, AWS_SECRET_KEY, AWS_ACCESS_KEY
+    return {"bucket": BUCKET_NAME,
+            "access_key": AWS_ACCESS_KEY,
+            "secret_key": AWS_SECRET_KEY}
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """The shared boto3 S3 client, built on first use (boto3 clients are
+    thread safe)"""
+
+    import boto3
+    from botocore.config import Config
+    return boto3.client(
                     's3',
-                    aws_access_key_id=AWS_ACCESS_KEY,
-                    aws_secret_access_key=AWS_SECRET_KEY
+                    aws_access_key_id=settings()["access_key"],
+                    aws_secret_access_key=settings()["secret_key"],
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=Config(max_pool_connections=MAX_POOL_CONNECTIONS),
                     )
 
-S3_LOCATION = f'https://{BUCKET_NAME}.s3.amazonaws.com/'
+
+@lru_cache(maxsize=None)
+def transfer_config():
+    """Multipart settings for upload_fileobj"""
+
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=MULTIPART_CHUNK_BYTES,
+                          multipart_chunksize=MULTIPART_CHUNK_BYTES,
+                          max_concurrency=MAX_CONCURRENCY)
+
+
+def bucket_name():
+    return settings()["bucket"]
+
+
+def s3_location():
+    if S3_ENDPOINT_URL:
+        return f'{S3_ENDPOINT_URL.rstrip("/")}/{bucket_name()}/'
+    return f'https://{bucket_name()}.s3.amazonaws.com/'
+
+
+# limits for uploaded photos, sent through the api or straight to s3 with a
+# presigned post
+PRESIGN_EXPIRES = 600
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+ALLOWED_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+
+@track_s3
+def upload_fileobj_s3(fileobj, filename, content_type, acl="public-read",
+                      config=None):
+    """Upload a file object under a unique key and return its url,
+    raises on failure. config is a TransferConfig, transfer_config() if
+    not given"""
+
+    key = f'{uuid.uuid4()}_{filename}'
+
+    get_client().upload_fileobj(
+        fileobj,
+        bucket_name(),
+        key,
+        ExtraArgs={
+            "ACL": acl,
+            "ContentType": content_type
+        },
+        Config=config or transfer_config(),
+    )
+
+    return "{}{}".format(s3_location(), key)
 
 
 def upload_file_s3(file, acl="public-read"):
     try:
-        filename = f'{uuid.uuid4()}_{file.filename}'
-
-        client.upload_fileobj(
-            file,
-            BUCKET_NAME,
-            filename,
-            ExtraArgs={
-                "ACL": acl,
-                "ContentType": file.content_type
-            }
-        )
+        # returns the new img url
+        return upload_fileobj_s3(file, file.filename, file.content_type, acl)
     except Exception as e:
         print("File upload didn't work", e)
         return e
 
-    # returns the new img url
-    return "{}{}".format(S3_LOCATION, filename)
+
+@track_s3
+def presigned_post_s3(key, content_type, max_bytes=MAX_UPLOAD_BYTES,
+                      acl="public-read"):
+    """Presigned POST that lets a client upload one file straight to `key`.
+    S3 rejects the upload if it is bigger than max_bytes or has a
+    different content type.
+
+    returns {"url": ..., "fields": {...}} for a multipart form POST"""
+
+    return get_client().generate_presigned_post(
+        bucket_name(),
+        key,
+        Fields={"acl": acl, "Content-Type": content_type},
+        Conditions=[
+            {"acl": acl},
+            {"Content-Type": content_type},
+            ["content-length-range", 1, max_bytes],
+        ],
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+
+
+@track_s3
+def head_object_s3(key):
+    """Return (size, content_type) of an uploaded key, None if missing"""
+
+    from botocore.exceptions import ClientError
+    try:
+        head = get_client().head_object(Bucket=bucket_name(), Key=key)
+    except ClientError:
+        return None
+    return head["ContentLength"], head["ContentType"]
+
+
+def object_url_s3(key):
+    return "{}{}".format(s3_location(), key)
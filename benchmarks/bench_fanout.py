@@ -0,0 +1,81 @@
+"""Message fan-out latency through the in-process broker
+
+Opens N idle subscriptions (one thread each, like one held SSE stream per
+worker thread), publishes messages to random recipients and reports the
+publish-to-receive latency and publish throughput.
+
+    python benchmarks/bench_fanout.py --subscribers 2000 --messages 20000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from broker import MessageBroker  # noqa: E402
+
+STOP = object()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['MESSAGE_STREAM_QUEUE_SIZE'] = 1000
+    broker = MessageBroker(app)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def listen(subscription):
+        received = []
+        while True:
+            message = subscription.get(timeout=60)
+            if message is STOP:
+                break
+            received.append(time.perf_counter() - message["sent"])
+        with lock:
+            latencies.extend(received)
+
+    users = [f"user{i}" for i in range(args.users)]
+    subscriptions = [broker.subscribe(users[i % args.users])
+                     for i in range(args.subscribers)]
+    threads = [threading.Thread(target=listen, args=(s,), daemon=True)
+               for s in subscriptions]
+    for thread in threads:
+        thread.start()
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        broker.publish(rng.choice(users), {"id": i,
+                                           "sent": time.perf_counter()})
+    elapsed = time.perf_counter() - start
+
+    for user in users:
+        broker.publish(user, STOP)
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    print(f"{args.subscribers} subscribers over {args.users} users, "
+          f"{args.messages} messages, {len(ms)} deliveries")
+    print(f"publish: {args.messages / elapsed:,.0f} msgs/sec")
+    print(f"latency: p50 {statistics.median(ms):.3f} ms  "
+          f"p95 {ms[int(len(ms) * 0.95)]:.3f} ms  "
+          f"p99 {ms[int(len(ms) * 0.99)]:.3f} ms  max {ms[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
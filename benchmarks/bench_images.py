@@ -0,0 +1,69 @@
+"""Image derivative throughput: process pool vs serial
+
+Generates synthetic camera-sized JPEGs and runs images.make_variants over
+them serially and through a ProcessPoolExecutor started the way
+ImagePipeline starts it, printing images/sec.
+
+    python benchmarks/bench_images.py --images 48 --workers 4
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from images import MP_CONTEXT, make_variants  # noqa: E402
+
+
+def make_photo(seed, width, height):
+    """A noisy gradient JPEG, so it compresses like a real photo"""
+    from PIL import Image, ImageFilter
+
+    rng = random.Random(seed)
+    small = Image.new("RGB", (width // 16, height // 16))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                   for _ in range(small.width * small.height)])
+    image = small.resize((width, height)).filter(ImageFilter.GaussianBlur(2))
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    photos = [make_photo(i, args.width, args.height)
+              for i in range(args.images)]
+    mb = sum(len(photo) for photo in photos) / 1e6
+    print(f"{args.images} photos, {args.width}x{args.height}, {mb:.1f} MB")
+
+    start = time.perf_counter()
+    for photo in photos:
+        make_variants(photo)
+    serial = time.perf_counter() - start
+
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             mp_context=MP_CONTEXT) as pool:
+        # start the workers before timing
+        list(pool.map(abs, range(args.workers)))
+        start = time.perf_counter()
+        list(pool.map(make_variants, photos))
+        pooled = time.perf_counter() - start
+
+    print(f"serial:            {args.images / serial:8.2f} images/sec")
+    print(f"pool ({args.workers:>2} workers): {args.images / pooled:8.2f} "
+          f"images/sec  ({serial / pooled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
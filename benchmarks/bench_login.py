@@ -0,0 +1,92 @@
+"""/login throughput: inline bcrypt vs the password process pool
+
+Serves the app from a threaded werkzeug server and fires concurrent
+/login requests, once with PASSWORD_WORKERS=0 (bcrypt on the request
+thread) and once with the process pool, printing requests/sec and latency.
+
+Uses the database the app is configured for and creates the user
+"benchlogin" in it if missing.
+
+    python benchmarks/bench_login.py --requests 200 --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server  # noqa: E402
+from app import create_app  # noqa: E402
+from models import db, User  # noqa: E402
+
+app = create_app()
+
+USERNAME = "benchlogin"
+PASSWORD = "benchpassword"
+
+
+def ensure_user():
+    with app.app_context():
+        if not User.query.get(USERNAME):
+            User.signup(USERNAME, f"{USERNAME}@example.com", PASSWORD,
+                        "bench", "bench", None)
+            db.session.commit()
+
+
+def login(url):
+    body = json.dumps({"username": USERNAME, "password": PASSWORD}).encode()
+    req = urllib.request.Request(f"{url}/login", data=body,
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        assert "token" in json.load(resp)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(url, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = sorted(pool.map(lambda _: login(url), range(requests)))
+        elapsed = time.perf_counter() - start
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    ensure_user()
+
+    server = make_server("127.0.0.1", args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{args.port}"
+
+    for label, workers in (("inline", 0), (f"pool x{args.workers}",
+                                           args.workers)):
+        app.config['PASSWORD_WORKERS'] = workers
+        login(url)  # warm up (starts the pool)
+        result = run(url, args.requests, args.concurrency)
+        print(f"{label:>10}: {result['rps']:7.1f} req/s  "
+              f"p50 {result['p50']:7.1f} ms  p95 {result['p95']:7.1f} ms")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
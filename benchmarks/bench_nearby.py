@@ -0,0 +1,93 @@
+"""Radius search benchmark: geohash prefix index vs full scan
+
+Runs the first page of /listings/nearby (Listing.nearby) for random
+centers around the seeded places, and the same search as a full scan that
+computes the haversine distance of every listing, at several radii. Checks
+both return the same listings.
+
+Seed a million listings first:
+
+    python seed.py --truncate --listings 1000000 \\
+        --database-url postgresql:///sharebnb-bench
+    DATABASE_URL=postgresql:///sharebnb-bench \\
+        python benchmarks/bench_nearby.py --radius 1 5 25 --repeat 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from app import create_app  # noqa: E402
+from models import db, Listing  # noqa: E402
+from seed import COORDINATES  # noqa: E402
+
+app = create_app()
+
+
+def full_scan(latitude, longitude, radius_km, limit):
+    """Same page as Listing.nearby, without the geohash prefixes"""
+
+    distance = Listing.distance_km(latitude, longitude)
+    query = Listing.query.filter(distance <= radius_km)
+    return (Listing.projected(query)
+            .add_columns(distance.label("distance_km"))
+            .order_by(distance, Listing.id)
+            .limit(limit)
+            .all())
+
+
+def indexed(latitude, longitude, radius_km, limit):
+    rows, _ = Listing.nearby(latitude, longitude, radius_km, limit=limit)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--radius", type=float, nargs="+", default=[1, 5, 25])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    rng = random.Random(args.seed)
+    centers = [(latitude + rng.gauss(0, 0.05), longitude + rng.gauss(0, 0.05))
+               for latitude, longitude in
+               (rng.choice(list(COORDINATES.values()))
+                for _ in range(args.repeat))]
+
+    with app.app_context():
+        count = Listing.query.count()
+        print(f"{count:,} listings, {args.repeat} random centers, "
+              f"page of {args.limit}")
+        for radius in args.radius:
+            times = {"indexed": [], "full scan": []}
+            mismatches = 0
+            for latitude, longitude in centers:
+                pages = {}
+                for name, fn in (("indexed", indexed),
+                                 ("full scan", full_scan)):
+                    db.session.remove()
+                    start = time.perf_counter()
+                    pages[name] = [row.id for row in fn(
+                        latitude, longitude, radius, args.limit)]
+                    times[name].append(
+                        (time.perf_counter() - start) * 1000)
+                mismatches += pages["indexed"] != pages["full scan"]
+
+            indexed_ms = statistics.median(times["indexed"])
+            scan_ms = statistics.median(times["full scan"])
+            print(f"radius {radius:6.1f} km: indexed {indexed_ms:8.2f} ms  "
+                  f"full scan {scan_ms:8.2f} ms  "
+                  f"({scan_ms / indexed_ms:5.1f}x)  "
+                  f"{mismatches} mismatched pages")
+
+
+if __name__ == "__main__":
+    main()
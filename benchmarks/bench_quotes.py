@@ -0,0 +1,97 @@
+"""Quote engine benchmark
+
+Prices N listings x M stays with pricing.quote and with a plain Python
+loop over every night, on synthetic listings with a weekend rule and a
+seasonal rule each, and checks both agree. No database needed.
+
+    python benchmarks/bench_quotes.py --listings 200 --stays 12
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing import quote  # noqa: E402
+
+FRI_SAT = 1 << 4 | 1 << 5
+
+
+def looped(base_prices, rules, ranges):
+    """Reference: price each night of each stay of each listing"""
+
+    ordered = sorted(rules, key=lambda rule: (rule.priority, rule.id))
+    totals = []
+    for listing_id, base in base_prices.items():
+        listing_rules = [rule for rule in ordered
+                         if rule.listing_id == listing_id]
+        row = []
+        for start, end in ranges:
+            total = 0
+            for offset in range((end - start).days):
+                night = start + timedelta(days=offset)
+                price = base
+                for rule in listing_rules:
+                    if ((rule.start_date is None or night >= rule.start_date)
+                            and (rule.end_date is None or
+                                 night < rule.end_date)
+                            and (rule.weekdays is None or
+                                 rule.weekdays & 1 << night.weekday())):
+                        price = rule.nightly_price
+                total += int(price * 100)
+            row.append(total)
+        totals.append(row)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--listings", type=int, default=200)
+    parser.add_argument("--stays", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base_prices = {i: Decimal(rng.randint(5000, 40000)) / 100
+                   for i in range(1, args.listings + 1)}
+    rules = []
+    for listing_id, base in base_prices.items():
+        rules.append(SimpleNamespace(
+            id=len(rules) + 1, listing_id=listing_id, priority=0,
+            nightly_price=base * Decimal("1.25"), weekdays=FRI_SAT,
+            start_date=None, end_date=None))
+        rules.append(SimpleNamespace(
+            id=len(rules) + 1, listing_id=listing_id, priority=1,
+            nightly_price=base * Decimal("1.5"), weekdays=None,
+            start_date=date(2021, 6, 1), end_date=date(2021, 9, 1)))
+    ranges = []
+    for _ in range(args.stays):
+        start = date(2021, 1, 1) + timedelta(days=rng.randrange(330))
+        ranges.append((start, start + timedelta(days=rng.randint(1, 14))))
+
+    results = {}
+    for name, fn in (("vectorized", quote), ("looped", looped)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            totals = fn(base_prices, rules, ranges)
+        results[name] = (time.perf_counter() - start) / args.repeat * 1000
+        if name == "vectorized":
+            totals = totals[1].tolist()
+        results[name + " totals"] = totals
+
+    print(f"{args.listings} listings x {args.stays} stays")
+    print(f"vectorized: {results['vectorized']:8.2f} ms")
+    print(f"    looped: {results['looped']:8.2f} ms  "
+          f"({results['looped'] / results['vectorized']:.1f}x)")
+    print("same totals:",
+          results["vectorized totals"] == results["looped totals"])
+
+
+if __name__ == "__main__":
+    main()
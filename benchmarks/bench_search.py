@@ -0,0 +1,135 @@
+"""Listing search benchmark: full-text index vs ILIKE scan
+
+Loads N synthetic listings into a scratch database and times the ranked
+full-text query behind /listings/search against the naive version of the
+same search: an ILIKE scan for the term, ranked and ordered the same way.
+The default term is planted in a small fraction of the listings
+(--selectivity), like a real search for a specific word; a term in most
+rows would let both queries stop after the first page of matches.
+
+The scratch database must already have the sharebnb schema. Its listings
+and users tables are TRUNCATED, never point this at real data.
+
+    python benchmarks/bench_search.py --database-url postgresql:///sharebnb-bench
+    python benchmarks/bench_search.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import io
+import random
+import statistics
+import time
+
+import psycopg2
+
+WORDS = ("cozy sunny quiet modern rustic spacious charming bright private "
+         "garden pool beach mountain lake forest downtown studio loft cabin "
+         "cottage villa apartment house room suite view patio fireplace "
+         "kitchen parking wifi balcony hottub deck farm barn treehouse yurt "
+         "ocean river desert island vineyard castle").split()
+PLACES = ("San Francisco", "Oakland", "Berkeley", "Portland", "Seattle",
+          "Austin", "Denver", "Chicago", "Boston", "Miami", "Tahoe", "Napa")
+
+# planted in --selectivity of the listings, never generated otherwise
+RARE_WORD = "lighthouse"
+
+FTS_QUERY = """
+    SELECT id, ts_rank_cd(search_vector, q) AS rank
+    FROM listings, websearch_to_tsquery('english', %(terms)s) q
+    WHERE search_vector @@ q
+    ORDER BY rank DESC, id DESC
+    LIMIT 50
+"""
+
+# same ranking and order as FTS_QUERY, only the match is a scan
+ILIKE_QUERY = """
+    SELECT id, ts_rank_cd(search_vector, q) AS rank
+    FROM listings, websearch_to_tsquery('english', %(terms)s) q
+    WHERE title ILIKE %(pattern)s
+       OR location ILIKE %(pattern)s
+       OR description ILIKE %(pattern)s
+    ORDER BY rank DESC, id DESC
+    LIMIT 50
+"""
+
+COUNT_QUERY = """
+    SELECT count(*)
+    FROM listings, websearch_to_tsquery('english', %(terms)s) q
+    WHERE search_vector @@ q
+"""
+
+
+def load_listings(conn, n, selectivity, seed=0):
+    """Replace the listings table with n synthetic rows using COPY, with
+    RARE_WORD in the description of about `selectivity` of them"""
+    rng = random.Random(seed)
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE listings, users CASCADE")
+        cur.execute("""INSERT INTO users (username, email, password)
+                       VALUES ('bench', 'bench@example.com', 'x')""")
+        batch = 50_000
+        for start in range(0, n, batch):
+            buf = io.StringIO()
+            for _ in range(min(batch, n - start)):
+                title = " ".join(rng.choices(WORDS, k=4))
+                words = rng.choices(WORDS, k=40)
+                if rng.random() < selectivity:
+                    words[rng.randrange(len(words))] = RARE_WORD
+                description = " ".join(words)
+                location = rng.choice(PLACES)
+                price = rng.randint(30, 900)
+                buf.write(f"{title}\t{price}.00\t{description}\t"
+                          f"{location}\tbench\n")
+            buf.seek(0)
+            cur.copy_expert(
+                "COPY listings (title, price, description, location, "
+                "listing_owner) FROM STDIN", buf)
+        cur.execute("ANALYZE listings")
+    conn.commit()
+
+
+def time_query(conn, sql, params, repeat):
+    """Median wall time in ms of `repeat` runs, after one warm-up"""
+    timings = []
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        cur.fetchall()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url", default="postgresql:///sharebnb-bench")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--terms", default=RARE_WORD)
+    parser.add_argument("--selectivity", type=float, default=0.001,
+                        help="fraction of listings with the rare word")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+
+    params = {"terms": args.terms, "pattern": f"%{args.terms}%"}
+    print(f"{'listings':>10} {'matches':>8} {'fts ms':>10} {'ilike ms':>10} "
+          f"{'speedup':>8}")
+    for size in args.sizes:
+        load_listings(conn, size, args.selectivity)
+        with conn.cursor() as cur:
+            cur.execute(COUNT_QUERY, params)
+            matches = cur.fetchone()[0]
+        fts = time_query(conn, FTS_QUERY, params, args.repeat)
+        ilike = time_query(conn, ILIKE_QUERY, params, args.repeat)
+        print(f"{size:>10} {matches:>8} {fts:>10.2f} {ilike:>10.2f} "
+              f"{ilike / fts:>7.1f}x")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Microbenchmark of the listing list serialization paths
+
+Times building one /listings page (default 200 listings) both ways, in
+the same session setup as a request:
+
+    orm:       Listing objects + selectinload photos, serialize(), jsonify
+    projected: Listing.projected() rows with json_agg photos, dump_json
+
+and checks the two produce the same bytes. Needs a seeded database
+(python seed.py).
+
+    DATABASE_URL=postgresql:///sharebnb-bench \\
+        python benchmarks/bench_serialize.py --limit 200 --repeat 50
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+from app import create_app  # noqa: E402
+from helpers import dump_json  # noqa: E402
+from models import db, Listing  # noqa: E402
+
+app = create_app()
+
+
+def orm_page(limit, size):
+    query = Listing.query.options(selectinload(Listing.photos))
+    listings, _ = Listing.paginate_keyset(query, limit=limit)
+    return jsonify([listing.serialize(size) for listing in listings]) \
+        .get_data()
+
+
+def projected_page(limit, size):
+    rows, _ = Listing.paginate_keyset(
+        Listing.projected(Listing.query, size), limit=limit)
+    return dump_json([dict(row._mapping) for row in rows])
+
+
+def timed(fn, limit, size, repeat):
+    """Median milliseconds per call, each with a fresh session"""
+
+    samples = []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        fn(limit, size)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--size", default="original")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+
+    with app.test_request_context('/listings'):
+        same = orm_page(args.limit, args.size) == \
+            projected_page(args.limit, args.size)
+        orm = timed(orm_page, args.limit, args.size, args.repeat)
+        projected = timed(projected_page, args.limit, args.size, args.repeat)
+
+    print(f"{args.limit} listings, size {args.size}, median of {args.repeat}")
+    print(f"      orm: {orm:8.2f} ms")
+    print(f"projected: {projected:8.2f} ms  ({orm / projected:.1f}x)")
+    print(f"identical output: {same}")
+
+
+if __name__ == "__main__":
+    main()
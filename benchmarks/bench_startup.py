@@ -0,0 +1,88 @@
+"""Worker startup benchmark
+
+Times, in fresh interpreters, how long `import app` takes and how long it
+takes from there (building the app, if the import didn't) to the first
+handled request (a 404, so no query runs
+unless startup itself touches the database). Pass --compare <rev> to also
+measure another commit, checked out in a temporary git worktree, e.g. the
+commit before the app factory:
+
+    python benchmarks/bench_startup.py --runs 10 --compare HEAD~1
+
+Both trees use the same DATABASE_URL, so point it at a database that
+exists (startup before the factory ran create_all against it).
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+# trees before the factory built the app on import
+application = getattr(app, 'app', None) or app.create_app()
+application.test_client().get('/__startup_probe__')
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_request_ms": (served - imported) * 1000}))
+"""
+
+
+def measure(tree, runs):
+    """Median import and first-request times over `runs` fresh processes"""
+
+    samples = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", PROBE],
+                                      cwd=tree, text=True)
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {key: round(statistics.median(s[key] for s in samples), 1)
+            for key in samples[0]}
+
+
+def report(name, result):
+    total = result["import_ms"] + result["first_request_ms"]
+    print(f"{name:>12}: import {result['import_ms']:8.1f} ms  "
+          f"first request {result['first_request_ms']:8.1f} ms  "
+          f"total {total:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--compare", metavar="REV",
+                        help="also measure this git revision")
+    args = parser.parse_args()
+
+    report("working tree", measure(ROOT, args.runs))
+
+    if args.compare:
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = os.path.join(tmp, "tree")
+            subprocess.check_call(["git", "worktree", "add", "--detach",
+                                   tree, args.compare], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL)
+            # not under version control, older trees import it at startup
+            secrets = os.path.join(ROOT, "project_secrets.py")
+            if os.path.exists(secrets):
+                shutil.copy(secrets, tree)
+            try:
+                report(args.compare, measure(tree, args.runs))
+            finally:
+                subprocess.check_call(["git", "worktree", "remove", "--force",
+                                       tree], cwd=ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Memory benchmark for streamed listing responses
+
+Compares peak Python memory (tracemalloc) of building the whole listings
+response at once (every ORM object, then every dict, then one JSON
+string) against GET /listings?stream=1, for growing numbers of listings.
+The buffered peak should grow with the row count while the streamed one
+stays flat.
+
+Load enough listings first, e.g. python seed.py --truncate --listings 200000
+
+    DATABASE_URL=postgresql:///sharebnb-bench \\
+        python benchmarks/bench_stream.py --rows 1000 10000 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+from app import create_app, stream_json_array  # noqa: E402
+from models import db, Listing  # noqa: E402
+
+app = create_app()
+
+
+def buffered(rows):
+    """What send_listings used to do for `rows` listings"""
+
+    query = Listing.query.options(selectinload(Listing.photos)) \
+        .filter(Listing.id <= rows).order_by(Listing.id)
+    response = jsonify([listing.serialize() for listing in query.all()])
+    return len(response.get_data())
+
+
+def streamed(rows):
+    """What GET /listings?stream=1 does for `rows` listings"""
+
+    query = Listing.query.options(selectinload(Listing.photos)) \
+        .filter(Listing.id <= rows)
+    return sum(len(chunk.encode()) for chunk in stream_json_array(
+        listing.serialize() for listing in Listing.stream(query)))
+
+
+def measure(fn, rows):
+    """(peak MiB, seconds, response bytes) of fn(rows) in a fresh session"""
+
+    db.session.remove()
+    with app.test_request_context('/listings'):
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = fn(rows)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.remove()
+    return peak / 2 ** 20, elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+",
+                        default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['PERF_SAMPLE_RATE'] = 0
+
+    for rows in args.rows:
+        for name, fn in (("buffered", buffered), ("streamed", streamed)):
+            peak, elapsed, size = measure(fn, rows)
+            print(f"{rows:>8} rows {name:>9}: peak {peak:8.1f} MiB  "
+                  f"{elapsed:6.2f}s  {size / 2 ** 20:8.1f} MiB of JSON")
+
+
+if __name__ == "__main__":
+    main()
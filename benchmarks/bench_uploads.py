@@ -0,0 +1,111 @@
+"""Listing photo upload benchmark: one at a time vs the upload queue
+
+Uploads the photos of one listing to the in-process S3 stub, with a delay
+per request and a per-connection bandwidth limit to mimic real S3:
+
+    sequential: one upload_fileobj_s3 after another with boto3's default
+                TransferConfig, as add_listing used to
+    queued:     UploadQueue.enqueue_many over UPLOAD_WORKERS threads with
+                aws.transfer_config() (multipart chunk size/concurrency)
+
+and prints the wall time until every photo is in the bucket. No database
+needed.
+
+    python benchmarks/bench_uploads.py --photos 10 --photo-mb 8 \\
+        --latency-ms 30 --mbps 200 --workers 4
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from s3_stub import S3Stub  # noqa: E402
+
+
+def sequential(photos, aws):
+    from boto3.s3.transfer import TransferConfig
+
+    default = TransferConfig()
+    for i, photo in enumerate(photos):
+        aws.upload_fileobj_s3(io.BytesIO(photo), f"seq{i}.jpg", "image/jpeg",
+                              config=default)
+
+
+def queued(photos, workers):
+    from flask import Flask
+    from werkzeug.datastructures import FileStorage
+    from upload_queue import UploadQueue
+
+    app = Flask(__name__)
+    app.config['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp()
+    app.config['UPLOAD_WORKERS'] = workers
+    queue = UploadQueue(app)
+    done = threading.Event()
+    results = []
+
+    spooled = [queue.spool(FileStorage(io.BytesIO(photo), f"queued{i}.jpg",
+                                       content_type="image/jpeg"))
+               for i, photo in enumerate(photos)]
+
+    def finish(uploads):
+        results.extend(uploads)
+        done.set()
+
+    # spooling is part of the request, not the upload
+    start = time.perf_counter()
+    queue.enqueue_many(spooled, finish)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    if not all(url for url, _ in results):
+        raise RuntimeError("some uploads failed")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--photo-mb", type=float, default=8)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--mbps", type=float, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    stub = S3Stub(latency_ms=args.latency_ms, mbps=args.mbps).start()
+    # aws.py reads these on import / first use
+    os.environ.update({"S3_ENDPOINT_URL": stub.url,
+                       "S3_BUCKET_NAME": "sharebnb-bench",
+                       "AWS_ACCESS_KEY_ID": "bench",
+                       "AWS_SECRET_ACCESS_KEY": "bench",
+                       "AWS_DEFAULT_REGION": "us-east-1"})
+    import aws
+
+    photos = [os.urandom(int(args.photo_mb * 1024 * 1024))
+              for _ in range(args.photos)]
+    print(f"{args.photos} photos of {args.photo_mb} MB, "
+          f"{args.latency_ms} ms per request, {args.mbps} Mbps per "
+          f"connection, chunks of {aws.MULTIPART_CHUNK_BYTES >> 20} MB x "
+          f"{aws.MAX_CONCURRENCY}")
+
+    requests = stub.requests
+    start = time.perf_counter()
+    sequential(photos, aws)
+    seq = time.perf_counter() - start
+    print(f"sequential:         {seq:7.2f} s  "
+          f"({stub.requests - requests} requests)")
+
+    requests = stub.requests
+    pooled = queued(photos, args.workers)
+    print(f"queued ({args.workers:>2} workers): {pooled:7.2f} s  "
+          f"({stub.requests - requests} requests, {seq / pooled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""HTTP load benchmark for the API
+
+Starts the app on a threaded werkzeug server against a local Postgres
+(DATABASE_URL) and the in-process S3 stub, then drives /signup, /login,
+/listings and /listings/new at the given concurrency. For each endpoint it
+reports throughput, p50/p95/p99 latency, errors and SQL statements per
+request, and writes everything to a JSON file named after the current
+commit so runs can be compared.
+
+The database should be a scratch one: benchmark users and listings are
+added to it.
+
+    DATABASE_URL=postgresql:///sharebnb-bench \\
+        python benchmarks/load.py --requests 500 --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from s3_stub import S3Stub  # noqa: E402
+
+# aws.py reads these on import / first use, and create_app falls back to
+# project_secrets without a SECRET_KEY
+s3 = S3Stub().start()
+os.environ.update({"S3_ENDPOINT_URL": s3.url,
+                   "S3_BUCKET_NAME": "sharebnb-bench",
+                   "AWS_ACCESS_KEY_ID": "bench",
+                   "AWS_SECRET_ACCESS_KEY": "bench",
+                   "AWS_DEFAULT_REGION": "us-east-1"})
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+from app import create_app  # noqa: E402
+from upload_queue import upload_queue  # noqa: E402
+from bench_images import make_photo  # noqa: E402
+
+app = create_app()
+
+# a real JPEG, so uploads go through the image pipeline like a user's
+PHOTO = make_photo(0, 1024, 768)
+
+
+class StatementCounter:
+    """Counts every SQL statement on every thread"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(Engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+def multipart(fields, files):
+    """Encode a multipart/form-data body, returns (body, content type)"""
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode())
+        parts.append(data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def call(base, method, path, body=None, content_type=None):
+    """Make one request, returns (latency ms, ok)"""
+
+    headers = {"Content-Type": content_type} if content_type else {}
+    req = urllib.request.Request(base + path, data=body, method=method,
+                                 headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as resp:
+            resp.read()
+            ok = resp.status < 400
+    except urllib.error.HTTPError as e:
+        e.read()
+        ok = False
+    return (time.perf_counter() - start) * 1000, ok
+
+
+def percentile(values, pct):
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def run_phase(name, make_request, requests, concurrency, counter):
+    """Fire `requests` calls of make_request(i) and summarize them"""
+
+    before = counter.count
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(make_request, range(requests)))
+        elapsed = time.perf_counter() - start
+    # background uploads are part of what the request costs
+    with app.app_context():
+        upload_queue.join()
+    statements = counter.count - before
+
+    latencies = sorted(latency for latency, _ in results)
+    summary = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "sql_per_request": round(statements / requests, 2),
+    }
+    print(f"{name:>14}: {summary['rps']:8.1f} req/s  "
+          f"p50 {summary['p50_ms']:7.1f}  p95 {summary['p95_ms']:7.1f}  "
+          f"p99 {summary['p99_ms']:7.1f} ms  "
+          f"{summary['sql_per_request']:5.1f} sql/req  "
+          f"{summary['errors']} errors")
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--output", help="results file (default "
+                        "benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    counter = StatementCounter()
+    server = make_server("127.0.0.1", args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{args.port}"
+
+    run_id = uuid.uuid4().hex[:8]
+    usernames = [f"bench{run_id}_{i}" for i in range(args.requests)]
+
+    def signup(i):
+        body, content_type = multipart(
+            {"username": usernames[i], "email": f"{usernames[i]}@example.com",
+             "password": "benchpassword", "bio": "bench", "location": "bench"},
+            {"file": ("me.jpg", PHOTO, "image/jpeg")})
+        return call(base, "POST", "/signup", body, content_type)
+
+    def login(i):
+        body = json.dumps({"username": usernames[i],
+                           "password": "benchpassword"}).encode()
+        return call(base, "POST", "/login", body, "application/json")
+
+    def add_listing(i):
+        body, content_type = multipart(
+            {"title": f"Bench listing {i}", "price": f"{50 + i % 300}.00",
+             "description": "A listing made by the load benchmark",
+             "location": "Benchville", "username": usernames[i]},
+            {"photo": ("room.jpg", PHOTO, "image/jpeg")})
+        return call(base, "POST", "/listings/new", body, content_type)
+
+    def send_listings(i):
+        return call(base, "GET", "/listings")
+
+    print(f"{args.requests} requests per endpoint, concurrency "
+          f"{args.concurrency}, S3 stub at {s3.url}")
+    endpoints = {}
+    for name, make_request in (("POST /signup", signup),
+                               ("POST /login", login),
+                               ("POST /listings/new", add_listing),
+                               ("GET /listings", send_listings)):
+        endpoints[name] = run_phase(name, make_request, args.requests,
+                                    args.concurrency, counter)
+
+    server.shutdown()
+    s3.stop()
+
+    commit = git_commit()
+    output = args.output or os.path.join(HERE, "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "run_at": datetime.now(timezone.utc).isoformat(),
+            "database_url": app.config['SQLALCHEMY_DATABASE_URI'],
+            "endpoints": endpoints,
+        }, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
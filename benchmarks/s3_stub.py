@@ -0,0 +1,168 @@
+"""Local S3 stand-in for benchmarks
+
+Speaks just enough of the S3 REST API (path-style) for boto3 uploads:
+PutObject, HeadObject, GetObject and the multipart upload calls. Objects
+are kept in memory. --latency-ms adds a delay to every request to mimic
+the round trip to real S3, and --mbps limits how fast each connection
+can send a request body.
+
+    python benchmarks/s3_stub.py --port 9000 --latency-ms 50 --mbps 100
+    S3_ENDPOINT_URL=http://127.0.0.1:9000 flask run
+"""
+
+import argparse
+import hashlib
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class S3Stub:
+    """In-memory bucket store behind a threaded HTTP server"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, mbps=0):
+        self.objects = {}
+        self.multipart = {}
+        self.requests = 0
+        self.latency = latency_ms / 1000
+        # seconds per byte received, 0 for no limit
+        self.byte_time = 8 / (mbps * 1e6) if mbps else 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _key(self):
+                parsed = urlparse(self.path)
+                return parsed.path.lstrip("/"), parse_qs(
+                    parsed.query, keep_blank_values=True)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                data = self.rfile.read(length)
+                if stub.byte_time:
+                    time.sleep(length * stub.byte_time)
+                return data
+
+            def _reply(self, status, body=b"", headers=None):
+                with stub.lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_PUT(self):
+                key, query = self._key()
+                data = self._body()
+                etag = f'"{hashlib.md5(data).hexdigest()}"'
+                if "uploadId" in query:
+                    upload = stub.multipart[query["uploadId"][0]]
+                    upload["parts"][int(query["partNumber"][0])] = data
+                else:
+                    stub.objects[key] = (
+                        data, self.headers.get("Content-Type",
+                                               "binary/octet-stream"))
+                self._reply(200, headers={"ETag": etag})
+
+            def do_POST(self):
+                key, query = self._key()
+                self._body()
+                if "uploads" in query:
+                    upload_id = uuid.uuid4().hex
+                    stub.multipart[upload_id] = {
+                        "parts": {},
+                        "content_type": self.headers.get(
+                            "Content-Type", "binary/octet-stream")}
+                    bucket, _, name = key.partition("/")
+                    body = (
+                        "<InitiateMultipartUploadResult>"
+                        f"<Bucket>{bucket}</Bucket><Key>{name}</Key>"
+                        f"<UploadId>{upload_id}</UploadId>"
+                        "</InitiateMultipartUploadResult>").encode()
+                    self._reply(200, body, {"Content-Type": "application/xml"})
+                elif "uploadId" in query:
+                    upload = stub.multipart.pop(query["uploadId"][0])
+                    parts = upload["parts"]
+                    stub.objects[key] = (
+                        b"".join(parts[n] for n in sorted(parts)),
+                        upload["content_type"])
+                    body = ("<CompleteMultipartUploadResult>"
+                            f"<Key>{key}</Key><ETag>\"stub\"</ETag>"
+                            "</CompleteMultipartUploadResult>").encode()
+                    self._reply(200, body, {"Content-Type": "application/xml"})
+                else:
+                    self._reply(204)
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                key, _ = self._key()
+                if key not in stub.objects:
+                    self._reply(404)
+                    return
+                data, content_type = stub.objects[key]
+                if self.command == "HEAD":
+                    # report the object size, not the empty HEAD body
+                    with stub.lock:
+                        stub.requests += 1
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    return
+                self._reply(200, data, {"Content-Type": content_type})
+
+            def do_DELETE(self):
+                key, _ = self._key()
+                stub.objects.pop(key, None)
+                self._reply(204)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--mbps", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = S3Stub(args.host, args.port, args.latency_ms, args.mbps)
+    print(f"S3 stub listening on {stub.url}")
+    stub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
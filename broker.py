@@ -0,0 +1,231 @@
+"""Real-time message fan-out
+
+New messages are published, after their transaction commits, to an
+in-process broker that hands them to every open stream of the recipient.
+A subscriber is just a small bounded queue, so idle streams cost almost
+nothing beyond the connection itself (run under gevent/eventlet workers to
+hold thousands of them).
+
+With MESSAGE_BROKER_BRIDGE = "postgres" messages are instead sent with
+NOTIFY inside the inserting transaction, and every worker process LISTENs
+and republishes them to its own subscribers, so a message reaches streams
+held by any worker.
+"""
+
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from models import db, Message
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must be under 8000 bytes
+MAX_NOTIFY_BYTES = 7900
+
+
+class Subscription:
+    """One open stream's queue of messages for `username`"""
+
+    def __init__(self, username, maxsize, subscribers):
+        self.username = username
+        self.queue = queue.Queue(maxsize)
+        # the app's subscriber set, so streams can unsubscribe after the
+        # request has ended
+        self.subscribers = subscribers
+        # set when the client fell too far behind and messages were
+        # dropped; the stream should end so the client refetches
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next message, raises queue.Empty after `timeout` seconds"""
+
+        return self.queue.get(timeout=timeout)
+
+
+class _Subscribers:
+    """One app's open streams and LISTEN thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.listener = None
+
+
+class MessageBroker:
+    """Fan-out of new messages to the recipient's open streams, with
+    separate subscribers per app (kept in app.extensions)
+
+    config:
+    MESSAGE_STREAM_QUEUE_SIZE: messages buffered per stream
+    MESSAGE_STREAM_HEARTBEAT: seconds between keepalives on idle streams
+    MESSAGE_BROKER_BRIDGE: None, or "postgres" for LISTEN/NOTIFY
+    MESSAGE_NOTIFY_CHANNEL: channel name for the postgres bridge
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MESSAGE_STREAM_QUEUE_SIZE', 100)
+        app.config.setdefault('MESSAGE_STREAM_HEARTBEAT', 15)
+        app.config.setdefault('MESSAGE_BROKER_BRIDGE', None)
+        app.config.setdefault('MESSAGE_NOTIFY_CHANNEL', 'sharebnb_messages')
+        app.extensions['message_broker'] = _Subscribers(app)
+
+    def _state(self, app=None):
+        if app is None:
+            app = self.app if self.app is not None else current_app
+        return app.extensions['message_broker']
+
+    def bridged(self, app=None):
+        """Do messages go through postgres LISTEN/NOTIFY?"""
+
+        return self._state(app).app.config['MESSAGE_BROKER_BRIDGE'] == \
+            'postgres'
+
+    def subscribe(self, username):
+        """Start receiving messages sent to `username`"""
+
+        state = self._state()
+        if self.bridged():
+            self._start_listener(state)
+
+        subscription = Subscription(
+            username, state.app.config['MESSAGE_STREAM_QUEUE_SIZE'], state)
+        with state.lock:
+            state.subscriptions.setdefault(username, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        state = subscription.subscribers
+        with state.lock:
+            subscriptions = state.subscriptions.get(subscription.username)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del state.subscriptions[subscription.username]
+
+    def subscriber_count(self):
+        state = self._state()
+        with state.lock:
+            return sum(len(subs) for subs in state.subscriptions.values())
+
+    def publish(self, username, payload, app=None):
+        """Hand `payload` to every open stream of `username`"""
+
+        state = self._state(app)
+        with state.lock:
+            subscriptions = list(state.subscriptions.get(username, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(payload)
+            except queue.Full:
+                subscription.overflowed = True
+
+    def _start_listener(self, state):
+        if state.listener is not None:
+            return
+        with state.lock:
+            if state.listener is None:
+                state.listener = threading.Thread(
+                    target=self._listen, args=(state,),
+                    name="message-listener", daemon=True)
+                state.listener.start()
+
+    def _listen(self, state):
+        """LISTEN on the notify channel and republish locally, reconnecting
+        if the connection drops"""
+
+        app = state.app
+        channel = app.config['MESSAGE_NOTIFY_CHANNEL']
+        while True:
+            try:
+                with app.app_context():
+                    raw = db.engine.raw_connection()
+                # keep this connection out of the pool for good
+                raw.detach()
+                conn = raw.connection
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{channel}"')
+
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        payload = json.loads(notify.payload)
+                        self.publish(payload["to_user_name"], payload, app)
+            except Exception:
+                logger.exception("Message listener failed, reconnecting")
+                time.sleep(1)
+
+
+message_broker = MessageBroker()
+
+
+def _notify_payload(message):
+    payload = json.dumps(message)
+    if len(payload.encode()) > MAX_NOTIFY_BYTES:
+        # too big to NOTIFY, the client fetches it from the thread
+        payload = json.dumps({"id": message["id"],
+                              "from_user_name": message["from_user_name"],
+                              "to_user_name": message["to_user_name"],
+                              "truncated": True})
+    return payload
+
+
+def _broker_app(session):
+    """The app whose broker this session's messages go to, None if it
+    has none"""
+
+    app = getattr(session, 'app', None)
+    if app is None or 'message_broker' not in app.extensions:
+        return None
+    return app
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_messages(session, flush_context):
+    """Queue new messages for publishing once the transaction commits, or
+    NOTIFY them inside it when the postgres bridge is on"""
+
+    messages = [obj.serialize() for obj in session.new
+                if isinstance(obj, Message)]
+    app = _broker_app(session)
+    if not messages or app is None:
+        return
+
+    if message_broker.bridged(app):
+        channel = app.config['MESSAGE_NOTIFY_CHANNEL']
+        for message in messages:
+            session.connection().execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": channel, "payload": _notify_payload(message)})
+    else:
+        session.info.setdefault('new_messages', []).extend(messages)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_new_messages(session):
+    messages = session.info.pop('new_messages', ())
+    app = _broker_app(session)
+    if app is None:
+        return
+    for message in messages:
+        message_broker.publish(message["to_user_name"], message, app)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_new_messages(session):
+    session.info.pop('new_messages', None)
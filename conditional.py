@@ -0,0 +1,59 @@
+"""Conditional GET support
+
+Read endpoints decorated with @conditional_get(scope) answer
+If-None-Match / If-Modified-Since with a 304 after a single primary-key
+lookup of the scope's ChangeVersion, without loading or serializing rows.
+"""
+
+from datetime import timezone
+from functools import wraps
+from flask import current_app, g, make_response, request
+from models import ChangeVersion
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # clients may keep the body but must revalidate before using it
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_get(scope):
+    """Tag responses with the current version of `scope` and answer 304
+    when the client already has it"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version, updated_at = ChangeVersion.current(scope)
+            # for views that cache by version
+            g.change_version = version
+            etag = f"{scope}-{version}"
+            last_modified = None
+            if updated_at:
+                # HTTP dates have second resolution
+                last_modified = updated_at.replace(
+                    microsecond=0, tzinfo=timezone.utc)
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+                return _set_validators(response, etag, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                _set_validators(response, etag, last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
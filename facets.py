@@ -0,0 +1,96 @@
+"""Short-lived cache of listing facets
+
+The price histogram and location/owner counts shown next to search
+results change only when listings do, and many users ask for the same
+handful of filters. Results are cached per normalized filter (and per
+listings change version, so writes show up at once) for a few seconds;
+a hit costs a dict lookup instead of an aggregate over every matching
+listing.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+
+def facet_key(filters, buckets, version):
+    """Cache key of filters from parse_listing_filters: filters that mean
+    the same thing give the same key"""
+
+    def number(value):
+        return None if value is None else str(value.normalize())
+
+    # Listing.filtered matches location case-insensitively
+    return (number(filters["min_price"]), number(filters["max_price"]),
+            filters["location"].lower() if filters["location"] else None,
+            filters["owner"], buckets, version)
+
+
+class _Entries:
+    """One app's cache entries and counters"""
+
+    def __init__(self, app):
+        self.app = app
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+class FacetCache:
+    """LRU cache whose entries expire after FACETS_CACHE_SECONDS, one per
+    app (kept in app.extensions)
+
+    config:
+    FACETS_CACHE_SECONDS: how long an entry is served, 0 turns caching off
+    FACETS_CACHE_SIZE: most entries kept
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FACETS_CACHE_SECONDS', 30)
+        app.config.setdefault('FACETS_CACHE_SIZE', 1024)
+        app.extensions['facet_cache'] = _Entries(app)
+
+    def _state(self):
+        app = self.app if self.app is not None else current_app
+        return app.extensions['facet_cache']
+
+    def clear(self):
+        state = self._state()
+        with state.lock:
+            state.entries.clear()
+
+    def get(self, key, compute):
+        """Cached value for `key`, or compute() it and cache it"""
+
+        state = self._state()
+        ttl = state.app.config['FACETS_CACHE_SECONDS']
+        now = time.monotonic()
+        with state.lock:
+            entry = state.entries.get(key)
+            if entry is not None and entry[0] > now:
+                state.entries.move_to_end(key)
+                state.hits += 1
+                return entry[1]
+
+        # computed outside the lock; concurrent misses on one key just
+        # compute it twice
+        value = compute()
+        with state.lock:
+            state.misses += 1
+            if ttl:
+                state.entries[key] = (now + ttl, value)
+                state.entries.move_to_end(key)
+                size = state.app.config['FACETS_CACHE_SIZE']
+                while len(state.entries) > size:
+                    state.entries.popitem(last=False)
+        return value
+
+
+facet_cache = FacetCache()
@@ -0,0 +1,87 @@
+"""Geohash helpers for radius search
+
+Listings store the geohash of their coordinates. Every point within
+`radius_km` of a center lies in the 3x3 block of geohash cells around the
+center's cell once the cells are at least radius_km across, so a radius
+search only has to look at listings whose geohash starts with one of
+those nine prefixes (a btree prefix scan) before checking exact distances.
+"""
+
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+# ~5m cells, finer than any search needs
+GEOHASH_PRECISION = 9
+
+
+def _spread(bits):
+    """Spread the low 32 bits of an int out to the even bit positions"""
+
+    bits &= 0xFFFFFFFF
+    bits = (bits | bits << 16) & 0x0000FFFF0000FFFF
+    bits = (bits | bits << 8) & 0x00FF00FF00FF00FF
+    bits = (bits | bits << 4) & 0x0F0F0F0F0F0F0F0F
+    bits = (bits | bits << 2) & 0x3333333333333333
+    return (bits | bits << 1) & 0x5555555555555555
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point
+
+    Both coordinates are quantized to the longitude's bit count and
+    interleaved (longitude first) in one go, rather than bisecting bit by
+    bit, so seeding millions of listings stays fast."""
+
+    total = 5 * precision
+    bits = (total + 1) // 2
+    scale = 1 << bits
+    lat = min(int((latitude + 90.0) / 180.0 * scale), scale - 1)
+    lng = min(int((longitude + 180.0) / 360.0 * scale), scale - 1)
+    code = (_spread(lng) << 1 | _spread(lat)) >> (2 * bits - total)
+    return "".join(BASE32[code >> shift & 31]
+                   for shift in range(total - 5, -1, -5))
+
+
+def cell_degrees(precision):
+    """(height, width) in degrees of a geohash cell"""
+
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells cover every point within radius_km,
+    or None when no precision is coarse enough (huge radius, or near a
+    pole) and every listing has to be checked"""
+
+    # cells narrow towards the poles, size them for the poleward edge
+    edge = min(90.0, abs(latitude) + radius_km / KM_PER_DEGREE)
+    shrink = math.cos(math.radians(edge))
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_degrees(precision)
+        if (height * KM_PER_DEGREE >= radius_km and
+                width * KM_PER_DEGREE * shrink >= radius_km):
+            break
+    else:
+        return None
+
+    prefixes = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            lat = max(-90.0, min(90.0, latitude + dy * height))
+            lng = (longitude + dx * width + 180.0) % 360.0 - 180.0
+            prefixes.add(encode(lat, lng, precision))
+    return sorted(prefixes)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points"""
+
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -1,4 +1,346 @@
 import jwt
+import base64
+import binascii
+import json
+import math
+import multiprocessing
+import orjson
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+LISTING_SORTS = ("id", "price")
+PHOTO_SIZES = ("thumb", "medium", "original")
+MAX_STAY_DAYS = 365
+DEFAULT_RADIUS_KM = 10
+MAX_RADIUS_KM = 200
+DEFAULT_FACET_BUCKETS = 20
+MAX_FACET_BUCKETS = 100
+# PriceRule.weekdays bit i is WEEKDAYS[i]
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MAX_QUOTE_STAYS = 20
+MAX_QUOTE_SPAN_DAYS = 2 * 365
+# price_rules.priority is an INTEGER
+MAX_PRIORITY = 2 ** 31 - 1
+CENT = Decimal("0.01")
+# Numeric(9, 2)
+MAX_PRICE = Decimal("9999999.99")
+MAX_BULK_LISTINGS = 500
+MAX_LISTING_PHOTOS = 20
+# what parsing request input can raise; routes answer these with a 400
+INVALID_INPUT = (TypeError, ValueError, InvalidOperation)
+# how the image and password process pools start their workers: forked
+# ones would inherit the web worker's threads, held locks and database
+# connections, so start them from a clean server process instead (spawn
+# where there is no forkserver)
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+    else "spawn")
+
 
 def get_token(username):
 	return jwt.encode({username: username})
+
+
+def _cursor_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row on a page into an opaque,
+    url-safe token"""
+    raw = json.dumps([_cursor_value(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Unpack a token made by encode_cursor, raises ValueError if invalid"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _cursor_int(value):
+    if type(value) is not int:
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def _cursor_float(value):
+    if type(value) not in (int, float) or not math.isfinite(value):
+        raise ValueError("Invalid cursor")
+    return float(value)
+
+
+def _cursor_str(value):
+    if not isinstance(value, str):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def _cursor_decimal(value):
+    return _to_decimal(_cursor_str(value), "cursor")
+
+
+def _cursor_datetime(value):
+    return datetime.fromisoformat(_cursor_str(value))
+
+
+_CURSOR_READERS = {
+    int: _cursor_int,
+    float: _cursor_float,
+    str: _cursor_str,
+    Decimal: _cursor_decimal,
+    datetime: _cursor_datetime,
+}
+
+
+def read_cursor(cursor, *kinds):
+    """Check a decoded cursor holds one value of each kind (int, float,
+    str, Decimal or datetime) of the sort key, raises ValueError if not.
+    returns the values converted to those kinds"""
+    if len(cursor) != len(kinds):
+        raise ValueError("Invalid cursor")
+    try:
+        return [_CURSOR_READERS[kind](value)
+                for value, kind in zip(cursor, kinds)]
+    except INVALID_INPUT:
+        raise ValueError("Invalid cursor")
+
+
+def dump_json(data):
+    """Encode like jsonify (sorted keys, compact, trailing newline, with
+    JSON_AS_ASCII off) but several times faster; returns bytes"""
+    return orjson.dumps(
+        data, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+
+def _to_decimal(value, name):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a number")
+    # NaN, sNaN and Infinity parse, but can't be compared or stored
+    if not number.is_finite():
+        raise ValueError(f"{name} must be a number")
+    return number
+
+
+def parse_page_args(args):
+    """Read limit/cursor query params, raises ValueError if invalid"""
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+
+    cursor = args.get("cursor")
+    return {
+        "limit": min(limit, MAX_PAGE_SIZE),
+        "cursor": decode_cursor(cursor) if cursor else None,
+    }
+
+
+def parse_price(value, name="price"):
+    """Read a price, raises ValueError if invalid. returns it rounded to
+    cents the way postgres stores it, so it serializes the same before
+    and after a round trip"""
+    price = _to_decimal(str(value), name)
+    if not price.is_finite() or not 0 <= price <= MAX_PRICE:
+        raise ValueError(f"{name} must be between 0 and {MAX_PRICE}")
+    return price.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def parse_listing_filters(args):
+    """Read listing filter query params, raises ValueError if invalid
+    returns dict of keyword args for Listing.filtered, normalized so
+    filters that mean the same thing are equal"""
+    filters = {
+        "min_price": None,
+        "max_price": None,
+        "location": (args.get("location") or "").strip() or None,
+        "owner": args.get("owner") or None,
+    }
+    for name in ("min_price", "max_price"):
+        if args.get(name):
+            filters[name] = _to_decimal(args[name], name)
+    return filters
+
+
+def parse_photo_size(args):
+    """Read the photo size query param, raises ValueError if invalid"""
+    size = args.get("size", "original")
+    if size not in PHOTO_SIZES:
+        raise ValueError(f"size must be one of {PHOTO_SIZES}")
+    return size
+
+
+def parse_date_range(args):
+    """Read start/end query params (YYYY-MM-DD), raises ValueError if
+    invalid. returns (start, end) dates, end is the checkout day"""
+    try:
+        start = date.fromisoformat(args.get("start", ""))
+        end = date.fromisoformat(args.get("end", ""))
+    except (TypeError, ValueError):
+        raise ValueError("start and end must be dates like 2021-10-31")
+    if end <= start:
+        raise ValueError("end must be after start")
+    if (end - start).days > MAX_STAY_DAYS:
+        raise ValueError(f"stays are at most {MAX_STAY_DAYS} days")
+    return start, end
+
+
+def parse_coordinates(args, lat_name="lat", lng_name="lng"):
+    """Read a latitude/longitude pair, raises ValueError if invalid
+    returns (latitude, longitude), or (None, None) if both are missing"""
+    latitude, longitude = args.get(lat_name), args.get(lng_name)
+    if latitude in (None, "") and longitude in (None, ""):
+        return None, None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError(f"{lat_name} and {lng_name} must both be numbers")
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError(f"{lat_name} must be within [-90, 90] and "
+                         f"{lng_name} within [-180, 180]")
+    return latitude, longitude
+
+
+def parse_radius(args):
+    """Read the radius param (km), raises ValueError if invalid"""
+    try:
+        radius = float(args.get("radius", DEFAULT_RADIUS_KM))
+    except ValueError:
+        raise ValueError("radius must be a number")
+    if not 0 < radius <= MAX_RADIUS_KM:
+        raise ValueError(f"radius must be over 0 and at most "
+                         f"{MAX_RADIUS_KM} km")
+    return radius
+
+
+def parse_facet_buckets(args):
+    """Read the buckets param, raises ValueError if invalid"""
+    try:
+        buckets = int(args.get("buckets", DEFAULT_FACET_BUCKETS))
+    except ValueError:
+        raise ValueError("buckets must be an integer")
+    if not 1 <= buckets <= MAX_FACET_BUCKETS:
+        raise ValueError(f"buckets must be between 1 and {MAX_FACET_BUCKETS}")
+    return buckets
+
+
+def parse_price_rule(data):
+    """Read a price rule from JSON, raises ValueError if invalid
+    returns dict of keyword args for PriceRule
+
+    {"name": "summer", "nightly_price": "150.00", "start_date":
+     "2021-06-01", "end_date": "2021-09-01", "weekdays": ["fri", "sat"],
+     "priority": 1}, every field but name and nightly_price is optional"""
+    if not isinstance(data, dict) or not data.get("name"):
+        raise ValueError("name is required")
+    price = parse_price(data.get("nightly_price"), "nightly_price")
+
+    dates = {}
+    for name in ("start_date", "end_date"):
+        try:
+            dates[name] = (date.fromisoformat(data[name])
+                           if data.get(name) else None)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a date like 2021-10-31")
+    if dates["start_date"] and dates["end_date"] and \
+            dates["end_date"] <= dates["start_date"]:
+        raise ValueError("end_date must be after start_date")
+
+    weekdays = None
+    if data.get("weekdays"):
+        try:
+            weekdays = sum(1 << WEEKDAYS.index(day.lower()[:3])
+                           for day in set(data["weekdays"]))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError(f"weekdays must be a list of {WEEKDAYS}")
+
+    priority = data.get("priority", 0)
+    if isinstance(priority, str):
+        try:
+            priority = int(priority)
+        except ValueError:
+            pass
+    if not isinstance(priority, int) or isinstance(priority, bool) or \
+            not -MAX_PRIORITY - 1 <= priority <= MAX_PRIORITY:
+        raise ValueError(f"priority must be an integer between "
+                         f"{-MAX_PRIORITY - 1} and {MAX_PRIORITY}")
+
+    return {"name": str(data["name"]), "nightly_price": price,
+            "weekdays": weekdays, "priority": priority, **dates}
+
+
+def parse_quote_request(data):
+    """Read {"listing_ids": [...], "stays": [{"start", "end"}, ...]},
+    raises ValueError if invalid. returns (listing_ids, [(start, end)])"""
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    listing_ids, stays = data.get("listing_ids"), data.get("stays")
+    if not isinstance(listing_ids, list) or not listing_ids or not all(
+            isinstance(listing_id, int) for listing_id in listing_ids):
+        raise ValueError("listing_ids must be a list of ids")
+    if len(listing_ids) > MAX_PAGE_SIZE:
+        raise ValueError(f"at most {MAX_PAGE_SIZE} listings per request")
+    if not isinstance(stays, list) or not stays:
+        raise ValueError("stays must be a list of {start, end}")
+    if len(stays) > MAX_QUOTE_STAYS:
+        raise ValueError(f"at most {MAX_QUOTE_STAYS} stays per request")
+
+    ranges = [parse_date_range(stay if isinstance(stay, dict) else {})
+              for stay in stays]
+    span = (max(end for _, end in ranges) -
+            min(start for start, _ in ranges)).days
+    if span > MAX_QUOTE_SPAN_DAYS:
+        raise ValueError(f"stays must fall within {MAX_QUOTE_SPAN_DAYS} days")
+    return listing_ids, ranges
+
+
+def parse_bulk_listings(data):
+    """Read {"listings": [{title, price, description, location, latitude,
+    longitude, photos: [image urls]}]}, raises ValueError naming the
+    first invalid listing. returns a list of dicts with the same keys"""
+    listings = data.get("listings") if isinstance(data, dict) else None
+    if not isinstance(listings, list) or not listings:
+        raise ValueError("listings must be a non-empty list")
+    if len(listings) > MAX_BULK_LISTINGS:
+        raise ValueError(f"at most {MAX_BULK_LISTINGS} listings per request")
+
+    parsed = []
+    for i, listing in enumerate(listings):
+        try:
+            if not isinstance(listing, dict):
+                raise ValueError("must be an object")
+            fields = {}
+            for name in ("title", "description", "location"):
+                if not isinstance(listing.get(name), str) or \
+                        not listing[name].strip():
+                    raise ValueError(f"{name} is required")
+                fields[name] = listing[name]
+            fields["price"] = parse_price(listing.get("price"))
+            fields["latitude"], fields["longitude"] = parse_coordinates(
+                listing, "latitude", "longitude")
+            photos = listing.get("photos", [])
+            if not isinstance(photos, list) or not all(
+                    isinstance(url, str) and url for url in photos):
+                raise ValueError("photos must be a list of image urls")
+            if len(photos) > MAX_LISTING_PHOTOS:
+                raise ValueError(f"at most {MAX_LISTING_PHOTOS} photos")
+            fields["photos"] = photos
+        except ValueError as e:
+            raise ValueError(f"listings[{i}]: {e}")
+        parsed.append(fields)
+    return parsed
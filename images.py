@@ -0,0 +1,101 @@
+"""Image derivative pipeline
+
+Resizes uploaded listing photos into thumbnail and medium variants, as
+JPEG and WebP, in a pool of worker processes so the CPU-heavy resizing
+doesn't hold the GIL of the web worker.
+
+    image_pipeline = ImagePipeline()
+    image_pipeline.init_app(app)
+    variants = image_pipeline.derive(data)
+"""
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from flask import current_app
+from helpers import MP_CONTEXT
+
+# longest edge in pixels of each variant
+VARIANT_SIZES = {
+    "thumb": 320,
+    "medium": 1024,
+}
+
+VARIANT_FORMATS = {
+    # column suffix: (Pillow format, content type)
+    "url": ("JPEG", "image/jpeg"),
+    "webp_url": ("WEBP", "image/webp"),
+}
+
+QUALITY = 82
+
+
+def make_variants(data):
+    """Resize image bytes into every variant
+
+    returns {Listing_Photo column: (bytes, content type)}, e.g.
+    {"thumb_url": (b"...", "image/jpeg"), "thumb_webp_url": ...}
+    runs in a worker process, so it must stay a top-level function"""
+
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    for size, edge in VARIANT_SIZES.items():
+        resized = image.copy()
+        # keeps aspect ratio and never scales up
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        for suffix, (fmt, content_type) in VARIANT_FORMATS.items():
+            buf = io.BytesIO()
+            resized.save(buf, fmt, quality=QUALITY)
+            variants[f"{size}_{suffix}"] = (buf.getvalue(), content_type)
+
+    return variants
+
+
+class _PipelineState:
+    """One app's process pool"""
+
+    def __init__(self):
+        self.executor = None
+        self.lock = Lock()
+
+
+class ImagePipeline:
+    """Lazily started process pool running make_variants, one pool per
+    app (kept in app.extensions)
+
+    config:
+    IMAGE_WORKERS: number of worker processes (default: one per CPU)
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_WORKERS', os.cpu_count() or 1)
+        app.extensions['image_pipeline'] = _PipelineState()
+
+    def derive(self, data):
+        """Make every variant of `data`, blocking until the pool is done"""
+
+        return self._pool().submit(make_variants, data).result()
+
+    def _pool(self):
+        app = self.app if self.app is not None else current_app
+        state = app.extensions['image_pipeline']
+        if state.executor is None:
+            with state.lock:
+                if state.executor is None:
+                    state.executor = ProcessPoolExecutor(
+                        max_workers=app.config['IMAGE_WORKERS'],
+                        mp_context=MP_CONTEXT)
+        return state.executor
+
+
+image_pipeline = ImagePipeline()
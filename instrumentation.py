@@ -0,0 +1,153 @@
+"""Per-request performance instrumentation
+
+For a sample of requests, records the number of SQL statements, time
+spent in the database, time spent calling S3 and total time. The numbers
+are sent back in a Server-Timing header (visible in browser dev tools) and
+logged as one JSON line on the "sharebnb.perf" logger.
+
+    instrumentation = Instrumentation()
+    instrumentation.init_app(app)
+
+    @track_s3
+    def upload_fileobj_s3(...):
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("sharebnb.perf")
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Counters for the request being handled on this thread"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.s3_count = 0
+        self.s3_ms = 0.0
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        return (f'db;dur={self.sql_ms:.1f};desc="{self.sql_count} queries", '
+                f's3;dur={self.s3_ms:.1f};desc="{self.s3_count} calls", '
+                f'total;dur={self.total_ms():.1f}')
+
+
+def current_metrics():
+    """Metrics of the sampled request on this thread, None if not sampled"""
+
+    return getattr(_local, "metrics", None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    if current_metrics() is not None:
+        conn.info.setdefault("perf_start", []).append(time.perf_counter())
+
+
+def _count_statement(conn):
+    # pop even when not sampled, so starts never pile up on a connection
+    starts = conn.info.get("perf_start")
+    if not starts:
+        return
+    start = starts.pop()
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.sql_count += 1
+        metrics.sql_ms += (time.perf_counter() - start) * 1000
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context,
+                   executemany):
+    _count_statement(conn)
+
+
+@event.listens_for(Engine, "handle_error")
+def _failed_statement(context):
+    # a failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        _count_statement(context.connection)
+
+
+def track_s3(fn):
+    """Count time spent in an S3 call towards the current request"""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        metrics = current_metrics()
+        if metrics is None:
+            return fn(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.s3_count += 1
+            metrics.s3_ms += (time.perf_counter() - start) * 1000
+
+    return wrapper
+
+
+class Instrumentation:
+    """Sets up sampling, the Server-Timing header and the perf log
+
+    config:
+    PERF_SAMPLE_RATE: fraction of requests to measure (default 1%), 0
+    turns it off
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PERF_SAMPLE_RATE', 0.01)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._clear)
+        app.extensions['instrumentation'] = self
+
+    def _start(self):
+        rate = current_app.config['PERF_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            _local.metrics = RequestMetrics()
+
+    def _finish(self, response):
+        metrics = current_metrics()
+        if metrics is None:
+            return response
+
+        response.headers['Server-Timing'] = metrics.server_timing()
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "sql_count": metrics.sql_count,
+            "db_ms": round(metrics.sql_ms, 2),
+            "s3_count": metrics.s3_count,
+            "s3_ms": round(metrics.s3_ms, 2),
+            "total_ms": round(metrics.total_ms(), 2),
+        }))
+        return response
+
+    def _clear(self, exc):
+        _local.metrics = None
+
+
+instrumentation = Instrumentation()
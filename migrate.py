@@ -0,0 +1,92 @@
+"""Versioned schema migrations
+
+The schema lives in migrations/NNNN_name.sql files, applied in order, each
+in its own transaction. Applied versions are recorded in the
+schema_migrations table so every file runs once per database.
+
+    flask db-upgrade
+    python migrate.py --database-url postgresql:///sharebnb-test
+
+New migrations must be plain SQL without "%" (the files are run as-is
+through psycopg2) and are never edited once they have been applied.
+"""
+
+import argparse
+import os
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'migrations')
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version TEXT PRIMARY KEY,
+        applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+            DEFAULT (now() at time zone 'utc')
+    )
+"""
+
+
+def available():
+    """(version, path) of every migration file, in order"""
+
+    return [(filename[:-len('.sql')], os.path.join(MIGRATIONS_DIR, filename))
+            for filename in sorted(os.listdir(MIGRATIONS_DIR))
+            if filename.endswith('.sql')]
+
+
+def applied(engine):
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_TABLE_SQL))
+        return {row.version for row in
+                conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine):
+    """Apply pending migrations, returns the versions applied"""
+
+    done = applied(engine)
+    versions = []
+    for version, path in available():
+        if version in done:
+            continue
+        with open(path) as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            # straight to the DBAPI cursor: a file has many statements
+            conn.connection.cursor().execute(sql)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version) VALUES (:v)"),
+                {"v": version})
+        versions.append(version)
+    return versions
+
+
+def init_app(app):
+    """Add the `flask db-upgrade` command"""
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        """Apply pending schema migrations."""
+
+        from models import db
+        versions = upgrade(db.get_engine(app))
+        for version in versions:
+            print(f"applied {version}")
+        if not versions:
+            print("database is up to date")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url", default=os.environ.get(
+        "DATABASE_URL", "postgresql:///sharebnb"))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    for version in upgrade(engine):
+        print(f"applied {version}")
+
+
+if __name__ == "__main__":
+    main()
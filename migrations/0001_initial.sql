@@ -0,0 +1,45 @@
+-- Tables as they were first created by db.create_all()
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    bio TEXT,
+    location TEXT,
+    image_url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS listings (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    price NUMERIC(9, 2) NOT NULL,
+    description TEXT NOT NULL,
+    location TEXT NOT NULL,
+    listing_owner TEXT REFERENCES users (username) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS listing_photos (
+    id SERIAL PRIMARY KEY,
+    listing_id INTEGER REFERENCES listings (id) ON DELETE CASCADE,
+    image_url TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bookings (
+    id SERIAL PRIMARY KEY,
+    renter_username TEXT NOT NULL
+        REFERENCES users (username) ON DELETE CASCADE,
+    listing_id INTEGER NOT NULL REFERENCES listings (id) ON DELETE CASCADE,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    start_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    end_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    total_price NUMERIC(9, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id SERIAL PRIMARY KEY,
+    text TEXT NOT NULL,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    to_user_name TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+    from_user_name TEXT NOT NULL
+        REFERENCES users (username) ON DELETE CASCADE
+);
@@ -0,0 +1,71 @@
+-- Everything models.py grew on top of the initial tables: listing
+-- search and pagination indexes, pending uploads and image variants,
+-- message indexes, conversation summaries and change versions.
+-- Safe to run on a database that create_all() already brought up to date.
+
+-- listings: full text search and keyset pagination
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') ||
+        setweight(to_tsvector('english', location), 'B') ||
+        setweight(to_tsvector('english', description), 'C')) STORED;
+CREATE INDEX IF NOT EXISTS ix_listings_search_vector
+    ON listings USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS ix_listings_price_id ON listings (price, id);
+CREATE INDEX IF NOT EXISTS ix_listings_owner_id
+    ON listings (listing_owner, id);
+CREATE INDEX IF NOT EXISTS ix_listings_lower_location
+    ON listings (lower(location));
+
+-- photos: lookups by listing, background uploads and resized variants
+CREATE INDEX IF NOT EXISTS ix_listing_photos_listing_id
+    ON listing_photos (listing_id);
+ALTER TABLE listing_photos
+    ADD COLUMN IF NOT EXISTS upload_status TEXT NOT NULL DEFAULT 'done',
+    ADD COLUMN IF NOT EXISTS thumb_url TEXT,
+    ADD COLUMN IF NOT EXISTS thumb_webp_url TEXT,
+    ADD COLUMN IF NOT EXISTS medium_url TEXT,
+    ADD COLUMN IF NOT EXISTS medium_webp_url TEXT;
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS upload_status TEXT NOT NULL DEFAULT 'done';
+
+-- messages: threads and inbox pages
+CREATE INDEX IF NOT EXISTS ix_messages_thread
+    ON messages (from_user_name, to_user_name, timestamp, id);
+CREATE INDEX IF NOT EXISTS ix_messages_inbox
+    ON messages (to_user_name, timestamp, id);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    username TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+    counterpart TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+    last_message_id INTEGER NOT NULL,
+    last_message_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    unread_count INTEGER NOT NULL,
+    PRIMARY KEY (username, counterpart)
+);
+CREATE INDEX IF NOT EXISTS ix_conversation_summaries_recent
+    ON conversation_summaries (username, last_message_at, counterpart);
+
+-- summaries of conversations that predate the table; every existing
+-- message counts as unread, as there was no way to mark them read
+INSERT INTO conversation_summaries
+    (username, counterpart, last_message_id, last_message_at, unread_count)
+SELECT username, counterpart,
+       (array_agg(id ORDER BY timestamp DESC, id DESC))[1],
+       max(timestamp), sum(unread)
+FROM (SELECT to_user_name AS username, from_user_name AS counterpart,
+             id, timestamp, 1 AS unread
+      FROM messages
+      UNION ALL
+      SELECT from_user_name, to_user_name, id, timestamp, 0
+      FROM messages) m
+GROUP BY username, counterpart
+ON CONFLICT (username, counterpart) DO NOTHING;
+
+-- ETag versions for conditional GETs
+CREATE TABLE IF NOT EXISTS change_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
@@ -0,0 +1,10 @@
+-- Coordinates given when a listing is made, and the geohash index used
+-- by /listings/nearby
+
+ALTER TABLE listings
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS geohash TEXT;
+
+CREATE INDEX IF NOT EXISTS ix_listings_geohash
+    ON listings (geohash text_pattern_ops);
@@ -0,0 +1,15 @@
+-- Seasonal and weekend nightly prices, used by POST /quotes
+
+CREATE TABLE IF NOT EXISTS price_rules (
+    id SERIAL PRIMARY KEY,
+    listing_id INTEGER NOT NULL REFERENCES listings (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    start_date DATE,
+    end_date DATE,
+    weekdays INTEGER,
+    priority INTEGER NOT NULL DEFAULT 0,
+    nightly_price NUMERIC(9, 2) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_price_rules_listing_id
+    ON price_rules (listing_id);
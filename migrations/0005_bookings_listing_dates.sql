@@ -0,0 +1,4 @@
+-- Bookings by listing and dates, for /listings/available
+
+CREATE INDEX IF NOT EXISTS ix_bookings_listing_dates
+    ON bookings (listing_id, start_date, end_date);
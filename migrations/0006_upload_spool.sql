@@ -0,0 +1,5 @@
+-- Spool name of pending uploads, for `flask resume-uploads`
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS upload_spool TEXT;
+
+ALTER TABLE listing_photos ADD COLUMN IF NOT EXISTS upload_spool TEXT;
@@ -1,12 +1,23 @@
-import jwt
 # from app import app
-from flask_sqlalchemy import SQLAlchemy
+import logging
+from routing import RoutingSQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import (REAL, TSVECTOR,
+                                            aggregate_order_by,
+                                            insert as pg_insert)
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from flask_bcrypt import Bcrypt
+from decimal import Decimal
+from passwords import password_hasher
+from helpers import WEEKDAYS, read_cursor
+from geo import (EARTH_RADIUS_KM, covering_prefixes,
+                 encode as geohash_encode)
+from auth import token_auth
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+logger = logging.getLogger(__name__)
 
 
 def connect_db(app):
@@ -51,12 +62,320 @@ class Listing(db.Model):
         db.ForeignKey('users.username', ondelete='CASCADE'),
     )
 
+    # given by the client when the listing is made, optional
+    latitude = db.Column(
+        db.Float,
+        nullable=True,
+    )
+
+    longitude = db.Column(
+        db.Float,
+        nullable=True,
+    )
+
+    # kept in sync with the coordinates by set_geohash below, for radius
+    # search with prefix scans of ix_listings_geohash
+    geohash = db.Column(
+        db.Text,
+        nullable=True,
+    )
+
+    # generated by postgres so it is always in sync with the text columns,
+    # title matches rank above location, location above description
+    search_vector = db.deferred(db.Column(
+        TSVECTOR,
+        db.Computed(
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', location), 'B') || "
+            "setweight(to_tsvector('english', description), 'C')",
+            persisted=True,
+        ),
+    ))
+
     bookings = db.relationship('Booking', order_by='Booking.timestamp.desc()')
 
     photos = db.relationship('Listing_Photo', order_by='Listing_Photo.id')
 
-    def serialize(self):
-        """serialize data, currently assuming only one photo"""
+    __table_args__ = (
+        db.Index('ix_listings_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+        # keyset pagination by (price, id) and by id within an owner
+        db.Index('ix_listings_price_id', 'price', 'id'),
+        db.Index('ix_listings_owner_id', 'listing_owner', 'id'),
+        # location filter is case-insensitive
+        db.Index('ix_listings_lower_location', db.func.lower(location)),
+        # text_pattern_ops so geohash LIKE 'prefix%' can use it
+        db.Index('ix_listings_geohash', 'geohash',
+                 postgresql_ops={'geohash': 'text_pattern_ops'}),
+    )
+
+    @classmethod
+    def filtered(cls, min_price=None, max_price=None, location=None,
+                 owner=None):
+        """Build a query for listings matching every given filter"""
+
+        query = cls.query
+        if min_price is not None:
+            query = query.filter(cls.price >= min_price)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        if location is not None:
+            query = query.filter(
+                db.func.lower(cls.location) == location.lower())
+        if owner is not None:
+            query = query.filter(cls.listing_owner == owner)
+        return query
+
+    @classmethod
+    def unbooked(cls, query, start, end):
+        """Narrow `query` to listings with no booked night in [start, end),
+        as one anti-join against bookings"""
+
+        booked = Booking.query.filter(
+            Booking.listing_id == cls.id,
+            db.cast(Booking.start_date, db.Date) < end,
+            db.cast(Booking.end_date, db.Date) > start)
+        return query.filter(~booked.exists())
+
+    @classmethod
+    def projected(cls, query, size="original"):
+        """`query` reduced to the columns serialize(size) returns, with the
+        photos aggregated to JSON in SQL. Rows come back as plain tuples
+        (row._mapping matches serialize()), no ORM objects are built."""
+
+        photo = Listing_Photo
+        if size == "original":
+            image_url, webp_url = photo.image_url, db.null()
+        else:
+            image_url = db.func.coalesce(getattr(photo, f"{size}_url"),
+                                         photo.image_url)
+            webp_url = getattr(photo, f"{size}_webp_url")
+
+        photos = db.select(db.func.coalesce(
+            db.func.json_agg(aggregate_order_by(
+                db.func.json_build_object(
+                    'id', photo.id,
+                    'listing_id', photo.listing_id,
+                    'image_url', image_url,
+                    'webp_url', webp_url),
+                photo.id)),
+            db.literal_column("'[]'::json"))
+        ).where(photo.listing_id == cls.id).scalar_subquery()
+
+        return query.with_entities(
+            cls.id, cls.title, db.cast(cls.price, db.Text).label("price"),
+            cls.description, cls.location, cls.listing_owner, cls.latitude,
+            cls.longitude, photos.label("photos"))
+
+    @classmethod
+    def paginate_keyset(cls, query, sort="id", cursor=None, limit=50):
+        """Return one page of `query` ordered by `sort` and the cursor
+        for the next page (None on the last page).
+
+        Pages start after the row the cursor points at rather than using
+        OFFSET, so every page costs one index range scan.
+        """
+
+        if sort == "price":
+            order = (cls.price, cls.id)
+            if cursor is not None:
+                price, listing_id = read_cursor(cursor, Decimal, int)
+                query = query.filter(
+                    db.tuple_(cls.price, cls.id) >
+                    db.tuple_(price, listing_id))
+        else:
+            order = (cls.id,)
+            if cursor is not None:
+                listing_id, = read_cursor(cursor, int)
+                query = query.filter(cls.id > listing_id)
+
+        rows = query.order_by(*order).limit(limit + 1).all()
+        if len(rows) <= limit:
+            return rows, None
+
+        rows = rows[:limit]
+        last = rows[-1]
+        if sort == "price":
+            return rows, (last.price, last.id)
+        return rows, (last.id,)
+
+    @classmethod
+    def facets(cls, query, buckets=20, limit=20):
+        """Price histogram and location/owner counts of `query`, from one
+        aggregate query (a single scan of the matching listings)
+
+        returns {"total", "price": {"min", "max", "buckets"},
+                 "locations", "owners"}: `buckets` equal-width price
+        ranges between the cheapest and dearest listing, and the `limit`
+        most common locations and owners
+        """
+
+        low = db.func.min(cls.price).over()
+        high = db.func.max(cls.price).over()
+        bucket = db.case(
+            (high == low, 0),
+            else_=db.func.least(
+                db.func.floor((cls.price - low) * buckets / (high - low)),
+                buckets - 1))
+        matching = query.with_entities(
+            cls.location, cls.listing_owner, bucket.label("bucket"),
+            low.label("low"), high.label("high")).subquery()
+
+        # grouping() is a bitmask of the columns a row is NOT grouped by:
+        # 3 = bucket row, 5 = location row, 6 = owner row, 7 = total
+        grouping = db.func.grouping(matching.c.bucket, matching.c.location,
+                                    matching.c.listing_owner)
+        count = db.func.count()
+        grouped = db.session.query(
+            grouping.label("grouping"), matching.c.bucket,
+            matching.c.location, matching.c.listing_owner,
+            db.func.min(matching.c.low).label("low"),
+            db.func.min(matching.c.high).label("high"),
+            count.label("count"),
+            db.func.row_number().over(
+                partition_by=grouping,
+                order_by=(count.desc(), matching.c.bucket,
+                          matching.c.location, matching.c.listing_owner)
+            ).label("rank"),
+        ).group_by(db.func.grouping_sets(
+            db.tuple_(matching.c.bucket), db.tuple_(matching.c.location),
+            db.tuple_(matching.c.listing_owner), db.tuple_())).subquery()
+
+        rows = (db.session.query(grouped)
+                .filter(grouped.c.rank <= max(buckets, limit))
+                .order_by(grouped.c.grouping, grouped.c.rank)
+                .all())
+
+        counts = [0] * buckets
+        locations, owners = [], []
+        total, low, high = 0, None, None
+        for row in rows:
+            if row.grouping == 3:
+                counts[int(row.bucket)] = row.count
+            elif row.grouping == 5 and row.rank <= limit:
+                locations.append({"location": row.location,
+                                  "count": row.count})
+            elif row.grouping == 6 and row.rank <= limit:
+                owners.append({"listing_owner": row.listing_owner,
+                               "count": row.count})
+            elif row.grouping == 7:
+                total, low, high = row.count, row.low, row.high
+
+        histogram = []
+        if total:
+            width = (high - low) / buckets
+            for i, bucket_count in enumerate(counts):
+                histogram.append({
+                    "min": str((low + width * i).quantize(low)),
+                    "max": str(high if i == buckets - 1 else
+                               (low + width * (i + 1)).quantize(low)),
+                    "count": bucket_count,
+                })
+
+        return {
+            "total": total,
+            "price": {"min": str(low) if total else None,
+                      "max": str(high) if total else None,
+                      "buckets": histogram},
+            "locations": locations,
+            "owners": owners,
+        }
+
+    @classmethod
+    def distance_km(cls, latitude, longitude):
+        """SQL expression: haversine distance of each listing from a point"""
+
+        lat1, lat2 = db.func.radians(latitude), db.func.radians(cls.latitude)
+        a = (db.func.power(db.func.sin((lat2 - lat1) / 2), 2) +
+             db.func.cos(lat1) * db.func.cos(lat2) *
+             db.func.power(db.func.sin(db.func.radians(
+                 cls.longitude - longitude) / 2), 2))
+        return 2 * EARTH_RADIUS_KM * db.func.asin(
+            db.func.least(1.0, db.func.sqrt(a)))
+
+    @classmethod
+    def nearby(cls, latitude, longitude, radius_km, cursor=None, limit=50,
+               size="original"):
+        """Return one page of projected rows (see projected) for listings
+        within radius_km of a point, nearest first, each with its
+        distance_km, and the cursor for the next page.
+
+        Only listings in the geohash cells around the point are read
+        (prefix scans of ix_listings_geohash), then exact distances are
+        checked.
+        """
+
+        distance = cls.distance_km(latitude, longitude)
+        query = cls.query.filter(distance <= radius_km)
+        prefixes = covering_prefixes(latitude, longitude, radius_km)
+        if prefixes is not None:
+            query = query.filter(db.or_(
+                *[cls.geohash.startswith(prefix) for prefix in prefixes]))
+        if cursor is not None:
+            last_distance, listing_id = read_cursor(cursor, float, int)
+            query = query.filter(
+                db.tuple_(distance, cls.id) >
+                db.tuple_(last_distance, listing_id))
+
+        rows = (cls.projected(query, size)
+                .add_columns(distance.label("distance_km"))
+                .order_by(distance, cls.id)
+                .limit(limit + 1)
+                .all())
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1].distance_km, rows[-1].id)
+        return rows, next_cursor
+
+    @classmethod
+    def stream(cls, query, sort="id", batch_size=500):
+        """Iterate over every row of `query` ordered by `sort`
+
+        Rows are fetched batch_size at a time through a server-side
+        cursor (photos with one selectin query per batch), and the
+        session only holds weak references to them, so memory stays flat
+        however many rows there are.
+        """
+
+        order = (cls.price, cls.id) if sort == "price" else (cls.id,)
+        return query.order_by(*order).yield_per(batch_size)
+
+    @classmethod
+    def search_ranked(cls, terms, cursor=None, limit=50):
+        """Full-text search over title, location and description.
+
+        Returns one page of listings, best match first, and the cursor for
+        the next page (None on the last page). `terms` uses web search
+        syntax: quoted phrases, `or`, and `-` to exclude a word.
+        """
+
+        tsquery = db.func.websearch_to_tsquery('english', terms)
+        rank = db.func.ts_rank_cd(cls.search_vector, tsquery)
+
+        query = (db.session.query(cls, rank)
+                 .options(selectinload(cls.photos))
+                 .filter(cls.search_vector.op('@@')(tsquery)))
+        if cursor is not None:
+            last_rank, listing_id = read_cursor(cursor, float, int)
+            # ts_rank_cd is a real; compare as one, or the widened value
+            # never equals the rank it came from and ties skip rows
+            query = query.filter(
+                db.tuple_(rank, cls.id) <
+                db.tuple_(db.cast(last_rank, REAL), listing_id))
+
+        rows = query.order_by(rank.desc(), cls.id.desc()).limit(limit + 1).all()
+        listings = [listing for listing, _ in rows[:limit]]
+        if len(rows) <= limit:
+            return listings, None
+
+        last_listing, last_rank = rows[limit - 1]
+        return listings, (last_rank, last_listing.id)
+
+    def serialize(self, size="original"):
+        """serialize data, photos use the `size` variant
+        (thumb, medium or original)"""
         return {
             "id": self.id,
             "title": self.title,
@@ -64,9 +383,82 @@ class Listing(db.Model):
             "description": self.description,
             "location": self.location,
             "listing_owner": self.listing_owner,
-            "photos": [photo.serialize() for photo in self.photos],
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "photos": [photo.serialize(size) for photo in self.photos],
         }
 
+    @classmethod
+    def create_many(cls, owner, listings, batch_size=1000):
+        """Insert `listings` (dicts from helpers.parse_bulk_listings) owned
+        by `owner`, with their photos, in the session's transaction; the
+        caller commits. Returns them serialized, in the order given.
+
+        Ids are reserved with one nextval() query, then each batch is one
+        multi-row INSERT for the listings and one INSERT ... RETURNING for
+        the photos, instead of a round trip per row."""
+
+        listing_table = cls.__table__
+        photo_table = Listing_Photo.__table__
+
+        sequence = db.func.pg_get_serial_sequence('listings', 'id')
+        ids = db.session.execute(
+            db.select(db.func.nextval(sequence))
+            .select_from(db.func.generate_series(1, len(listings)))
+        ).scalars().all()
+
+        rows = []
+        photos = []
+        for listing_id, listing in zip(ids, listings):
+            latitude, longitude = listing["latitude"], listing["longitude"]
+            # before_insert doesn't run for Core inserts
+            geohash = (None if latitude is None
+                       else geohash_encode(latitude, longitude))
+            rows.append({"id": listing_id,
+                         "title": listing["title"],
+                         "price": listing["price"],
+                         "description": listing["description"],
+                         "location": listing["location"],
+                         "listing_owner": owner,
+                         "latitude": latitude,
+                         "longitude": longitude,
+                         "geohash": geohash})
+            photos.extend({"listing_id": listing_id, "image_url": url}
+                          for url in listing["photos"])
+
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(
+                listing_table.insert().values(rows[start:start + batch_size]))
+
+        photos_by_listing = {listing_id: [] for listing_id in ids}
+        for start in range(0, len(photos), batch_size):
+            inserted = db.session.execute(
+                photo_table.insert()
+                .values(photos[start:start + batch_size])
+                .returning(photo_table.c.id, photo_table.c.listing_id,
+                           photo_table.c.image_url))
+            for photo_id, listing_id, image_url in inserted:
+                photos_by_listing[listing_id].append({
+                    "id": photo_id,
+                    "listing_id": listing_id,
+                    "image_url": image_url,
+                    "webp_url": None,
+                })
+
+        # collect_change_scopes only sees flushed objects
+        ChangeVersion.touch(db.session, 'listings')
+
+        created = []
+        for row in rows:
+            listing = {key: row[key] for key in
+                       ("id", "title", "price", "description", "location",
+                        "listing_owner", "latitude", "longitude")}
+            listing["price"] = str(listing["price"])
+            listing["photos"] = sorted(photos_by_listing[row["id"]],
+                                       key=lambda photo: photo["id"])
+            created.append(listing)
+        return created
+
 
 class Listing_Photo(db.Model):
     """store multiple photos per listing"""
@@ -81,6 +473,7 @@ class Listing_Photo(db.Model):
     listing_id = db.Column(
         db.Integer,
         db.ForeignKey('listings.id', ondelete='CASCADE'),
+        index=True,
     )
 
     image_url = db.Column(
@@ -88,14 +481,43 @@ class Listing_Photo(db.Model):
         nullable=False
     )
 
+    # pending while the background upload queue is still sending the file
+    upload_status = db.Column(
+        db.Text,
+        nullable=False,
+        default='done',
+    )
+
+    # UploadQueue spool name of a pending upload, so it can be resumed
+    # after a restart
+    upload_spool = db.Column(db.Text, nullable=True)
+
+    # resized variants, filled in by the image pipeline after upload
+    thumb_url = db.Column(db.Text, nullable=True)
+
+    thumb_webp_url = db.Column(db.Text, nullable=True)
+
+    medium_url = db.Column(db.Text, nullable=True)
+
+    medium_webp_url = db.Column(db.Text, nullable=True)
+
     listing = db.relationship('Listing')
 
-    def serialize(self):
-        """serialize data"""
+    def serialize(self, size="original"):
+        """serialize data
+        image_url is the `size` variant, falling back to the original until
+        the variant has been made; webp_url is None for the original"""
+        image_url = self.image_url
+        webp_url = None
+        if size != "original":
+            image_url = getattr(self, f"{size}_url") or self.image_url
+            webp_url = getattr(self, f"{size}_webp_url")
+
         return {
             "id": self.id,
             "listing_id": self.listing_id,
-            "image_url": self.image_url,
+            "image_url": image_url,
+            "webp_url": webp_url,
         }
 
 
@@ -138,6 +560,17 @@ class User(db.Model):
         nullable=True,
     )
 
+    # pending while the background upload queue is still sending the file
+    upload_status = db.Column(
+        db.Text,
+        nullable=False,
+        default='done',
+    )
+
+    # UploadQueue spool name of a pending upload, so it can be resumed
+    # after a restart
+    upload_spool = db.Column(db.Text, nullable=True)
+
     messages_sent = db.relationship('Message',
                                     primaryjoin='User.username==Message.from_user_name',
                                     order_by='Message.timestamp.desc()')
@@ -154,22 +587,10 @@ class User(db.Model):
     @classmethod
     def get_token(cls, username):
         """
-        Generates the Auth Token
+        Generates a short-lived access token
         :return: string
         """
-        try:
-            payload = {
-                # 'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1, seconds=5),
-                # 'iat': datetime.datetime.utcnow(),
-                'username': username
-            }
-            return jwt.encode(
-                payload,
-                'meow',
-                algorithm='HS256'
-            )
-        except Exception as e:
-            return e
+        return token_auth.create_token(username)
 
     @classmethod
     def signup(cls, username, email, password, bio, location, image_url):
@@ -178,7 +599,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         try:
             user = User(
@@ -206,13 +627,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the hash was made with a different cost than BCRYPT_LOG_ROUNDS
+        the password is rehashed; commit to save it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
 
         return False
@@ -264,11 +690,98 @@ class Booking(db.Model):
         nullable=False,
     )
 
+    __table_args__ = (
+        # Listing.unbooked looks bookings up by listing
+        db.Index('ix_bookings_listing_dates', 'listing_id', 'start_date',
+                 'end_date'),
+    )
+
     renter = db.relationship('User')
 
     listing = db.relationship('Listing')
 
 
+class PriceRule(db.Model):
+    """Nightly price override for some nights of a listing
+
+    A night matches when it falls in [start_date, end_date) (either end
+    may be open) and its weekday is in the `weekdays` bitmask (Monday = 1
+    ... Sunday = 64, None for every day). Of the rules matching a night the
+    one with the highest priority, then the newest, sets its price;
+    nights no rule matches cost the listing's price.
+    """
+
+    __tablename__ = 'price_rules'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    listing_id = db.Column(
+        db.Integer,
+        db.ForeignKey('listings.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    start_date = db.Column(
+        db.Date,
+        nullable=True,
+    )
+
+    end_date = db.Column(
+        db.Date,
+        nullable=True,
+    )
+
+    weekdays = db.Column(
+        db.Integer,
+        nullable=True,
+    )
+
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    nightly_price = db.Column(
+        db.Numeric(9, 2),
+        nullable=False,
+    )
+
+    @classmethod
+    def overlapping(cls, listing_ids, first, last):
+        """Rules of these listings that can match a night in [first, last)"""
+
+        return cls.query.filter(
+            cls.listing_id.in_(listing_ids),
+            db.or_(cls.start_date.is_(None), cls.start_date < last),
+            db.or_(cls.end_date.is_(None), cls.end_date > first),
+        ).all()
+
+    def serialize(self):
+        """serialize data"""
+        return {
+            "id": self.id,
+            "listing_id": self.listing_id,
+            "name": self.name,
+            "start_date": self.start_date and self.start_date.isoformat(),
+            "end_date": self.end_date and self.end_date.isoformat(),
+            "weekdays": [day for i, day in enumerate(WEEKDAYS)
+                         if self.weekdays is not None and
+                         self.weekdays & 1 << i] or None,
+            "priority": self.priority,
+            "nightly_price": str(self.nightly_price),
+        }
+
+
 class Message(db.Model):
     """Individual message between users"""
 
@@ -305,3 +818,325 @@ class Message(db.Model):
     to_user = db.relationship('User', foreign_keys=[to_user_name])
 
     from_user = db.relationship('User', foreign_keys=[from_user_name])
+
+    __table_args__ = (
+        # keyset pagination of one direction of a conversation, and of
+        # a user's inbox, newest first
+        db.Index('ix_messages_thread', 'from_user_name', 'to_user_name',
+                 'timestamp', 'id'),
+        db.Index('ix_messages_inbox', 'to_user_name', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def _before(cls, query, cursor):
+        """messages older than the (timestamp, id) cursor, newest first"""
+
+        if cursor is not None:
+            timestamp, message_id = read_cursor(cursor, datetime, int)
+            query = query.filter(
+                db.tuple_(cls.timestamp, cls.id) <
+                db.tuple_(timestamp, message_id))
+        return query.order_by(cls.timestamp.desc(), cls.id.desc())
+
+    @classmethod
+    def _page(cls, rows, limit):
+        """split a newest-first list into one page and the next cursor"""
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1].timestamp, rows[-1].id)
+
+    @classmethod
+    def thread(cls, username, other, cursor=None, limit=50):
+        """One page of the conversation between two users, newest first,
+        and the cursor for the next page (None on the last page).
+
+        Each direction is its own index range scan of ix_messages_thread,
+        so a page costs the same however many messages the users have.
+        """
+
+        rows = []
+        for sender, recipient in ((username, other), (other, username)):
+            query = cls.query.filter(cls.from_user_name == sender,
+                                     cls.to_user_name == recipient)
+            rows.extend(cls._before(query, cursor).limit(limit + 1))
+
+        rows.sort(key=lambda m: (m.timestamp, m.id), reverse=True)
+        return cls._page(rows, limit)
+
+    @classmethod
+    def inbox(cls, username, cursor=None, limit=50):
+        """One page of messages received by a user, newest first, and the
+        cursor for the next page (None on the last page)"""
+
+        query = cls._before(cls.query.filter(cls.to_user_name == username),
+                            cursor)
+        return cls._page(query.limit(limit + 1).all(), limit)
+
+    @classmethod
+    def since(cls, username, message_id, limit=100):
+        """Messages received by a user after the one with `message_id`,
+        oldest first, at most `limit` of them"""
+
+        return (cls.query
+                .filter(cls.to_user_name == username, cls.id > message_id)
+                .order_by(cls.id)
+                .limit(limit)
+                .all())
+
+    def serialize(self):
+        """serialize data"""
+        return {
+            "id": self.id,
+            "text": self.text,
+            "timestamp": self.timestamp.isoformat(),
+            "from_user_name": self.from_user_name,
+            "to_user_name": self.to_user_name,
+        }
+
+
+class ConversationSummary(db.Model):
+    """One row per (user, counterpart) conversation with its latest message
+    and how many messages the user hasn't read, kept up to date in the
+    same transaction as each message insert"""
+
+    __tablename__ = 'conversation_summaries'
+
+    username = db.Column(
+        db.Text,
+        db.ForeignKey('users.username', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    counterpart = db.Column(
+        db.Text,
+        db.ForeignKey('users.username', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    last_message_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    last_message_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    unread_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    __table_args__ = (
+        # a user's conversations, most recent first
+        db.Index('ix_conversation_summaries_recent', 'username',
+                 'last_message_at', 'counterpart'),
+    )
+
+    @classmethod
+    def record(cls, connection, message):
+        """Fold a just-inserted message into both users' summaries"""
+
+        table = cls.__table__
+        # lock rows in a fixed order so concurrent senders can't deadlock
+        rows = sorted([
+            (message.from_user_name, message.to_user_name, 0),
+            (message.to_user_name, message.from_user_name, 1),
+        ])
+        for username, counterpart, unread in rows:
+            stmt = pg_insert(table).values(
+                username=username,
+                counterpart=counterpart,
+                last_message_id=message.id,
+                last_message_at=message.timestamp,
+                unread_count=unread,
+            )
+            is_newer = stmt.excluded.last_message_at >= table.c.last_message_at
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.username, table.c.counterpart],
+                set_={
+                    'last_message_id': db.case(
+                        (is_newer, stmt.excluded.last_message_id),
+                        else_=table.c.last_message_id),
+                    'last_message_at': db.func.greatest(
+                        table.c.last_message_at,
+                        stmt.excluded.last_message_at),
+                    'unread_count': table.c.unread_count + unread,
+                },
+            )
+            connection.execute(stmt)
+
+    @classmethod
+    def recent(cls, username, cursor=None, limit=50):
+        """One page of a user's conversations, most recent first, and the
+        cursor for the next page (None on the last page)"""
+
+        query = cls.query.filter(cls.username == username)
+        if cursor is not None:
+            last_message_at, counterpart = read_cursor(cursor, datetime,
+                                                       str)
+            query = query.filter(
+                db.tuple_(cls.last_message_at, cls.counterpart) <
+                db.tuple_(last_message_at, counterpart))
+
+        rows = (query.order_by(cls.last_message_at.desc(),
+                               cls.counterpart.desc())
+                .limit(limit + 1).all())
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1].last_message_at, rows[-1].counterpart)
+
+    def serialize(self):
+        """serialize data"""
+        return {
+            "counterpart": self.counterpart,
+            "last_message_id": self.last_message_id,
+            "last_message_at": self.last_message_at.isoformat(),
+            "unread_count": self.unread_count,
+        }
+
+
+class ChangeVersion(db.Model):
+    """Version counter per group of tables (e.g. "listings"), bumped right
+    after any transaction that wrote to them commits. Read endpoints use it
+    to answer conditional GETs without loading any rows.
+
+    The bump is its own short transaction rather than part of the write:
+    inside the write, every writer to a group would hold the group's row
+    lock until it committed, queueing them all behind each other. The
+    price is a moment after each commit where readers can see the new rows
+    under the old version."""
+
+    __tablename__ = 'change_versions'
+
+    name = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    version = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    @classmethod
+    def current(cls, name):
+        """Return (version, updated_at) for `name`, (0, None) if it has
+        never been written"""
+
+        row = (db.session.query(cls.version, cls.updated_at)
+               .filter(cls.name == name).first())
+        return tuple(row) if row else (0, None)
+
+    @classmethod
+    def touch(cls, session, name):
+        """Bump the version of `name` once `session` commits"""
+
+        session.info.setdefault('changed_scopes', set()).add(name)
+
+    @classmethod
+    def bump(cls, connection, name):
+        """Increment the version of `name` using `connection`"""
+
+        now = datetime.utcnow()
+        stmt = pg_insert(cls.__table__).values(
+            name=name, version=1, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.name],
+            set_={'version': cls.__table__.c.version + 1, 'updated_at': now},
+        )
+        connection.execute(stmt)
+
+
+@event.listens_for(Listing, 'before_insert')
+@event.listens_for(Listing, 'before_update')
+def set_geohash(mapper, connection, listing):
+    """Keep the geohash in step with the coordinates"""
+
+    if listing.latitude is None or listing.longitude is None:
+        listing.geohash = None
+    else:
+        listing.geohash = geohash_encode(listing.latitude, listing.longitude)
+
+
+# which change version each model's writes bump
+CHANGE_SCOPES = {
+    Listing: 'listings',
+    Listing_Photo: 'listings',
+    User: 'users',
+}
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_change_scopes(session, flush_context):
+    """Remember every scope touched by this flush until the commit"""
+
+    changed = set(session.new) | set(session.deleted)
+    changed.update(obj for obj in session.dirty if session.is_modified(obj))
+
+    for obj in changed:
+        if type(obj) in CHANGE_SCOPES:
+            ChangeVersion.touch(session, CHANGE_SCOPES[type(obj)])
+
+
+@event.listens_for(Session, 'after_commit')
+def commit_change_scopes(session):
+    """Hold the committed scopes until the session lets go of its
+    connection"""
+
+    scopes = session.info.pop('changed_scopes', None)
+    if scopes:
+        session.info.setdefault('committed_scopes', set()).update(scopes)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def bump_change_versions(session, transaction):
+    """Bump the change version of every scope the transaction wrote, each
+    in its own autocommitted statement on the primary
+
+    Runs once the top-level transaction has returned its connection to
+    the pool: in after_commit it still holds it, so the bump would check
+    out a second one, and under load every request could be waiting on
+    the pool for the connection it's holding itself."""
+
+    if transaction.parent is not None:
+        return
+    scopes = session.info.pop('committed_scopes', ())
+    if not scopes:
+        return
+    app = getattr(session, 'app', None)
+    engine = db.get_engine(app) if app is not None else session.get_bind()
+    try:
+        with engine.begin() as connection:
+            for scope in sorted(scopes):
+                ChangeVersion.bump(connection, scope)
+    except Exception:
+        # the write is committed either way; the next one bumps again
+        logger.exception("Bumping change versions %s failed",
+                         sorted(scopes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def drop_change_scopes(session):
+    session.info.pop('changed_scopes', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_conversation_summaries(session, flush_context):
+    """Keep conversation summaries in step with new messages"""
+
+    for obj in session.new:
+        if isinstance(obj, Message):
+            ConversationSummary.record(session.connection(), obj)
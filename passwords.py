@@ -0,0 +1,115 @@
+"""Password hashing off the request thread
+
+bcrypt is deliberately slow (~100-300 ms of CPU per hash at cost 12), so
+hashing and checking run in a bounded pool of worker processes. The work
+factor comes from BCRYPT_LOG_ROUNDS, and needs_rehash() tells login when a
+stored hash was made with a different cost so it can be upgraded.
+
+    password_hasher = PasswordHasher()
+    password_hasher.init_app(app)
+    hashed = password_hasher.hash("hunter2")
+    password_hasher.check(hashed, "hunter2")
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+from helpers import MP_CONTEXT
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+def hash_rounds(hashed):
+    """Work factor a hash was made with, e.g. 12 for "$2b$12$..." """
+
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        raise ValueError("Invalid salt")
+
+
+class _HasherState:
+    """One app's process pool and in-flight limit"""
+
+    def __init__(self, max_pending):
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = threading.BoundedSemaphore(max_pending)
+
+
+class PasswordHasher:
+    """bcrypt in a lazily started process pool, one per app (kept in
+    app.extensions)
+
+    config:
+    BCRYPT_LOG_ROUNDS: work factor for new hashes
+    PASSWORD_WORKERS: worker processes, 0 hashes inline on the request
+    thread
+    PASSWORD_MAX_PENDING: hashes allowed in flight before callers wait,
+    so a login storm queues instead of piling work onto the pool
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('PASSWORD_MAX_PENDING',
+                              4 * app.config['PASSWORD_WORKERS'] or 1)
+        app.extensions['password_hasher'] = _HasherState(
+            app.config['PASSWORD_MAX_PENDING'])
+
+    def _app(self):
+        return self.app if self.app is not None else current_app
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost"""
+
+        return self._run(_hash, password,
+                         self._app().config['BCRYPT_LOG_ROUNDS'])
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`? raises ValueError if `hashed`
+        isn't a bcrypt hash"""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than configured?"""
+
+        return hash_rounds(hashed) != self._app().config['BCRYPT_LOG_ROUNDS']
+
+    def _run(self, fn, *args):
+        app = self._app()
+        if not app.config['PASSWORD_WORKERS']:
+            return fn(*args)
+
+        state = app.extensions['password_hasher']
+        with state.pending:
+            return self._pool(app, state).submit(fn, *args).result()
+
+    def _pool(self, app, state):
+        if state.executor is None:
+            with state.lock:
+                if state.executor is None:
+                    state.executor = ProcessPoolExecutor(
+                        max_workers=app.config['PASSWORD_WORKERS'],
+                        mp_context=MP_CONTEXT)
+        return state.executor
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,95 @@
+"""Batch stay pricing
+
+Prices every listing for every stay at once: nightly prices are laid out
+as an (listings x nights) array of cents starting from each listing's
+base price, price rules are written over the nights they match (lowest
+priority first, so the highest priority rule wins), and a running total
+along each row turns the price of any stay into one subtraction. Quoting
+a page of 200 listings for a dozen date ranges is a handful of array
+operations rather than a Python loop per listing, stay and night.
+"""
+
+from decimal import Decimal
+import numpy as np
+from models import Listing, PriceRule
+
+CENT = Decimal("0.01")
+
+
+def _cents(price):
+    return int(price * 100)
+
+
+def quote(base_prices, rules, ranges):
+    """Total price in cents of every listing for every stay
+
+    base_prices: {listing_id: nightly price (Decimal)}
+    rules: PriceRules of those listings, any order
+    ranges: [(start, end)] dates, end is the checkout day
+
+    returns (listing_ids, totals), totals[i, j] is the price of listing
+    listing_ids[i] for ranges[j] (int64 array)
+    """
+
+    listing_ids = list(base_prices)
+    first = min(start for start, _ in ranges)
+    days = (max(end for _, end in ranges) - first).days
+    row = {listing_id: i for i, listing_id in enumerate(listing_ids)}
+
+    base = np.array([_cents(price) for price in base_prices.values()],
+                    dtype=np.int64)
+    nightly = np.repeat(base[:, np.newaxis], days, axis=1)
+    # bit of each night's weekday, as in PriceRule.weekdays
+    weekday_bits = 1 << (first.weekday() + np.arange(days)) % 7
+
+    for rule in sorted(rules, key=lambda rule: (rule.priority, rule.id)):
+        i = row.get(rule.listing_id)
+        if i is None:
+            continue
+        low = 0 if rule.start_date is None else \
+            max((rule.start_date - first).days, 0)
+        high = days if rule.end_date is None else \
+            min((rule.end_date - first).days, days)
+        if low >= high:
+            continue
+        nights = nightly[i, low:high]
+        if rule.weekdays is None:
+            nights[:] = _cents(rule.nightly_price)
+        else:
+            nights[(weekday_bits[low:high] & rule.weekdays) != 0] = \
+                _cents(rule.nightly_price)
+
+    # running[:, d] is the price of the nights before day d
+    running = np.zeros((len(listing_ids), days + 1), dtype=np.int64)
+    np.cumsum(nightly, axis=1, out=running[:, 1:])
+    starts = np.array([(start - first).days for start, _ in ranges])
+    ends = np.array([(end - first).days for _, end in ranges])
+    return listing_ids, running[:, ends] - running[:, starts]
+
+
+def quote_listings(listing_ids, ranges):
+    """Quotes for stored listings, in the order given (unknown ids are
+    left out): [{"listing_id", "quotes": [{"start", "end", "nights",
+    "total_price"}]}]. Two queries whatever the number of listings."""
+
+    base_prices = dict(Listing.query
+                       .with_entities(Listing.id, Listing.price)
+                       .filter(Listing.id.in_(listing_ids)))
+    if not base_prices:
+        return []
+
+    first = min(start for start, _ in ranges)
+    last = max(end for _, end in ranges)
+    rules = PriceRule.overlapping(list(base_prices), first, last)
+    quoted_ids, totals = quote(base_prices, rules, ranges)
+    totals = dict(zip(quoted_ids, totals.tolist()))
+
+    return [{
+        "listing_id": listing_id,
+        "quotes": [{
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "nights": (end - start).days,
+            "total_price": str((Decimal(cents) * CENT).quantize(CENT)),
+        } for (start, end), cents in zip(ranges, totals[listing_id])],
+    } for listing_id in dict.fromkeys(listing_ids) if listing_id in totals]
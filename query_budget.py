@@ -0,0 +1,95 @@
+"""Query budget guard
+
+Counts the SQL statements issued on the current thread so tests, and the
+QUERY_BUDGET_ENFORCE debug mode, can assert that an endpoint stays within a
+fixed number of queries (catching N+1 regressions before production).
+"""
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block of code issues more statements than allowed"""
+
+
+class QueryCounter:
+    """Counts statements executed on this thread while the block is active
+
+    Counters nest, every active counter sees every statement.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        _active_counters().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active_counters().remove(self)
+        return False
+
+
+def _active_counters():
+    if not hasattr(_local, "counters"):
+        _local.counters = []
+    return _local.counters
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, "counters", ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+def _check(counter, limit, name):
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise QueryBudgetExceeded(
+            f"{name} issued {counter.count} queries (budget {limit}):\n"
+            f"{statements}")
+
+
+@contextmanager
+def assert_max_queries(limit, name="block"):
+    """Fail if the wrapped block issues more than `limit` statements
+
+    with assert_max_queries(2):
+        client.get('/listings')
+    """
+    with QueryCounter() as counter:
+        yield counter
+    _check(counter, limit, name)
+
+
+def query_budget(limit):
+    """Declare the most statements a view may issue
+
+    Only enforced when QUERY_BUDGET_ENFORCE is set in the app config, so
+    production requests don't pay for the bookkeeping.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("QUERY_BUDGET_ENFORCE"):
+                return view(*args, **kwargs)
+
+            with QueryCounter() as counter:
+                response = view(*args, **kwargs)
+            _check(counter, limit, view.__name__)
+            return response
+
+        wrapper.query_budget = limit
+        return wrapper
+
+    return decorator
@@ -0,0 +1,170 @@
+"""Connection pooling and read replica routing
+
+Reads made by views marked @read_only go to a replica, everything else
+(and every flush) goes to the primary. Once a request has written, the
+rest of it reads from the primary, and the writer's following requests
+stay on the primary for a few seconds too, so users see their own writes
+despite replication lag.
+
+Stickiness is keyed on the authenticated user (g.username), not a
+cookie: the frontend is on another origin and calls the API with bearer
+tokens and no credentials, so a cookie set here never comes back. Writes
+made without a token (signup, login) don't make anyone sticky. The
+expiries are kept per worker process, so with several workers a user's
+next request can still land on one that reads from a replica.
+
+    DATABASE_URL=postgresql:///sharebnb
+    DATABASE_REPLICA_URLS=postgresql://localhost:5433/sharebnb
+
+Behind PgBouncer (transaction pooling) set DATABASE_PGBOUNCER=1: the app
+then keeps no pool of its own and opens a PgBouncer connection per
+checkout.
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def engine_options(env):
+    """SQLALCHEMY_ENGINE_OPTIONS from DATABASE_* environment variables"""
+
+    if env.get('DATABASE_PGBOUNCER'):
+        # PgBouncer pools server connections; a second pool in every
+        # worker would only pin them
+        return {'poolclass': NullPool}
+
+    return {
+        'pool_size': int(env.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(env.get('DATABASE_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(env.get('DATABASE_POOL_TIMEOUT', 30)),
+        # close connections before a server or firewall idle timeout does
+        'pool_recycle': int(env.get('DATABASE_POOL_RECYCLE', 1800)),
+        # check a connection is alive before handing it out
+        'pool_pre_ping': env.get('DATABASE_POOL_PRE_PING', '1') != '0',
+    }
+
+
+def replica_binds(env):
+    """SQLALCHEMY_BINDS entries for DATABASE_REPLICA_URLS (comma separated)"""
+
+    urls = [url.strip() for url in env.get('DATABASE_REPLICA_URLS', '')
+            .split(',') if url.strip()]
+    return {f'replica_{i}': url for i, url in enumerate(urls)}
+
+
+def read_only(view):
+    """Let the view's reads go to a replica"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    """Session that picks a replica for reads in @read_only views"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if isinstance(clause, UpdateBase):
+            # Core insert/update/delete statements don't flush but are
+            # writes all the same
+            self.info['wrote'] = True
+        if self._use_replica(clause):
+            if 'replica' not in self.info:
+                # one replica per session so a request sees one snapshot
+                self.info['replica'] = random.choice(
+                    self.app.config['DATABASE_REPLICAS'])
+            return get_state(self.app).db.get_engine(
+                self.app, bind=self.info['replica'])
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def _use_replica(self, clause):
+        return (not self._flushing
+                and not self.info.get('wrote')
+                and not isinstance(clause, UpdateBase)
+                and has_request_context()
+                and g.get('db_read_only', False)
+                and bool(self.app.config['DATABASE_REPLICAS'])
+                and not db_routing.is_sticky(self.app, g.get('username')))
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions route reads to replicas"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class _RoutingState:
+    """One app's sticky users"""
+
+    def __init__(self):
+        # username -> time.monotonic() until which they read the primary
+        self.sticky = {}
+        self.lock = threading.Lock()
+        self.next_sweep = 0
+
+
+class DatabaseRouting:
+    """Sets up replica routing and read-your-writes stickiness
+
+    config:
+    DATABASE_REPLICAS: bind keys (in SQLALCHEMY_BINDS) of the replicas
+    REPLICA_STICKY_SECONDS: how long a writer keeps reading the primary
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_REPLICAS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        app.extensions['db_routing'] = _RoutingState()
+        app.after_request(self._set_sticky)
+
+    def is_sticky(self, app, username):
+        """Did `username` write in the last REPLICA_STICKY_SECONDS?"""
+
+        if not username:
+            return False
+        until = app.extensions['db_routing'].sticky.get(username)
+        return until is not None and until > time.monotonic()
+
+    def _set_sticky(self, response):
+        username = g.get('username')
+        if g.get('db_wrote') and username:
+            state = current_app.extensions['db_routing']
+            seconds = current_app.config['REPLICA_STICKY_SECONDS']
+            now = time.monotonic()
+            with state.lock:
+                state.sticky[username] = now + seconds
+                # drop expired users at most once per sticky period
+                if now >= state.next_sweep:
+                    state.sticky = {user: until for user, until
+                                    in state.sticky.items() if until > now}
+                    state.next_sweep = now + seconds
+        return response
+
+
+db_routing = DatabaseRouting()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(session):
+    if session.info.get('wrote') and has_request_context():
+        g.db_wrote = True
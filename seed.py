@@ -0,0 +1,303 @@
+"""Seed the database with realistic synthetic data at any scale
+
+Generates users, listings, photos, bookings and messages from a fixed
+random seed (same arguments, same data) and bulk loads them with
+PostgreSQL COPY, then rebuilds the derived tables (conversation summaries,
+change versions) and sequences.
+
+Every seeded user's password is "password".
+
+    python seed.py --truncate
+    python seed.py --truncate --users 100000 --listings 1000000 \\
+        --messages 10000000 --database-url postgresql:///sharebnb-bench
+"""
+
+import argparse
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+import psycopg2
+
+from geo import encode as geohash_encode
+
+BASE_DATE = datetime(2021, 1, 1)
+
+ADJECTIVES = ("Cozy", "Sunny", "Quiet", "Modern", "Rustic", "Spacious",
+              "Charming", "Bright", "Private", "Secluded", "Historic", "Tiny")
+KINDS = ("studio", "loft", "cabin", "cottage", "villa", "apartment", "house",
+         "room", "suite", "treehouse", "yurt", "farmhouse", "bungalow")
+FEATURES = ("garden", "pool", "hot tub", "fireplace", "ocean view",
+            "mountain view", "patio", "balcony", "full kitchen", "parking",
+            "fast wifi", "washer", "deck", "fire pit", "workspace", "sauna")
+PLACES = ("San Francisco, CA", "Oakland, CA", "Berkeley, CA", "Portland, OR",
+          "Seattle, WA", "Austin, TX", "Denver, CO", "Chicago, IL",
+          "Boston, MA", "Miami, FL", "Lake Tahoe, CA", "Napa, CA",
+          "Asheville, NC", "Brooklyn, NY", "Santa Fe, NM", "Savannah, GA")
+# rough centers, listings are scattered up to ~30km around them
+COORDINATES = {
+    "San Francisco, CA": (37.7749, -122.4194),
+    "Oakland, CA": (37.8044, -122.2712),
+    "Berkeley, CA": (37.8716, -122.2727),
+    "Portland, OR": (45.5152, -122.6784),
+    "Seattle, WA": (47.6062, -122.3321),
+    "Austin, TX": (30.2672, -97.7431),
+    "Denver, CO": (39.7392, -104.9903),
+    "Chicago, IL": (41.8781, -87.6298),
+    "Boston, MA": (42.3601, -71.0589),
+    "Miami, FL": (25.7617, -80.1918),
+    "Lake Tahoe, CA": (39.0968, -120.0324),
+    "Napa, CA": (38.2975, -122.2869),
+    "Asheville, NC": (35.5951, -82.5515),
+    "Brooklyn, NY": (40.6782, -73.9442),
+    "Santa Fe, NM": (35.6870, -105.9378),
+    "Savannah, GA": (32.0809, -81.0912),
+}
+GREETINGS = ("Hi!", "Hello,", "Hey there,", "Good morning,", "Thanks!")
+QUESTIONS = ("is the place available next weekend?",
+             "can we check in early?", "is parking included?",
+             "do you allow pets?", "how far is it from downtown?",
+             "we loved our stay, thank you!", "what's the wifi password?")
+
+PHOTO_URL = "https://picsum.photos/seed/{}/1200/800"
+
+
+def copy_rows(cur, table, columns, rows, batch_size):
+    """COPY `rows` (tuples) into `table` in batches, returns row count
+
+    values are written as-is in COPY text format, so generated data must
+    not contain tabs, newlines or backslashes"""
+
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    count = 0
+    lines = []
+    for row in rows:
+        lines.append("\t".join(map(str, row)))
+        count += 1
+        if len(lines) == batch_size:
+            cur.copy_expert(sql, io.StringIO("\n".join(lines) + "\n"))
+            lines = []
+    if lines:
+        cur.copy_expert(sql, io.StringIO("\n".join(lines) + "\n"))
+    return count
+
+
+def _rng(seed, table):
+    # one stream per table so changing one count doesn't reshuffle the rest
+    return random.Random(f"{seed}-{table}")
+
+
+def gen_users(seed, n, password):
+    rng = _rng(seed, "users")
+    for i in range(n):
+        username = f"user{i}"
+        yield (username, f"{username}@example.com", password,
+               f"{rng.choice(ADJECTIVES)} traveler who loves "
+               f"{rng.choice(FEATURES)}s",
+               rng.choice(PLACES), PHOTO_URL.format(f"u{i}"), "done")
+
+
+def _day_strings(days):
+    # formatting datetimes row by row is the slowest part of generation
+    return [(BASE_DATE + timedelta(days=day)).strftime("%Y-%m-%d")
+            for day in range(days)]
+
+
+def _point(rng, latitude, longitude):
+    """(latitude, longitude, geohash) strings of a point ~10km around"""
+    latitude += rng.gauss(0, 0.1)
+    longitude += rng.gauss(0, 0.1)
+    return (f"{latitude:.6f}", f"{longitude:.6f}",
+            geohash_encode(latitude, longitude))
+
+
+def gen_listings(seed, n, users):
+    rng = _rng(seed, "listings")
+    # own stream so the other columns match seeds made before coordinates
+    coordinates_rng = _rng(seed, "coordinates")
+    # log-normal nightly prices, median ~$120
+    prices = [f"{rng.lognormvariate(4.8, 0.6):.2f}" for _ in range(4096)]
+    # jittering and geohashing points row by row halves the load rate,
+    # draw them from a pool per place instead
+    per_place = min(n // len(PLACES) + 1, 4096)
+    points = {place: [_point(coordinates_rng, *COORDINATES[place])
+                      for _ in range(per_place)] for place in PLACES}
+    for i in range(1, n + 1):
+        adjective, kind = rng.choice(ADJECTIVES), rng.choice(KINDS)
+        features = rng.choices(FEATURES, k=4)
+        place = rng.choice(PLACES)
+        description = (f"{adjective} {kind} in {place.split(',')[0]} with "
+                       f"{features[0]}, {features[1]}, {features[2]} and "
+                       f"{features[3]}. Sleeps {rng.randint(1, 10)}.")
+        yield (i, f"{adjective} {kind} with {features[0]}", rng.choice(prices),
+               description, place, f"user{rng.randrange(users)}",
+               *coordinates_rng.choice(points[place]))
+
+
+def gen_photos(seed, listings, per_listing):
+    rng = _rng(seed, "photos")
+    photo_id = 0
+    for listing_id in range(1, listings + 1):
+        for _ in range(rng.randint(1, 2 * per_listing - 1)):
+            photo_id += 1
+            yield (photo_id, listing_id, PHOTO_URL.format(photo_id), "done")
+
+
+def gen_bookings(seed, n, listings, users):
+    """Non-overlapping stays, spread evenly over listings"""
+    rng = _rng(seed, "bookings")
+    # each listing gets ~n/listings stays of up to 30 days apart
+    days = _day_strings(60 + 31 * (n // max(listings, 1) + 1) + 60)
+    next_free = {}
+    for i in range(1, n + 1):
+        listing_id = rng.randrange(1, listings + 1)
+        start = next_free.get(listing_id, 60) + rng.randint(0, 20)
+        nights = rng.randint(1, 10)
+        end = start + nights
+        next_free[listing_id] = end
+        if end >= len(days):
+            days.extend(_day_strings(2 * end)[len(days):])
+        yield (i, f"user{rng.randrange(users)}", listing_id,
+               days[start - rng.randint(1, 60)], days[start], days[end],
+               f"{nights * rng.randint(40, 400)}.00")
+
+
+def gen_messages(seed, n, users):
+    """Messages between a bounded set of partners per user, in time order"""
+    rng = _rng(seed, "messages")
+    partners = min(users - 1, 20)
+    # spread evenly over a year, naive UTC like the app's timestamps
+    step = timedelta(days=365) / max(n, 1)
+    texts = [f"{greeting} {question}"
+             for greeting in GREETINGS for question in QUESTIONS]
+    for i in range(1, n + 1):
+        sender = rng.randrange(users)
+        recipient = (sender + rng.randint(1, partners)) % users
+        yield (i, rng.choice(texts),
+               (BASE_DATE + step * i).isoformat(" "),
+               f"user{recipient}", f"user{sender}")
+
+
+SUMMARIES_SQL = """
+    INSERT INTO conversation_summaries
+        (username, counterpart, last_message_id, last_message_at,
+         unread_count)
+    SELECT username, counterpart,
+           (array_agg(id ORDER BY timestamp DESC, id DESC))[1],
+           max(timestamp), sum(unread)
+    FROM (SELECT to_user_name AS username, from_user_name AS counterpart,
+                 id, timestamp, 1 AS unread
+          FROM messages
+          UNION ALL
+          SELECT from_user_name, to_user_name, id, timestamp, 0
+          FROM messages) m
+    GROUP BY username, counterpart
+"""
+
+CHANGE_VERSIONS_SQL = """
+    INSERT INTO change_versions (name, version, updated_at)
+    VALUES ('listings', 1, now() at time zone 'utc'),
+           ('users', 1, now() at time zone 'utc')
+    ON CONFLICT (name) DO UPDATE
+    SET version = change_versions.version + 1, updated_at = EXCLUDED.updated_at
+"""
+
+TABLES = ("conversation_summaries", "messages", "bookings", "listing_photos",
+          "listings", "users")
+SEQUENCES = {"listings": "id", "listing_photos": "id", "bookings": "id",
+             "messages": "id"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url", default=os.environ.get(
+        "DATABASE_URL", "postgresql:///sharebnb"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--listings", type=int, default=10000)
+    parser.add_argument("--photos-per-listing", type=int, default=3)
+    parser.add_argument("--bookings", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--truncate", action="store_true",
+                        help="empty the tables first (required unless they "
+                             "are empty)")
+    args = parser.parse_args()
+    if args.photos_per_listing < 1:
+        parser.error("--photos-per-listing must be at least 1")
+
+    users = max(args.users, 2)
+    password = bcrypt.hashpw(b"password", bcrypt.gensalt(12)).decode()
+
+    loads = (
+        ("users", ("username", "email", "password", "bio", "location",
+                   "image_url", "upload_status"),
+         gen_users(args.seed, users, password)),
+        ("listings", ("id", "title", "price", "description", "location",
+                      "listing_owner", "latitude", "longitude", "geohash"),
+         gen_listings(args.seed, args.listings, users)),
+        ("listing_photos", ("id", "listing_id", "image_url", "upload_status"),
+         gen_photos(args.seed, args.listings, args.photos_per_listing)),
+        ("bookings", ("id", "renter_username", "listing_id", "timestamp",
+                      "start_date", "end_date", "total_price"),
+         gen_bookings(args.seed, args.bookings if args.listings else 0,
+                      args.listings, users)),
+        ("messages", ("id", "text", "timestamp", "to_user_name",
+                      "from_user_name"),
+         gen_messages(args.seed, args.messages, users)),
+    )
+
+    conn = psycopg2.connect(args.database_url)
+    if not args.truncate:
+        # generated ids and usernames start from 1 / user0 every time
+        exists = " OR ".join(f"EXISTS (SELECT 1 FROM {table})"
+                             for table in TABLES)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {exists}")
+            seeded = cur.fetchone()[0]
+        if seeded:
+            conn.close()
+            parser.error("the tables already have rows, seeded ids would "
+                         "collide with them; pass --truncate")
+
+    started = time.perf_counter()
+    total = 0
+    with conn, conn.cursor() as cur:
+        if args.truncate:
+            cur.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+
+        for table, columns, rows in loads:
+            start = time.perf_counter()
+            count = copy_rows(cur, table, columns, rows, args.batch_size)
+            elapsed = time.perf_counter() - start
+            total += count
+            print(f"{table:>16}: {count:>10,} rows  {elapsed:7.1f}s  "
+                  f"{count / elapsed if elapsed else 0:>10,.0f} rows/sec")
+
+        for table, column in SEQUENCES.items():
+            cur.execute(f"""SELECT setval(pg_get_serial_sequence(
+                                '{table}', '{column}'),
+                            coalesce(max({column}), 0) + 1, false)
+                            FROM {table}""")
+
+        start = time.perf_counter()
+        cur.execute(SUMMARIES_SQL)
+        print(f"{'summaries':>16}: {cur.rowcount:>10,} rows  "
+              f"{time.perf_counter() - start:7.1f}s")
+        cur.execute(CHANGE_VERSIONS_SQL)
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{'total':>16}: {total:>10,} rows  {elapsed:7.1f}s  "
+          f"{total / elapsed:>10,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
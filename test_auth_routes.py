@@ -13,9 +13,9 @@ from models import db, User, Message, Booking, Listing
 # connected to the database
 # os.environ['DATABASE_URL'] = "postgresql:///sharebnb-test"
 
-from app import app
+from app import create_app
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sharebnb-test'
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -0,0 +1,93 @@
+"""Token auth tests"""
+
+# run tests: python -m unittest test_auth_tokens.py
+
+import time
+from unittest import TestCase
+from flask import Flask, g, jsonify
+from auth import TokenAuth, InvalidToken, login_required
+
+
+class TokenAuthTestCase(TestCase):
+    """Test issuing and verifying tokens."""
+
+    def setUp(self):
+        """Create an app with one protected route."""
+
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = "test-secret"
+        self.auth = TokenAuth(self.app)
+
+        @self.app.route('/whoami')
+        @login_required
+        def whoami():
+            return jsonify({"username": g.username})
+
+        self.client = self.app.test_client()
+
+    def test_access_token(self):
+        """Does a valid access token authenticate a request?"""
+
+        with self.app.app_context():
+            token = self.auth.create_token("testuser")
+
+        resp = self.client.get('/whoami',
+                               headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(resp.json, {"username": "testuser"})
+
+        resp = self.client.get('/whoami')
+        self.assertEqual(resp.status_code, 401)
+
+    def test_refresh_token_is_not_access(self):
+        """Is a refresh token rejected as an access token?"""
+
+        with self.app.app_context():
+            token = self.auth.create_token("testuser", "refresh")
+
+            with self.assertRaises(InvalidToken):
+                self.auth.verify(token)
+            self.assertEqual(self.auth.verify(token, "refresh")["username"],
+                             "testuser")
+
+    def test_expired_token(self):
+        """Is an expired token rejected even after it was cached?"""
+
+        with self.app.app_context():
+            token = self.auth.create_token("testuser")
+            self.auth.verify(token)
+
+            self.app.config['ACCESS_TOKEN_SECONDS'] = -1
+            expired = self.auth.create_token("testuser")
+
+            with self.assertRaises(InvalidToken):
+                self.auth.verify(expired)
+
+    def test_revoke(self):
+        """Is a revoked token rejected?"""
+
+        with self.app.app_context():
+            token = self.auth.create_token("testuser")
+            self.auth.revoke(self.auth.verify(token))
+
+            with self.assertRaises(InvalidToken):
+                self.auth.verify(token)
+
+    def test_revoked_expire(self):
+        """Are revoked tokens forgotten once they've expired?"""
+
+        with self.app.app_context():
+            self.auth.revoke({"jti": "old", "exp": time.time() - 1})
+            token = self.auth.create_token("testuser")
+            claims = self.auth.verify(token)
+            self.auth.revoke(claims)
+
+            self.assertEqual(self.app.extensions['token_auth'].revoked,
+                             {claims["jti"]: claims["exp"]})
+
+    def test_non_string_token(self):
+        """Is a token that isn't a string rejected, not a 500?"""
+
+        with self.app.app_context():
+            for token in (None, [], {}, 1):
+                with self.assertRaises(InvalidToken):
+                    self.auth.verify(token, "refresh")
@@ -0,0 +1,51 @@
+"""Message broker tests"""
+
+# run tests: python -m unittest test_broker.py
+
+import queue
+from unittest import TestCase
+from flask import Flask
+from broker import MessageBroker
+
+
+class MessageBrokerTestCase(TestCase):
+    """Test in-process message fan-out."""
+
+    def setUp(self):
+        """Create a broker with small stream queues."""
+
+        self.app = Flask(__name__)
+        self.app.config['MESSAGE_STREAM_QUEUE_SIZE'] = 2
+        self.broker = MessageBroker(self.app)
+
+    def test_publish(self):
+        """Does a message reach every stream of the recipient only?"""
+
+        phone = self.broker.subscribe("testuser1")
+        laptop = self.broker.subscribe("testuser1")
+        other = self.broker.subscribe("testuser2")
+
+        self.broker.publish("testuser1", {"id": 1})
+
+        self.assertEqual(phone.get(timeout=1), {"id": 1})
+        self.assertEqual(laptop.get(timeout=1), {"id": 1})
+        with self.assertRaises(queue.Empty):
+            other.get(timeout=0)
+
+    def test_unsubscribe(self):
+        """Are closed streams forgotten?"""
+
+        subscription = self.broker.subscribe("testuser1")
+        self.assertEqual(self.broker.subscriber_count(), 1)
+
+        self.broker.unsubscribe(subscription)
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    def test_overflow(self):
+        """Is a stream that falls behind flagged instead of blocking?"""
+
+        subscription = self.broker.subscribe("testuser1")
+        for i in range(3):
+            self.broker.publish("testuser1", {"id": i})
+
+        self.assertTrue(subscription.overflowed)
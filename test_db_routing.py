@@ -0,0 +1,147 @@
+"""Read replica routing tests"""
+
+# run tests: python -m unittest test_db_routing.py
+#
+# needs a second database standing in for the replica; with a real second
+# instance: TEST_REPLICA_URL=postgresql://localhost:5433/sharebnb-test
+
+import os
+import time
+from unittest import TestCase
+from flask import g
+from models import db, User, Listing
+from auth import token_auth
+from app import create_app
+
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
+app.config['SQLALCHEMY_BINDS'] = {'replica_0': os.environ.get(
+    'TEST_REPLICA_URL', 'postgresql:///sharebnb-test-replica')}
+
+db.create_all()
+replica = db.get_engine(app, bind='replica_0')
+db.Model.metadata.create_all(replica)
+
+
+class DatabaseRoutingTestCase(TestCase):
+    """Test that reads go to the replica and writes to the primary."""
+
+    def setUp(self):
+        """Put a different listing in the primary and the "replica"."""
+
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        app.config['DATABASE_REPLICAS'] = ['replica_0']
+
+        for table in ("listing_photos", "bookings", "price_rules", "listings",
+                      "users"):
+            db.session.execute(f"DELETE FROM {table}")
+            with replica.begin() as conn:
+                conn.execute(f"DELETE FROM {table}")
+        db.session.commit()
+
+        db.session.add(User(username="testuser1", email="test1@test.com",
+                            password="TEST_PASSWORD"))
+        db.session.add(Listing(title="on primary", price="50.00",
+                               description="test", location="test",
+                               listing_owner="testuser1"))
+        db.session.commit()
+
+        with replica.begin() as conn:
+            conn.execute(
+                "INSERT INTO users (username, email, password, upload_status)"
+                " VALUES ('testuser1', 'test1@test.com', 'x', 'done')")
+            conn.execute(
+                "INSERT INTO listings (title, price, description, location,"
+                " listing_owner) VALUES ('on replica', 50, 'test', 'test',"
+                " 'testuser1')")
+
+        # start each request with a fresh session, not the one that wrote
+        db.session.remove()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Leave routing off for the other test modules."""
+
+        db.session.rollback()
+        db.session.remove()
+        app.config['DATABASE_REPLICAS'] = []
+        app.extensions['db_routing'].sticky.clear()
+
+    def test_read_only_view(self):
+        """Does a @read_only view read from the replica?"""
+
+        resp = self.client.get('/listings')
+
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["on replica"])
+
+    def test_sticky_after_write(self):
+        """Does a user who just wrote read from the primary, and only
+        them?"""
+
+        listing = Listing.query.filter_by(title="on primary").one()
+        db.session.remove()
+        headers = {"Authorization":
+                   f"Bearer {token_auth.create_token('testuser1')}"}
+        resp = self.client.post(f'/listings/{listing.id}/price-rules',
+                                headers=headers, json={
+                                    "name": "weekend",
+                                    "nightly_price": "80.00"})
+        self.assertEqual(resp.status_code, 201)
+
+        # the requests share this test's app context, so its session
+        db.session.remove()
+        resp = self.client.get('/listings', headers=headers)
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["on primary"])
+
+        db.session.remove()
+        resp = self.client.get('/listings')
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["on replica"])
+
+    def test_expired_sticky(self):
+        """Does a writer go back to the replica once the period is over?"""
+
+        app.extensions['db_routing'].sticky["testuser1"] = \
+            time.monotonic() - 1
+        headers = {"Authorization":
+                   f"Bearer {token_auth.create_token('testuser1')}"}
+        resp = self.client.get('/listings', headers=headers)
+
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["on replica"])
+
+    def test_read_your_writes(self):
+        """Does a request read from the primary once it has written, and
+        is it marked for stickiness?"""
+
+        with app.test_request_context('/listings'):
+            g.db_read_only = True
+            self.assertEqual(
+                [listing.title for listing in Listing.query.all()],
+                ["on replica"])
+
+            db.session.add(Listing(title="new", price="60.00",
+                                   description="test", location="test",
+                                   listing_owner="testuser1"))
+            db.session.commit()
+
+            self.assertEqual(
+                sorted(listing.title for listing in Listing.query.all()),
+                ["new", "on primary"])
+            self.assertTrue(g.db_wrote)
+            db.session.remove()
+
+    def test_no_replicas(self):
+        """Do @read_only views use the primary without replicas?"""
+
+        app.config['DATABASE_REPLICAS'] = []
+        resp = self.client.get('/listings')
+
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["on primary"])
@@ -0,0 +1,58 @@
+"""Geohash helper tests"""
+
+# run tests: python -m unittest test_geo.py
+
+import math
+import random
+from unittest import TestCase
+from geo import covering_prefixes, encode, haversine_km, EARTH_RADIUS_KM
+
+
+def destination(latitude, longitude, bearing, km):
+    """Point `km` away from a point along `bearing` (radians)"""
+
+    d = km / EARTH_RADIUS_KM
+    lat1, lng1 = math.radians(latitude), math.radians(longitude)
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) +
+                     math.cos(lat1) * math.sin(d) * math.cos(bearing))
+    lng2 = lng1 + math.atan2(math.sin(bearing) * math.sin(d) * math.cos(lat1),
+                             math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lng2) + 180) % 360 - 180
+
+
+class GeoTestCase(TestCase):
+    """Test geohash encoding and radius coverage."""
+
+    def test_encode(self):
+        """Does encode match the reference geohash?"""
+
+        self.assertEqual(encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(encode(90, 180), "zzzzzzzzz")
+        self.assertEqual(encode(-90, -180), "000000000")
+
+    def test_haversine(self):
+        """Is one degree of latitude ~111km?"""
+
+        self.assertAlmostEqual(haversine_km(0, 0, 1, 0), 111.2, places=1)
+
+    def test_covering_prefixes(self):
+        """Is every point within the radius in one of the prefixes, even
+        across the antimeridian?"""
+
+        rng = random.Random(0)
+        centers = [(37.77, -122.42), (0.0, 179.99), (-33.9, 151.2),
+                   (64.1, -21.9)]
+        for latitude, longitude in centers:
+            for radius in (0.1, 1, 10, 100):
+                prefixes = covering_prefixes(latitude, longitude, radius)
+                for _ in range(200):
+                    point = destination(latitude, longitude,
+                                        rng.uniform(0, 2 * math.pi),
+                                        rng.uniform(0, radius))
+                    self.assertTrue(any(encode(*point).startswith(prefix)
+                                        for prefix in prefixes))
+
+    def test_covering_prefixes_pole(self):
+        """Is there no prefix filter where cells get too narrow?"""
+
+        self.assertIsNone(covering_prefixes(89.99, 0, 50))
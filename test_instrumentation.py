@@ -0,0 +1,67 @@
+"""Instrumentation tests"""
+
+# run tests: python -m unittest test_instrumentation.py
+
+from unittest import TestCase
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from instrumentation import Instrumentation, track_s3
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request metrics."""
+
+    def setUp(self):
+        """Create an app with a route that calls a fake s3 function."""
+
+        self.app = Flask(__name__)
+        self.app.config['PERF_SAMPLE_RATE'] = 1.0
+        Instrumentation(self.app)
+
+        @track_s3
+        def fake_upload():
+            return "http://s3.test/cat.jpg"
+
+        @self.app.route('/upload')
+        def upload():
+            return jsonify({"url": fake_upload()})
+
+        self.client = self.app.test_client()
+
+    def test_server_timing(self):
+        """Is a Server-Timing header added to sampled requests?"""
+
+        resp = self.client.get('/upload')
+
+        timing = resp.headers["Server-Timing"]
+        self.assertIn('db;dur=0.0;desc="0 queries"', timing)
+        self.assertIn('desc="1 calls"', timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_sampling_off(self):
+        """Are requests left alone when the sample rate is 0?"""
+
+        self.app.config['PERF_SAMPLE_RATE'] = 0
+
+        resp = self.client.get('/upload')
+
+        self.assertNotIn("Server-Timing", resp.headers)
+
+    def test_failed_statement(self):
+        """Is a statement that fails still counted, and its start time
+        dropped from the connection?"""
+
+        engine = create_engine("sqlite://")
+
+        @self.app.route('/fail')
+        def fail():
+            with engine.connect() as conn:
+                with self.assertRaises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing"))
+                self.assertEqual(conn.info.get("perf_start"), [])
+            return jsonify({})
+
+        resp = self.client.get('/fail')
+
+        self.assertIn('desc="1 queries"', resp.headers["Server-Timing"])
@@ -10,9 +10,9 @@ from models import db, User, Booking, Listing
 # connected to the database
 # os.environ['DATABASE_URL'] = "postgresql:///sharebnb-test"
 
-from app import app
+from app import create_app
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sharebnb-test'
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -27,6 +27,12 @@ class ListingModelTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         Booking.query.delete()
         Listing.query.delete()
         User.query.delete()
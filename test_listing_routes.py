@@ -0,0 +1,584 @@
+"""Listing routes tests"""
+
+# run tests: python -m unittest test_listing_routes.py
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import datetime
+from io import BytesIO
+from flask import jsonify
+from werkzeug.datastructures import FileStorage
+from models import (db, User, Booking, Listing, Listing_Photo, PriceRule,
+                    ChangeVersion)
+from query_budget import assert_max_queries
+from availability import availability_index
+from helpers import PHOTO_SIZES, encode_cursor
+from facets import facet_cache
+from auth import token_auth
+from upload_queue import upload_queue
+import aws
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+# os.environ['DATABASE_URL'] = "postgresql:///sharebnb-test"
+
+from app import create_app, resume_uploads
+
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class ListingRoutesTestCase(TestCase):
+    """Test listing endpoints."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Listing_Photo.query.delete()
+        PriceRule.query.delete()
+        Booking.query.delete()
+        Listing.query.delete()
+        User.query.delete()
+
+        user1 = User(
+            email="testemail@test.com",
+            username="testuser1",
+            password="TEST_PASSWORD"
+        )
+
+        db.session.add(user1)
+        db.session.commit()
+
+        for i in range(5):
+            listing = Listing(price=f"{50 + i}.00",
+                              title=f"test{i}",
+                              description="test",
+                              location="test",
+                              listing_owner=user1.username)
+            listing.photos.append(Listing_Photo(image_url="testurl.com"))
+            listing.photos.append(Listing_Photo(image_url="testurl2.com"))
+            db.session.add(listing)
+        db.session.commit()
+
+        availability_index.reset()
+
+        self.user1 = user1
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """clean up any fouled transaction"""
+        db.session.rollback()
+
+    def test_send_listings(self):
+        """Does GET /listings return every listing with its photos?"""
+
+        resp = self.client.get('/listings')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json), 5)
+        self.assertEqual(len(resp.json[0]["photos"]), 2)
+
+    def test_send_listings_query_budget(self):
+        """Does GET /listings stay at a fixed number of queries?"""
+
+        db.session.remove()
+        with assert_max_queries(3, "GET /listings"):
+            self.client.get('/listings')
+
+    def test_send_listings_filters(self):
+        """Does GET /listings apply the price filters?"""
+
+        resp = self.client.get('/listings?min_price=51&max_price=53')
+
+        self.assertEqual([listing["price"] for listing in resp.json],
+                         ["51.00", "52.00", "53.00"])
+
+        for bad in ("cheap", "NaN", "sNaN", "Infinity"):
+            resp = self.client.get(f'/listings?min_price={bad}')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_send_listings_pagination(self):
+        """Does following X-Next-Cursor walk every listing exactly once?"""
+
+        seen = []
+        resp = self.client.get('/listings?sort=price&limit=2')
+        while True:
+            seen.extend(listing["title"] for listing in resp.json)
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            resp = self.client.get(
+                f'/listings?sort=price&limit=2&cursor={cursor}')
+
+        self.assertEqual(seen, [f"test{i}" for i in range(5)])
+
+    def test_send_listings_bad_cursor(self):
+        """Is a cursor that doesn't match the sort a 400, not a 500?"""
+
+        bad = {
+            "id": [[], ["1"], [1, 2], [True], [1.5]],
+            "price": [[], [1], ["51.00"], ["cheap", 1], ["NaN", 1],
+                      [51, 1], ["51.00", "1"]],
+        }
+        for sort, cursors in bad.items():
+            for cursor in cursors:
+                resp = self.client.get(
+                    f'/listings?sort={sort}&cursor={encode_cursor(*cursor)}')
+                self.assertEqual(resp.status_code, 400, (sort, cursor))
+
+        for path in ('/listings/search?q=test', '/listings/nearby?lat=0&lng=0',
+                     '/listings/available?start=2021-11-01&end=2021-11-03'):
+            resp = self.client.get(f'{path}&cursor={encode_cursor()}')
+            self.assertEqual(resp.status_code, 400, path)
+
+    def test_send_listings_matches_serialize(self):
+        """Is the column-projected page byte for byte what jsonify of
+        Listing.serialize() gives, for every photo size?"""
+
+        listing = Listing.query.order_by(Listing.id).first()
+        listing.title = 'Caf\u00e9 \u2615 "quoted"\n\ttabbed'
+        listing.photos[0].thumb_url = "thumb.jpg"
+        listing.photos[0].thumb_webp_url = "thumb.webp"
+        db.session.add(Listing(price="70.00", title="no photos",
+                               description="test", location="test",
+                               listing_owner=self.user1.username))
+        db.session.commit()
+
+        for size in PHOTO_SIZES:
+            resp = self.client.get(f'/listings?size={size}')
+            with app.test_request_context():
+                expected = jsonify([
+                    listing.serialize(size) for listing in
+                    Listing.query.order_by(Listing.id)]).get_data()
+            self.assertEqual(resp.data, expected)
+
+    def test_send_listings_stream(self):
+        """Does stream=1 send every matching listing, encoded the same way
+        as a page?"""
+
+        resp = self.client.get('/listings?stream=1&max_price=53')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data,
+                         self.client.get('/listings?max_price=53').data)
+        self.assertEqual(len(resp.json), 4)
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_search_listings(self):
+        """Does GET /listings/search find listings by title?"""
+
+        resp = self.client.get('/listings/search?q=test3')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["test3"])
+
+        resp = self.client.get('/listings/search')
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_search_listings_pagination(self):
+        """Does paging through tied ranks return every match once?"""
+
+        seen = []
+        resp = self.client.get('/listings/search?q=test&limit=2')
+        while True:
+            seen.extend(listing["title"] for listing in resp.json)
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            resp = self.client.get(
+                f'/listings/search?q=test&limit=2&cursor={cursor}')
+
+        self.assertEqual(sorted(seen), [f"test{i}" for i in range(5)])
+
+    def test_send_listings_not_modified(self):
+        """Does GET /listings answer 304 until a listing changes?"""
+
+        resp = self.client.get('/listings')
+        etag = resp.headers["ETag"]
+
+        db.session.remove()
+        with assert_max_queries(1, "GET /listings 304"):
+            resp = self.client.get('/listings',
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+        # the bump waits for the write's connection to go back to the
+        # pool rather than checking out a second one
+        pool = db.get_engine(app).pool
+        checked_out = []
+        bump = ChangeVersion.bump.__func__
+
+        def counting_bump(cls, connection, name):
+            checked_out.append(pool.checkedout())
+            bump(cls, connection, name)
+
+        listing = Listing.query.first()
+        listing.price = "99.00"
+        with patch.object(ChangeVersion, "bump", classmethod(counting_bump)):
+            db.session.commit()
+        self.assertEqual(checked_out, [1])
+
+        resp = self.client.get('/listings', headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_available_listings(self):
+        """Does GET /listings/available leave out listings booked then?"""
+
+        listing = Listing.query.filter_by(title="test2").one()
+        booking = Booking(renter_username=self.user1.username,
+                          listing_id=listing.id,
+                          start_date=datetime(2021, 10, 31),
+                          end_date=datetime(2021, 11, 5),
+                          total_price="400.00")
+        db.session.add(booking)
+        db.session.commit()
+
+        # 0: too many booked to exclude by id, ask bookings instead
+        max_excluded = app.config['AVAILABILITY_MAX_EXCLUDED']
+        self.addCleanup(app.config.__setitem__, 'AVAILABILITY_MAX_EXCLUDED',
+                        max_excluded)
+        for limit in (max_excluded, 0):
+            app.config['AVAILABILITY_MAX_EXCLUDED'] = limit
+            resp = self.client.get('/listings/available'
+                                   '?start=2021-11-01&end=2021-11-03')
+            titles = [listing["title"] for listing in resp.json]
+            self.assertEqual(len(titles), 4)
+            self.assertNotIn("test2", titles)
+
+            # checkout day is free for the next stay
+            resp = self.client.get('/listings/available'
+                                   '?start=2021-11-05&end=2021-11-07')
+            self.assertEqual(len(resp.json), 5)
+
+        resp = self.client.get('/listings/available?start=2021-11-05')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_nearby_listings(self):
+        """Does GET /listings/nearby return listings within the radius,
+        nearest first, one page at a time?"""
+
+        # ~0km, ~1.1km and ~2.2km north of the center, and one in Oakland
+        listings = Listing.query.order_by(Listing.id).all()
+        for listing, latitude in zip(listings, (37.79, 37.80, 37.81)):
+            listing.latitude, listing.longitude = latitude, -122.40
+        listings[3].latitude, listings[3].longitude = 37.8044, -122.2712
+        db.session.commit()
+        self.assertEqual(len(listings[0].geohash), 9)
+
+        resp = self.client.get(
+            '/listings/nearby?lat=37.79&lng=-122.40&radius=5&limit=2')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["test0", "test1"])
+        self.assertAlmostEqual(resp.json[1]["distance_km"], 1.112, places=2)
+
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get('/listings/nearby?lat=37.79&lng=-122.40'
+                               f'&radius=5&limit=2&cursor={cursor}')
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["test2"])
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+        resp = self.client.get('/listings/nearby?lat=37.79&lng=-122.40'
+                               '&radius=20')
+        self.assertEqual(len(resp.json), 4)
+
+        resp = self.client.get('/listings/nearby?lat=37.79')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/listings/nearby?lat=37.79&lng=-122.40'
+                               '&radius=1000')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_listing_facets(self):
+        """Does GET /listings/facets count the matching listings by price
+        range, location and owner?"""
+
+        facet_cache.clear()
+        resp = self.client.get('/listings/facets?buckets=2')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["total"], 5)
+        self.assertEqual(resp.json["price"], {
+            "min": "50.00", "max": "54.00",
+            "buckets": [{"min": "50.00", "max": "52.00", "count": 2},
+                        {"min": "52.00", "max": "54.00", "count": 3}]})
+        self.assertEqual(resp.json["locations"],
+                         [{"location": "test", "count": 5}])
+        self.assertEqual(resp.json["owners"],
+                         [{"listing_owner": "testuser1", "count": 5}])
+
+        resp = self.client.get('/listings/facets?max_price=50')
+        self.assertEqual(resp.json["total"], 1)
+        self.assertEqual(len(resp.json["price"]["buckets"]), 20)
+
+        resp = self.client.get('/listings/facets?buckets=0')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_listing_facets_cache(self):
+        """Are facets served from the cache until a listing changes?"""
+
+        facet_cache.clear()
+        self.client.get('/listings/facets?location=Test')
+
+        db.session.remove()
+        with assert_max_queries(1, "cached GET /listings/facets"):
+            resp = self.client.get('/listings/facets?location=test')
+        self.assertEqual(resp.json["total"], 5)
+
+        listing = Listing.query.first()
+        listing.location = "elsewhere"
+        db.session.commit()
+
+        resp = self.client.get('/listings/facets?location=test')
+        self.assertEqual(resp.json["total"], 4)
+
+    def test_listing_facets_whitespace(self):
+        """Do filters differing only in whitespace match the same listings
+        and share a cache entry?"""
+
+        facet_cache.clear()
+        resp = self.client.get('/listings/facets?location=%20test%20')
+        self.assertEqual(resp.json["total"], 5)
+
+        db.session.remove()
+        with assert_max_queries(1, "cached GET /listings/facets"):
+            resp = self.client.get('/listings/facets?location=test')
+        self.assertEqual(resp.json["total"], 5)
+
+        resp = self.client.get('/listings?location=%20test%20')
+        self.assertEqual(len(resp.json), 5)
+
+    def test_send_quotes(self):
+        """Does POST /quotes price every listing for every stay?"""
+
+        listing = Listing.query.filter_by(title="test1").one()
+        db.session.add(PriceRule(listing_id=listing.id, name="weekend",
+                                 nightly_price="100.00",
+                                 weekdays=1 << 4 | 1 << 5))
+        db.session.commit()
+
+        resp = self.client.post('/quotes', json={
+            "listing_ids": [listing.id, 999999],
+            "stays": [{"start": "2021-11-04", "end": "2021-11-08"},
+                      {"start": "2021-11-01", "end": "2021-11-02"}]})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, [{
+            "listing_id": listing.id,
+            "quotes": [
+                {"start": "2021-11-04", "end": "2021-11-08", "nights": 4,
+                 "total_price": "302.00"},
+                {"start": "2021-11-01", "end": "2021-11-02", "nights": 1,
+                 "total_price": "51.00"},
+            ]}])
+
+        resp = self.client.post('/quotes', json={"listing_ids": [1],
+                                                 "stays": []})
+        self.assertEqual(resp.status_code, 400)
+
+        for stay in ({"start": None, "end": "2021-11-02"},
+                     {"start": 20211101, "end": 20211102}):
+            resp = self.client.post('/quotes', json={
+                "listing_ids": [listing.id], "stays": [stay]})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_add_price_rule(self):
+        """Does POST /listings/<id>/price-rules add the owner's rule and
+        reject priorities that aren't an INTEGER?"""
+
+        listing = Listing.query.filter_by(title="test1").one()
+        with app.app_context():
+            token = token_auth.create_token(listing.listing_owner)
+        headers = {"Authorization": f"Bearer {token}"}
+        url = f'/listings/{listing.id}/price-rules'
+
+        resp = self.client.post(url, headers=headers, json={
+            "name": "weekend", "nightly_price": "150.00",
+            "weekdays": ["fri", "sat"], "priority": "2"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json["priority"], 2)
+
+        for priority in (float("inf"), 2 ** 31, 1.5, True, "high"):
+            resp = self.client.post(url, headers=headers, json={
+                "name": "bad", "nightly_price": "1.00",
+                "priority": priority})
+            self.assertEqual(resp.status_code, 400, priority)
+        self.assertEqual(
+            PriceRule.query.filter_by(listing_id=listing.id).count(), 1)
+
+    def test_add_listing(self):
+        """Does POST /listings/new add the listing and its photo in one
+        transaction and return it as stored?"""
+
+        db.session.remove()
+        with assert_max_queries(4, "POST /listings/new"):
+            resp = self.client.post('/listings/new', data={
+                "title": "new", "price": "120", "description": "test",
+                "location": "test", "username": "testuser1"})
+
+        self.assertEqual(resp.status_code, 200)
+        listing = Listing.query.get(resp.json["id"])
+        self.assertEqual(resp.json, listing.serialize())
+        self.assertEqual(resp.json["price"], "120.00")
+        self.assertEqual(len(resp.json["photos"]), 1)
+
+        resp = self.client.post('/listings/new', data={
+            "title": "new", "price": "free", "description": "test",
+            "location": "test", "username": "testuser1"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_add_listing_invalid(self):
+        """Does POST /listings/new check every field and photo before
+        spooling anything, and drop spooled photos if the insert fails?"""
+
+        self.addCleanup(app.config.__setitem__, 'UPLOAD_SPOOL_DIR',
+                        app.config['UPLOAD_SPOOL_DIR'])
+        app.config['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp()
+
+        def post(photo=(b"meow", "image/jpeg"), **fields):
+            data = {"title": "new", "price": "120", "description": "test",
+                    "location": "test", "username": "testuser1",
+                    "photo": (BytesIO(photo[0]), "cat.jpg", photo[1])}
+            data.update(fields)
+            return self.client.post('/listings/new', data=data)
+
+        with patch.object(aws, "MAX_UPLOAD_BYTES", 4):
+            self.assertEqual(post(title="").status_code, 400)
+            self.assertEqual(post(photo=(b"meow", "text/html")).status_code,
+                             400)
+            self.assertEqual(post(photo=(b"meow!", "image/jpeg")).status_code,
+                             400)
+            self.assertEqual(os.listdir(app.config['UPLOAD_SPOOL_DIR']), [])
+
+            resp = post(username="nobody")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(os.listdir(app.config['UPLOAD_SPOOL_DIR']), [])
+        self.assertEqual(Listing.query.filter_by(title="new").count(), 0)
+
+    def test_add_listing_photos(self):
+        """Does POST /listings/new take several photos, add a pending row
+        for each and point every row at its upload?"""
+
+        uploaded = []
+
+        def fake_upload(fileobj, filename, content_type):
+            uploaded.append(filename)
+            return f"http://s3.test/{filename}"
+
+        upload_fn = upload_queue.upload_fn
+        upload_queue.upload_fn = fake_upload
+        app.config['UPLOAD_SYNC'] = True
+        try:
+            resp = self.client.post('/listings/new', data={
+                "title": "new", "price": "120", "description": "test",
+                "location": "test", "username": "testuser1",
+                "photo": [(BytesIO(b"meow"), f"cat{i}.jpg", "image/jpeg")
+                          for i in range(3)]})
+        finally:
+            upload_queue.upload_fn = upload_fn
+            app.config['UPLOAD_SYNC'] = False
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json["photos"]), 3)
+        self.assertEqual(uploaded[0], "cat0.jpg")
+
+        photos = Listing.query.get(resp.json["id"]).photos
+        self.assertEqual([photo.image_url for photo in photos],
+                         [f"http://s3.test/cat{i}.jpg" for i in range(3)])
+        self.assertEqual({photo.upload_status for photo in photos}, {"done"})
+
+    def test_resume_uploads(self):
+        """Does resume_uploads finish pending uploads whose spooled file
+        survived a restart, fail the rest and delete stray files?"""
+
+        self.addCleanup(app.config.__setitem__, 'UPLOAD_SPOOL_DIR',
+                        app.config['UPLOAD_SPOOL_DIR'])
+        app.config['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp()
+        kept, lost, stray = [upload_queue.spool(FileStorage(
+            BytesIO(b"meow"), f"{name}.jpg", content_type="image/jpeg"))
+            for name in ("kept", "lost", "stray")]
+        os.remove(lost.path)
+
+        photos = Listing.query.filter_by(title="test0").one().photos
+        for photo, spooled in zip(photos, (kept, lost)):
+            photo.upload_status = 'pending'
+            photo.upload_spool = spooled.name
+        db.session.commit()
+        photo_ids = [photo.id for photo in photos]
+
+        upload_fn = upload_queue.upload_fn
+        upload_queue.upload_fn = (
+            lambda fileobj, filename, content_type:
+            f"http://s3.test/{filename}")
+        app.config['UPLOAD_SYNC'] = True
+        try:
+            self.assertEqual(resume_uploads(), (1, 1))
+        finally:
+            upload_queue.upload_fn = upload_fn
+            app.config['UPLOAD_SYNC'] = False
+
+        kept_photo, lost_photo = [Listing_Photo.query.get(photo_id)
+                                  for photo_id in photo_ids]
+        self.assertEqual((kept_photo.upload_status, kept_photo.image_url),
+                         ("done", "http://s3.test/kept.jpg"))
+        self.assertEqual(lost_photo.upload_status, "failed")
+        self.assertIsNone(lost_photo.upload_spool)
+        self.assertEqual(os.listdir(app.config['UPLOAD_SPOOL_DIR']), [])
+        self.assertIsNone(upload_queue.load(stray.name))
+
+    def test_add_listings_bulk(self):
+        """Does POST /listings/bulk add every listing with its photos, in
+        the order given, and nothing if one is invalid?"""
+
+        with app.app_context():
+            token = token_auth.create_token("testuser1")
+        headers = {"Authorization": f"Bearer {token}"}
+        listings = [{"title": f"bulk{i}", "price": f"{100 + i}.5",
+                     "description": "test", "location": "bulk",
+                     "latitude": 37.79, "longitude": -122.40,
+                     "photos": [f"bulk{i}-{j}.jpg" for j in range(i)]}
+                    for i in range(3)]
+
+        resp = self.client.post('/listings/bulk', json={"listings": listings},
+                                headers=headers)
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual([listing["title"] for listing in resp.json],
+                         ["bulk0", "bulk1", "bulk2"])
+        self.assertEqual(resp.json[1]["price"], "101.50")
+        for created in resp.json:
+            listing = Listing.query.get(created["id"])
+            self.assertEqual(created, listing.serialize())
+            self.assertEqual(listing.listing_owner, "testuser1")
+            self.assertEqual(len(listing.geohash), 9)
+        self.assertEqual([photo["image_url"]
+                          for photo in resp.json[2]["photos"]],
+                         ["bulk2-0.jpg", "bulk2-1.jpg"])
+
+        listings[1]["price"] = "-1"
+        resp = self.client.post('/listings/bulk', json={"listings": listings},
+                                headers=headers)
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(resp.json["error"].startswith("listings[1]: "))
+        self.assertEqual(Listing.query.filter_by(location="bulk").count(), 3)
+
+        resp = self.client.post('/listings/bulk', json={"listings": listings})
+        self.assertEqual(resp.status_code, 401)
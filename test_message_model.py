@@ -4,15 +4,20 @@
 
 # import os --> for heroku later
 from unittest import TestCase
-from models import db, User, Message
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from models import db, User, Message, ConversationSummary
+from auth import token_auth
+from broker import message_broker
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
 # before we import our app, since that will have already
 # connected to the database
 
-from app import app
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sharebnb-test'
+from app import create_app
+
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -27,6 +32,13 @@ class MessageModelTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        ConversationSummary.query.delete()
         User.query.delete()
         Message.query.delete()
 
@@ -77,3 +89,104 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(len(self.user2.messages_received), 1)
         self.assertIsInstance(message2, Message)
         self.assertEqual(message2.text, "test2")
+
+    def test_thread(self):
+        """Does paging a thread return both directions, newest first?"""
+
+        start = datetime(2021, 10, 1)
+        for i in range(6):
+            sender, recipient = ((self.user1, self.user2) if i % 2
+                                 else (self.user2, self.user1))
+            db.session.add(Message(text=f"msg{i}",
+                                   timestamp=start + timedelta(minutes=i),
+                                   to_user_name=recipient.username,
+                                   from_user_name=sender.username))
+        db.session.commit()
+
+        texts = []
+        cursor = None
+        while True:
+            messages, cursor = Message.thread(self.user1.username,
+                                              self.user2.username,
+                                              cursor=cursor, limit=3)
+            texts.extend(message.text for message in messages)
+            if cursor is None:
+                break
+            cursor = [cursor[0].isoformat(), cursor[1]]
+
+        # message1 from setUp is the newest
+        self.assertEqual(texts, ["test", "msg5", "msg4", "msg3", "msg2",
+                                 "msg1", "msg0"])
+
+    def test_inbox(self):
+        """Does the inbox only hold messages received?"""
+
+        messages, cursor = Message.inbox(self.user2.username)
+
+        self.assertEqual(messages, [])
+        self.assertIsNone(cursor)
+        self.assertEqual(len(Message.inbox(self.user1.username)[0]), 1)
+
+    def test_conversation_summary(self):
+        """Are summaries updated with each message?"""
+
+        for text in ("hi", "there"):
+            db.session.add(Message(text=text,
+                                   to_user_name=self.user1.username,
+                                   from_user_name=self.user2.username))
+            db.session.commit()
+
+        last = Message.query.filter_by(text="there").one()
+        inbox = ConversationSummary.query.get((self.user1.username,
+                                               self.user2.username))
+        sent = ConversationSummary.query.get((self.user2.username,
+                                              self.user1.username))
+
+        self.assertEqual(inbox.unread_count, 3)
+        self.assertEqual(inbox.last_message_id, last.id)
+        self.assertEqual(sent.unread_count, 0)
+        self.assertEqual(sent.last_message_id, last.id)
+
+    def test_stream_replay(self):
+        """Does a reconnecting stream get the messages after Last-Event-ID
+        first, each once, and a reset if it missed too many?"""
+
+        db.session.add(Message(text="while away",
+                               to_user_name=self.user1.username,
+                               from_user_name=self.user2.username))
+        db.session.commit()
+        token = token_auth.create_token(self.user1.username)
+
+        def first_events(count):
+            resp = self.client.get(
+                f'/messages/stream?token={token}', buffered=False,
+                headers={"Last-Event-ID": str(self.message1.id)})
+            chunks = resp.response
+            events = [next(chunks) for _ in range(count)]
+            resp.close()
+            return [event if isinstance(event, str) else event.decode()
+                    for event in events]
+
+        retry, replayed = first_events(2)
+        self.assertEqual(retry, "retry: 3000\n\n")
+        self.assertIn("while away", replayed)
+
+        queue_size = app.config['MESSAGE_STREAM_QUEUE_SIZE']
+        self.addCleanup(app.config.__setitem__, 'MESSAGE_STREAM_QUEUE_SIZE',
+                        queue_size)
+        app.config['MESSAGE_STREAM_QUEUE_SIZE'] = 0
+        self.assertEqual(first_events(2)[1], "event: reset\ndata: {}\n\n")
+
+        subscribers = message_broker.subscriber_count()
+        for last_id in ("latest", "\u00b2", str(2 ** 31)):
+            resp = self.client.get(f'/messages/stream?token={token}',
+                                   headers={"Last-Event-ID": last_id})
+            self.assertEqual(resp.status_code, 400, last_id)
+
+        # a failed replay lookup doesn't leave the subscription behind
+        with patch.object(Message, "since", side_effect=RuntimeError):
+            resp = self.client.get(
+                f'/messages/stream?token={token}',
+                headers={"Last-Event-ID": str(self.message1.id)})
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(message_broker.subscriber_count(), subscribers)
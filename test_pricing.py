@@ -0,0 +1,65 @@
+"""Pricing engine tests"""
+
+# run tests: python -m unittest test_pricing.py
+
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import TestCase
+from pricing import quote
+
+FRI_SAT = 1 << 4 | 1 << 5
+
+
+def rule(id, listing_id, price, start=None, end=None, weekdays=None,
+         priority=0):
+    return SimpleNamespace(id=id, listing_id=listing_id,
+                           nightly_price=Decimal(price), start_date=start,
+                           end_date=end, weekdays=weekdays, priority=priority)
+
+
+class QuoteTestCase(TestCase):
+    """Test vectorized stay pricing."""
+
+    def test_base_price(self):
+        """Without rules is a stay nights x base price?"""
+
+        ids, totals = quote({1: Decimal("100.00"), 2: Decimal("49.99")}, [],
+                            [(date(2021, 11, 1), date(2021, 11, 4)),
+                             (date(2021, 11, 2), date(2021, 11, 3))])
+
+        self.assertEqual(ids, [1, 2])
+        self.assertEqual(totals.tolist(), [[30000, 10000], [14997, 4999]])
+
+    def test_weekend_and_season(self):
+        """Do weekend and seasonal rules price only their nights, the
+        higher priority rule winning?"""
+
+        # Thu 4 Nov to Mon 8 Nov 2021: Thu, Fri, Sat, Sun nights
+        stay = (date(2021, 11, 4), date(2021, 11, 8))
+        rules = [
+            rule(1, 1, "150.00", weekdays=FRI_SAT),
+            rule(2, 1, "80.00", start=date(2021, 11, 1),
+                 end=date(2021, 12, 1)),
+            rule(3, 1, "200.00", start=date(2021, 11, 6),
+                 end=date(2021, 11, 7), priority=1),
+            # another listing's rule changes nothing here
+            rule(4, 2, "1.00"),
+        ]
+
+        _, totals = quote({1: Decimal("100.00")}, rules, [stay])
+
+        # newest rule wins ties: season (80) over weekend (150) on Fri,
+        # the priority 1 rule (200) on Sat
+        self.assertEqual(totals.tolist(), [[8000 + 8000 + 20000 + 8000]])
+
+    def test_rules_outside_stays(self):
+        """Are rules that end before or start after every stay ignored?"""
+
+        rules = [rule(1, 1, "1.00", end=date(2021, 1, 1)),
+                 rule(2, 1, "1.00", start=date(2022, 1, 1))]
+
+        _, totals = quote({1: Decimal("10.00")}, rules,
+                          [(date(2021, 6, 1), date(2021, 6, 3))])
+
+        self.assertEqual(totals.tolist(), [[2000]])
@@ -0,0 +1,140 @@
+"""Upload queue tests"""
+
+# run tests: python -m unittest test_upload_queue.py
+
+import io
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+from upload_queue import UploadQueue
+
+
+class FakeS3:
+    """local stand-in for the s3 upload function"""
+
+    def __init__(self, fail=False):
+        self.objects = {}
+        self.fail = fail
+
+    def upload(self, fileobj, filename, content_type):
+        if self.fail:
+            raise IOError("s3 is down")
+        self.objects[filename] = (fileobj.read(), content_type)
+        return f"http://s3.test/{filename}"
+
+
+class UploadQueueTestCase(TestCase):
+    """Test the background upload queue."""
+
+    def setUp(self):
+        """Create an app with a queue backed by the fake s3."""
+
+        self.app = Flask(__name__)
+        self.app.config['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp()
+        self.s3 = FakeS3()
+        self.queue = UploadQueue(self.app, upload_fn=self.s3.upload)
+        self.results = []
+
+    def record(self, url, variants):
+        self.results.append((url, variants))
+
+    def make_file(self, name="cat.jpg"):
+        return FileStorage(stream=io.BytesIO(b"meow"), filename=name,
+                           content_type="image/jpeg")
+
+    def test_enqueue(self):
+        """Are spooled files uploaded by the workers and called back?"""
+
+        for i in range(10):
+            spooled = self.queue.spool(self.make_file(f"cat{i}.jpg"))
+            self.queue.enqueue(spooled, self.record)
+        self.queue.join()
+
+        self.assertEqual(len(self.s3.objects), 10)
+        self.assertEqual(self.s3.objects["cat0.jpg"], (b"meow", "image/jpeg"))
+        self.assertIn(("http://s3.test/cat9.jpg", {}), self.results)
+
+        stats = self.queue.stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["completed"], 10)
+        self.assertIn("p95", stats["latency_ms"])
+
+    def test_enqueue_many(self):
+        """Are grouped files uploaded in parallel, with one callback for
+        all of them in the order given?"""
+
+        in_flight = []
+        most = []
+        lock = threading.Lock()
+
+        def slow_upload(fileobj, filename, content_type):
+            with lock:
+                in_flight.append(filename)
+                most.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(filename)
+            return self.s3.upload(fileobj, filename, content_type)
+
+        self.queue.upload_fn = slow_upload
+        spooled = [self.queue.spool(self.make_file(f"cat{i}.jpg"))
+                   for i in range(6)]
+        self.queue.enqueue_many(spooled, self.results.append)
+        self.queue.join()
+
+        self.assertEqual(self.results, [[
+            (f"http://s3.test/cat{i}.jpg", {}) for i in range(6)]])
+        self.assertEqual(max(most), self.app.config['UPLOAD_WORKERS'])
+
+    def test_derive(self):
+        """Are derived variants uploaded and passed to the callback?"""
+
+        self.app.config['UPLOAD_SYNC'] = True
+
+        def derive(data):
+            return {"thumb_url": (data[:2], "image/jpeg")}
+
+        self.queue.enqueue(self.queue.spool(self.make_file()), self.record,
+                           derive=derive)
+
+        self.assertEqual(self.results, [("http://s3.test/cat.jpg",
+                                          {"thumb_url":
+                                           "http://s3.test/cat_thumb.jpeg"})])
+        self.assertEqual(self.s3.objects["cat_thumb.jpeg"],
+                         (b"me", "image/jpeg"))
+
+    def test_failed_upload(self):
+        """Does a failed upload call back with None?"""
+
+        self.s3.fail = True
+        self.app.config['UPLOAD_SYNC'] = True
+
+        self.queue.enqueue(self.queue.spool(self.make_file()), self.record)
+
+        self.assertEqual(self.results, [(None, {})])
+        self.assertEqual(self.queue.stats()["failed"], 1)
+
+    def test_per_app(self):
+        """Does each app get its own queue and spool dir when the queue is
+        shared, as the module-level one is across create_app calls?"""
+
+        shared = UploadQueue(upload_fn=self.s3.upload)
+        apps = []
+        for _ in range(2):
+            app = Flask(__name__)
+            app.config['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp()
+            app.config['UPLOAD_SYNC'] = True
+            shared.init_app(app)
+            apps.append(app)
+
+        with apps[0].app_context():
+            spooled = shared.spool(self.make_file())
+            self.assertTrue(spooled.path.startswith(
+                apps[0].config['UPLOAD_SPOOL_DIR']))
+            shared.enqueue(spooled, self.record)
+            self.assertEqual(shared.stats()["completed"], 1)
+        with apps[1].app_context():
+            self.assertEqual(shared.stats()["completed"], 0)
@@ -0,0 +1,155 @@
+"""Presigned upload routes tests"""
+
+# run tests: python -m unittest test_upload_routes.py
+
+from unittest import TestCase
+from unittest.mock import patch
+import aws
+from auth import token_auth
+from models import db, User, Booking, Listing, Listing_Photo, PriceRule
+
+from app import create_app
+
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
+
+db.create_all()
+
+
+class UploadRoutesTestCase(TestCase):
+    """Test presign and confirm endpoints, with s3 stubbed out."""
+
+    def setUp(self):
+        """Create two users, a listing for the first, and stub aws."""
+
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Listing_Photo.query.delete()
+        PriceRule.query.delete()
+        Booking.query.delete()
+        Listing.query.delete()
+        User.query.delete()
+
+        for name in ("owner", "other"):
+            db.session.add(User(email=f"{name}@test.com", username=name,
+                                password="TEST_PASSWORD"))
+        listing = Listing(price="50.00", title="test", description="test",
+                          location="test", listing_owner="owner")
+        db.session.add(listing)
+        db.session.commit()
+        self.listing_id = listing.id
+
+        self.head = (1024, "image/jpeg")
+        stubs = {
+            "presigned_post_s3": lambda key, content_type: {
+                "url": "http://s3.test/", "fields": {"key": key}},
+            "head_object_s3": lambda key: self.head,
+            "object_url_s3": lambda key: f"http://s3.test/{key}",
+        }
+        for name, stub in stubs.items():
+            patcher = patch.object(aws, name, stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """clean up any fouled transaction"""
+        db.session.rollback()
+
+    def headers(self, username):
+        with app.app_context():
+            token = token_auth.create_token(username)
+        return {"Authorization": f"Bearer {token}"}
+
+    def presign(self, target, target_id, username=None,
+                content_type="image/jpeg"):
+        return self.client.post(
+            '/uploads/presign',
+            json={"target": target, "id": target_id,
+                  "filename": "cat.jpg", "content_type": content_type},
+            headers=self.headers(username) if username else {})
+
+    def test_presign(self):
+        """Is a presigned post only handed to the listing owner or the
+        user themselves?"""
+
+        self.assertEqual(self.presign("listing", self.listing_id).status_code,
+                         401)
+        self.assertEqual(
+            self.presign("listing", self.listing_id, "other").status_code, 403)
+        self.assertEqual(self.presign("user", "owner", "other").status_code,
+                         403)
+        self.assertEqual(
+            self.presign("listing", self.listing_id, "owner",
+                         content_type="text/html").status_code, 400)
+
+        resp = self.presign("listing", self.listing_id, "owner")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json["key"].startswith(
+            f"uploads/listings/{self.listing_id}/"))
+
+        resp = self.presign("user", "owner", "owner")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_confirm_listing_photo(self):
+        """Can only the owner attach an accepted upload to a listing?"""
+
+        url = f'/listings/{self.listing_id}/photos'
+        key = f"uploads/listings/{self.listing_id}/abc_cat.jpg"
+
+        resp = self.client.post(url, json={"key": key})
+        self.assertEqual(resp.status_code, 401)
+
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("other"))
+        self.assertEqual(resp.status_code, 403)
+
+        self.head = (aws.MAX_UPLOAD_BYTES + 1, "image/jpeg")
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 400)
+
+        self.head = (1024, "text/html")
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 400)
+
+        self.head = (1024, "image/jpeg")
+        resp = self.client.post(
+            url, json={"key": "uploads/listings/999999/abc_cat.jpg"},
+            headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json["image_url"], f"http://s3.test/{key}")
+
+    def test_confirm_user_photo(self):
+        """Can only the user themselves set their profile photo?"""
+
+        url = '/users/owner/photo'
+        key = "uploads/users/owner/abc_cat.jpg"
+
+        resp = self.client.post(url, json={"key": key})
+        self.assertEqual(resp.status_code, 401)
+
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("other"))
+        self.assertEqual(resp.status_code, 403)
+
+        self.head = (aws.MAX_UPLOAD_BYTES + 1, "image/jpeg")
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 400)
+
+        self.head = (1024, "image/jpeg")
+        resp = self.client.post(url, json={"key": key},
+                                headers=self.headers("owner"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(User.query.get("owner").image_url,
+                         f"http://s3.test/{key}")
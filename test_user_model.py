@@ -8,6 +8,7 @@ from unittest import TestCase
 import jwt
 from sqlalchemy.exc import IntegrityError
 from models import db, User, Message, Booking, Listing, Listing_Photo
+from auth import token_auth
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -15,9 +16,9 @@ from models import db, User, Message, Booking, Listing, Listing_Photo
 # connected to the database
 # os.environ['DATABASE_URL'] = "postgresql:///sharebnb-test"
 
-from app import app
+from app import create_app
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///sharebnb-test'
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql:///sharebnb-test'})
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +33,12 @@ class UserModelTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        # each test runs in this module's app, so db.session and the
+        # extensions use its config
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
         User.query.delete()
         Message.query.delete()
         Booking.query.delete()
@@ -134,9 +141,52 @@ class UserModelTestCase(TestCase):
     def test_User_get_token(self):
         """tests if token is created and returned"""
 
-        token = User.get_token(username="testuser")
+        with app.app_context():
+            token = User.get_token(username="testuser")
+
+        claims = jwt.decode(token,
+                            app.config['JWT_SECRET_KEY'],
+                            algorithms=["HS256"])
+        self.assertEqual(claims["username"], "testuser")
+        self.assertEqual(claims["type"], "access")
+        self.assertEqual(claims["exp"] - claims["iat"],
+                         app.config['ACCESS_TOKEN_SECONDS'])
+
+    def test_refresh_token_route(self):
+        """Does POST /token/refresh answer a missing or non-string token
+        with a 401 and swap a valid one for new tokens?"""
+
+        for body in ({}, {"refresh_token": []}, {"refresh_token": {}}, []):
+            resp = self.client.post('/token/refresh', json=body)
+            self.assertEqual(resp.status_code, 401, body)
+
+        with app.app_context():
+            token = token_auth.create_token("testuser1", "refresh")
+        resp = self.client.post('/token/refresh',
+                                json={"refresh_token": token})
+        self.assertEqual(resp.status_code, 201)
+        self.assertIn("refresh_token", resp.json)
+
+    def test_User_authenticate_rehash(self):
+        """is a password rehashed on login when the cost changes?"""
+
+        rounds = app.config['BCRYPT_LOG_ROUNDS']
+        try:
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+            User.signup(username="testuser",
+                        email="test@test.com",
+                        password="HASHED_PASSWORD",
+                        image_url="",
+                        bio="hello",
+                        location="Norway")
+            db.session.commit()
+
+            app.config['BCRYPT_LOG_ROUNDS'] = 5
+            user = User.authenticate(username="testuser",
+                                     password="HASHED_PASSWORD")
 
-        self.assertEqual(jwt.decode(token,
-                                    "meow",
-                                    algorithms=["HS256"])["username"],
-                                    "testuser")
+            self.assertTrue(user.password.startswith("$2b$05$"))
+            self.assertTrue(User.authenticate(username="testuser",
+                                              password="HASHED_PASSWORD"))
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = rounds
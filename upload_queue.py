@@ -0,0 +1,302 @@
+"""Background S3 upload queue
+
+Requests spool the uploaded file to local disk and return right away; a
+pool of worker threads uploads it to S3 and then calls back (inside an app
+context) so the pending row can be pointed at its final url.
+
+    upload_queue = UploadQueue()
+    upload_queue.init_app(app)
+
+    spooled = upload_queue.spool(request.files["photo"])
+    ... commit row with upload_status="pending" ...
+    upload_queue.enqueue(spooled, partial(finish_upload, Listing_Photo, id),
+                         derive=image_pipeline.derive)
+
+Several files (e.g. all the photos of a new listing) can be enqueued as a
+group with enqueue_many: they are uploaded in parallel by the workers and
+the callback runs once, when the last one is done, so every row can be
+updated in one transaction.
+
+Uploads still queued when the process stops are lost, but their files stay
+in the spool dir: store spooled.name on the pending row, and on the next
+start load(name) gives the upload back to enqueue again.
+"""
+
+import io
+import json
+import logging
+import os
+import queue
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from functools import partial
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# how many recent upload durations to keep for latency stats
+LATENCY_WINDOW = 1000
+# a spooled file's filename and content type are kept in <file>.json
+META_SUFFIX = ".json"
+
+
+def _upload_to_s3(fileobj, filename, content_type):
+    # imported here so the queue can be used (and tested) without AWS
+    # credentials when a different upload_fn is given
+    from aws import upload_fileobj_s3
+    return upload_fileobj_s3(fileobj, filename, content_type)
+
+
+class SpooledUpload:
+    """An uploaded file saved to local disk, waiting for a worker"""
+
+    def __init__(self, path, filename, content_type):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+
+    @property
+    def name(self):
+        """What to store on the pending row to find the file again after a
+        restart (see UploadQueue.load)"""
+        return os.path.basename(self.path)
+
+
+class _QueueState:
+    """One app's jobs, workers and stats"""
+
+    def __init__(self, app):
+        self.app = app
+        self.jobs = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.completed = 0
+        self.failed = 0
+
+
+class UploadQueue:
+    """Job queue plus a lazily started pool of upload worker threads
+
+    Each app gets its own queue and workers (kept in app.extensions), so
+    several apps in one process don't share uploads or callbacks.
+
+    config:
+    UPLOAD_SPOOL_DIR: where files wait for upload
+    UPLOAD_WORKERS: number of worker threads
+    UPLOAD_SYNC: upload inline in the request (tests, debugging)
+    """
+
+    def __init__(self, app=None, upload_fn=_upload_to_s3):
+        self.upload_fn = upload_fn
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('UPLOAD_SPOOL_DIR', os.path.join(
+            tempfile.gettempdir(), 'sharebnb-uploads'))
+        app.config.setdefault('UPLOAD_WORKERS', 4)
+        app.config.setdefault('UPLOAD_SYNC', False)
+        app.extensions['upload_queue'] = _QueueState(app)
+
+    def _state(self):
+        """State of the app this queue was created with, else of the
+        current app"""
+
+        app = self.app if self.app is not None else current_app
+        return app.extensions['upload_queue']
+
+    def spool(self, file):
+        """Save a werkzeug FileStorage to the spool dir, with its filename
+        and content type next to it so a restart can resume the upload"""
+
+        spool_dir = self._state().app.config['UPLOAD_SPOOL_DIR']
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, uuid.uuid4().hex)
+        file.save(path)
+        with open(path + META_SUFFIX, 'w') as meta:
+            json.dump({"filename": file.filename,
+                       "content_type": file.content_type}, meta)
+        return SpooledUpload(path, file.filename, file.content_type)
+
+    def load(self, name):
+        """The spooled upload saved under `name` (SpooledUpload.name), or
+        None if it is gone"""
+
+        path = os.path.join(self._state().app.config['UPLOAD_SPOOL_DIR'],
+                            os.path.basename(name))
+        try:
+            with open(path + META_SUFFIX) as meta:
+                info = json.load(meta)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        return SpooledUpload(path, info["filename"], info["content_type"])
+
+    def sweep(self, keep):
+        """Delete every spooled file whose name isn't in `keep`, e.g. ones
+        left behind when a request failed after spooling"""
+
+        spool_dir = self._state().app.config['UPLOAD_SPOOL_DIR']
+        if not os.path.isdir(spool_dir):
+            return
+        for filename in os.listdir(spool_dir):
+            name = filename[:-len(META_SUFFIX)] \
+                if filename.endswith(META_SUFFIX) else filename
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(spool_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, spooled):
+        """Drop a spooled file that will never be uploaded"""
+
+        for path in (spooled.path, spooled.path + META_SUFFIX):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def enqueue(self, spooled, callback, derive=None):
+        """Upload `spooled` in the background, then call
+        callback(url, variants) in an app context (url is None if the
+        upload failed).
+
+        derive(data), if given, returns {name: (bytes, content type)} of
+        extra files made from the upload (e.g. thumbnails); they are
+        uploaded too and their urls passed to the callback as
+        {name: url}"""
+
+        state = self._state()
+        job = (spooled, callback, derive)
+        if state.app.config['UPLOAD_SYNC']:
+            self._run(state, job)
+            return
+
+        self._start_workers(state)
+        state.jobs.put(job)
+
+    def enqueue_many(self, spooled_files, callback, derive=None):
+        """Upload several spooled files in the background, one job each so
+        the workers send them in parallel, then call callback(results)
+        once in an app context, with a (url, variants) pair per file in
+        the order given (url is None for failed uploads)"""
+
+        results = [None] * len(spooled_files)
+        remaining = [len(spooled_files)]
+        lock = threading.Lock()
+
+        def done(i, url, variants):
+            results[i] = (url, variants)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback(results)
+
+        for i, spooled in enumerate(spooled_files):
+            self.enqueue(spooled, partial(done, i), derive=derive)
+
+    def join(self):
+        """Block until every queued upload has finished"""
+
+        self._state().jobs.join()
+
+    def stats(self):
+        """Queue depth, totals and recent upload latency in ms"""
+
+        state = self._state()
+        latencies = sorted(state.latencies)
+        latency = {}
+        if latencies:
+            latency = {
+                "avg": round(statistics.mean(latencies), 2),
+                "p50": round(latencies[len(latencies) // 2], 2),
+                "p95": round(latencies[int(len(latencies) * 0.95)], 2),
+                "max": round(latencies[-1], 2),
+            }
+        return {
+            "queue_depth": state.jobs.qsize(),
+            "workers": len(state.workers),
+            "completed": state.completed,
+            "failed": state.failed,
+            "latency_ms": latency,
+        }
+
+    def _upload_variants(self, spooled, derive, data):
+        # a broken variant shouldn't fail the original upload
+        urls = {}
+        try:
+            stem = os.path.splitext(spooled.filename)[0]
+            for name, (blob, content_type) in derive(data).items():
+                # e.g. thumb_webp_url -> cat_thumb_webp.webp
+                label = name[:-len("_url")] if name.endswith("_url") else name
+                extension = content_type.split("/")[-1]
+                urls[name] = self.upload_fn(io.BytesIO(blob),
+                                            f"{stem}_{label}.{extension}",
+                                            content_type)
+        except Exception:
+            logger.exception("Making variants of %s failed",
+                             spooled.filename)
+        return urls
+
+    def _start_workers(self, state):
+        if state.workers:
+            return
+        with state.lock:
+            if state.workers:
+                return
+            for i in range(state.app.config['UPLOAD_WORKERS']):
+                worker = threading.Thread(target=self._work, args=(state,),
+                                          name=f"upload-worker-{i}",
+                                          daemon=True)
+                worker.start()
+                state.workers.append(worker)
+
+    def _work(self, state):
+        while True:
+            job = state.jobs.get()
+            try:
+                self._run(state, job)
+            finally:
+                state.jobs.task_done()
+
+    def _run(self, state, job):
+        spooled, callback, derive = job
+        start = time.perf_counter()
+        url = None
+        variants = {}
+        # derive and the callback look up their app's extensions
+        with state.app.app_context():
+            try:
+                with open(spooled.path, 'rb') as fileobj:
+                    data = fileobj.read()
+                url = self.upload_fn(io.BytesIO(data), spooled.filename,
+                                     spooled.content_type)
+                if derive:
+                    variants = self._upload_variants(spooled, derive, data)
+                with state.lock:
+                    state.completed += 1
+            except Exception:
+                with state.lock:
+                    state.failed += 1
+                logger.exception("Upload of %s failed", spooled.filename)
+            finally:
+                state.latencies.append((time.perf_counter() - start) * 1000)
+                self.discard(spooled)
+
+            try:
+                callback(url, variants)
+            except Exception:
+                logger.exception("Upload callback for %s failed",
+                                 spooled.filename)
+
+
+upload_queue = UploadQueue()
@@ -0,0 +1,8 @@
+"""WSGI entry point
+
+    flask db-upgrade && flask resume-uploads && gunicorn wsgi:app
+"""
+
+from app import create_app
+
+app = create_app()